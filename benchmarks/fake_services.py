@@ -0,0 +1,148 @@
+"""Local stand-ins for the Bitfinex candles endpoint and the InfluxDB write API."""
+import gzip
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bitfinex_extractor_influxdb.resample import TIMEFRAME_MS
+
+CANDLES_PATH = re.compile(r'^/v2/candles/trade:(?P<timeframe>[^:]+):(?P<pair>[^/]+)/hist$')
+
+
+class _Service:
+
+    def __init__(self, handler):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeBitfinex(_Service):
+    """Candles endpoint serving synthetic series from ``since``, in milliseconds, up to now.
+
+    Every response waits ``latency`` seconds, and every ``rate_limit_every`` requests
+    the rate limit error 11010 is answered instead of candles.
+    """
+
+    def __init__(self, since, latency=0.05, rate_limit_every=None):
+        super().__init__(_BitfinexHandler)
+        self.since = since
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.now = int(time.time() * 1000)
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def candles(self, timeframe, start, end, limit):
+        period = TIMEFRAME_MS.get(timeframe, TIMEFRAME_MS['1D'])
+        last = self.now // period * period
+        start = max(start, self.since)
+        start += -start % period
+        end = min(end, last)
+        timestamps = range(start, end + 1, period)[:limit]
+        return [[timestamp, 100.0 + timestamp % 7, 100.5, 101.0 + timestamp % 3, 99.0, 1.5 + timestamp % 11]
+                for timestamp in timestamps]
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every is not None and self.requests % self.rate_limit_every == 0
+            self.rate_limited += limited
+            return limited
+
+
+class _BitfinexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        match = CANDLES_PATH.match(url.path)
+        if match is None:
+            self.send_error(404)
+            return
+        time.sleep(service.latency)
+        if service.count():
+            self._send(429, ['error', 11010, 'ratelimit: error'])
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self._send(200, service.candles(match['timeframe'], int(query.get('start', 0)),
+                                        int(query.get('end', service.now)), int(query.get('limit', 120))))
+
+    def _send(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        compressed = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compressed:
+            content = gzip.compress(content, compresslevel=1)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeInfluxDB(_Service):
+    """InfluxDB write and query endpoints that count the written points and store nothing."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(_InfluxDBHandler)
+        self.latency = latency
+        self.points = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def record(self, body):
+        with self._lock:
+            self.writes += 1
+            self.points += body.count(b'\n') + 1
+
+
+class _InfluxDBHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        path = urlparse(self.path).path
+        if path == '/api/v2/write':
+            time.sleep(service.latency)
+            service.record(body)
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif path == '/api/v2/query':
+            # Empty result: no series stored yet.
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,152 @@
+"""Reproducible benchmarks of DataSync against local fake Bitfinex and InfluxDB services.
+
+Usage: python benchmarks/run.py [scenario ...]
+
+Scenarios: serialization, deep_backfill, many_series, steady_state. All of them run by default.
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timezone
+
+from mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import FakeBitfinex, FakeInfluxDB  # noqa: E402
+from bitfinex_extractor_influxdb import exchange_db_sync, protocol  # noqa: E402
+from bitfinex_extractor_influxdb.exchange_db_sync import DataSync  # noqa: E402
+
+YEAR = datetime.datetime.now(timezone.utc).year
+SINCE = int(datetime.datetime(YEAR, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+PAIRS = ['tBTCUSD', 'tETHUSD', 'tLTCUSD', 'tXRPUSD', 'tIOTUSD', 'tEOSUSD']
+TIMEFRAMES = ['6h', '12h', '1D']
+
+
+@contextmanager
+def data_sync(bitfinex, influxdb, pairs, timeframes, **settings):
+    """Build a DataSync pointed at the fake services, with pairs and timeframes instead of MySQL tables."""
+    environment = {
+        'INFLUX_URL': influxdb.url.rstrip('/'),
+        'INFLUX_TOKEN': 'token',
+        'INFLUX_ORG': 'org',
+        'INFLUX_BUCKET': 'bucket',
+        'STARTING_YEAR': str(YEAR),
+        'REQUEST_DELAY': '1',
+        'REQUESTS_PER_MINUTE': '600000',
+        'REQUEST_BURST': '1000',
+        'RATE_LIMIT_BACKOFF': '0.05',
+        'INFLUX_FLUSH_INTERVAL': '0.05',
+    }
+    environment.update(settings)
+    with patch.dict(os.environ, environment), \
+            patch('pymysql.connect'), \
+            patch.object(DataSync, 'query_pairs', return_value=pairs), \
+            patch.object(DataSync, 'query_timeframes', return_value=timeframes), \
+            patch.object(exchange_db_sync, 'HTTP_API_URL', bitfinex.url + 'v2/'):
+        yield DataSync()
+
+
+@contextmanager
+def measure(results, name):
+    """Record wall time and peak traced memory of the block into results[name]."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    report = {}
+    try:
+        yield report
+    finally:
+        report['seconds'] = time.perf_counter() - start
+        report['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        results[name] = report
+
+
+def serialization(results):
+    pages = 20
+    response = [[SINCE + i * 60000, 100.0 + i % 7, 100.5, 101.0 + i % 3, 99.0, 1.5 + i % 11] for i in range(1000)]
+    for name, serialize in (('serialize_points', protocol.serialize_points),
+                            ('serialize_lines', protocol.serialize_lines)):
+        with measure(results, f'serialization/{name}') as report:
+            for _ in range(pages):
+                serialize('tBTCUSD', '1m', response)
+        report['candles_per_second'] = pages * len(response) / report['seconds']
+
+
+def deep_backfill(results):
+    for windows in ('1', '8'):
+        with FakeBitfinex(SINCE, latency=0.02) as bitfinex, FakeInfluxDB() as influxdb, \
+                data_sync(bitfinex, influxdb, ['tBTCUSD'], ['15m'], BACKFILL_WINDOWS=windows) as sync, \
+                measure(results, f'deep_backfill/windows={windows}') as report:
+            sync.run()
+        report['candles_per_second'] = influxdb.points / report['seconds']
+        report['requests'] = bitfinex.requests
+
+
+def many_series(results):
+    for concurrency in (1, 8):
+        with FakeBitfinex(SINCE, latency=0.02, rate_limit_every=25) as bitfinex, FakeInfluxDB() as influxdb, \
+                data_sync(bitfinex, influxdb, PAIRS, TIMEFRAMES) as sync, \
+                measure(results, f'many_series/concurrency={concurrency}') as report:
+            sync.run_async(max_concurrency=concurrency)
+        report['candles_per_second'] = influxdb.points / report['seconds']
+        report['requests'] = bitfinex.requests
+        report['rate_limited'] = bitfinex.rate_limited
+
+
+def steady_state(results):
+    with tempfile.TemporaryDirectory() as directory, FakeBitfinex(SINCE, latency=0.02) as bitfinex, \
+            FakeInfluxDB() as influxdb, \
+            data_sync(bitfinex, influxdb, PAIRS, TIMEFRAMES,
+                      CHECKPOINT_PATH=os.path.join(directory, 'checkpoints.sqlite')) as sync:
+        sync.run_async(max_concurrency=8)
+        series = [(pair, timeframe) for pair in PAIRS for timeframe in TIMEFRAMES]
+
+        # Extraction started again once every series is up to date, resuming from the checkpoints.
+        requests = bitfinex.requests
+        with measure(results, 'steady_state/resync') as report:
+            sync.run_async(max_concurrency=8)
+        report['series_per_second'] = len(series) / report['seconds']
+        report['requests'] = bitfinex.requests - requests
+
+        # A round of DataSync.poll(), every series requested from its last stored candle.
+        requests = bitfinex.requests
+        with measure(results, 'steady_state/poll') as report, ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda item: sync._poll_series(*item, sync.checkpoints.get(*item)), series))
+        report['series_per_second'] = len(series) / report['seconds']
+        report['requests'] = bitfinex.requests - requests
+
+
+SCENARIOS = {
+    'serialization': serialization,
+    'deep_backfill': deep_backfill,
+    'many_series': many_series,
+    'steady_state': steady_state,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=', '.join(SCENARIOS))
+    arguments = parser.parse_args()
+    unknown = set(arguments.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results = {}
+    for scenario in arguments.scenarios or SCENARIOS:
+        SCENARIOS[scenario](results)
+    for name, report in results.items():
+        print(f'{name:40} ' + '  '.join(f'{key}={value:.2f}' if isinstance(value, float) else f'{key}={value}'
+                                        for key, value in report.items()))
+
+
+if __name__ == "__main__":
+    main()
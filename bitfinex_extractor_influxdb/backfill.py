@@ -0,0 +1,169 @@
+import bisect
+import threading
+
+from bitfinex_extractor_influxdb.resample import TIMEFRAME_MS
+
+
+def plan_windows(start, end, windows, alignment=1):
+    """Split a time range into contiguous windows that can be fetched independently.
+
+    :param start: First timestamp of the range in milliseconds.
+    :type start: int
+    :param end: Last timestamp of the range in milliseconds, included.
+    :type end: int
+    :param windows: Number of windows to split the range into.
+    :type windows: int
+    :param alignment: Every window but the first one starts at a multiple of it, windows left empty are dropped.
+    :type alignment: int
+    :return: (start, end) pairs in milliseconds, both included, covering the range without overlapping.
+    :rtype: list
+    """
+    if end < start:
+        return []
+    windows = max(1, min(int(windows), end - start + 1))
+    step = (end - start + 1) // windows
+    inner = sorted({(start + step * i) // alignment * alignment for i in range(1, windows)})
+    bounds = [start] + [bound for bound in inner if start < bound <= end] + [end + 1]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(len(bounds) - 1)]
+
+
+class Backfill:
+    """Progress of a range of a series extracted in windows, possibly fetched in parallel.
+
+    The fetched and the written parts are recorded apart. Written parts are the candles
+    actually received, from the start of the request to the last one, and are merged when
+    they are less than a candle apart, since nothing can be missing between two
+    consecutive candles.
+
+    :param start: First timestamp of the range in milliseconds.
+    :type start: int
+    :param end: Last timestamp of the range in milliseconds, included.
+    :type end: int
+    :param period: Candle length in milliseconds.
+    :type period: int
+    :param timeframes: Timeframes built from the 1m candles of each window. Windows are then aligned to the
+        longest of them, so every period is built whole from a single window.
+    :type timeframes: list
+    :param checkpoint: Whether the written part moves the checkpoint of the series, not for holes behind it.
+    :type checkpoint: bool
+    """
+
+    def __init__(self, start, end, period=1, timeframes=(), checkpoint=True):
+        self._fetched = Coverage(start, end)
+        self._written = Coverage(start, end, resolution=period)
+        self._timeframes = list(timeframes)
+        self._checkpoint = checkpoint
+
+    @property
+    def fetched(self):
+        return self._fetched
+
+    @property
+    def written(self):
+        return self._written
+
+    @property
+    def timeframes(self):
+        return self._timeframes
+
+    @property
+    def checkpoint(self):
+        return self._checkpoint
+
+    def windows(self, count):
+        """Split the range into ``count`` windows, aligned to the periods of :attr:`timeframes`.
+
+        :rtype: list
+        """
+        alignment = max([TIMEFRAME_MS[timeframe] for timeframe in self._timeframes] + [1])
+        return plan_windows(self._fetched.start, self._fetched.end, count, alignment)
+
+
+class Coverage:
+    """Thread safe record of the parts of a time range that have been processed.
+
+    Intervals are merged as they are added, so the covered prefix of the range, used to
+    resume, and the missing parts can be known at any time. Adding an interval that was
+    already covered is reported, which keeps every candle processed exactly once.
+
+    :param start: First timestamp of the range in milliseconds.
+    :type start: int
+    :param end: Last timestamp of the range in milliseconds, included.
+    :type end: int
+    :param resolution: Intervals up to this far apart are merged, like the timestamps of consecutive candles.
+    :type resolution: int
+    """
+
+    def __init__(self, start, end, resolution=1):
+        self._start = start
+        self._end = end
+        self._resolution = resolution
+        self._intervals = []
+        self._lock = threading.Lock()
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def intervals(self):
+        with self._lock:
+            return list(self._intervals)
+
+    def add(self, start, end):
+        """Mark an interval as covered.
+
+        :return: False if some part of the interval was already covered.
+        :rtype: bool
+        """
+        with self._lock:
+            index = bisect.bisect_left(self._intervals, (start, end))
+            overlaps = (index > 0 and self._intervals[index - 1][1] >= start) or \
+                       (index < len(self._intervals) and self._intervals[index][0] <= end)
+            self._intervals.insert(index, (start, end))
+            self._merge()
+            return not overlaps
+
+    def contiguous_end(self):
+        """Return the last timestamp covered without holes from the start of the range.
+
+        :return: Timestamp in milliseconds, None if the start of the range is not covered yet.
+        :rtype: int
+        """
+        with self._lock:
+            if not self._intervals or self._intervals[0][0] > self._start:
+                return None
+            return min(self._intervals[0][1], self._end)
+
+    def missing(self):
+        """Return the parts of the range not covered yet.
+
+        :return: (start, end) pairs in milliseconds, both included.
+        :rtype: list
+        """
+        with self._lock:
+            missing = []
+            cursor = self._start
+            for start, end in self._intervals:
+                if start > cursor:
+                    missing.append((cursor, min(start - 1, self._end)))
+                cursor = max(cursor, end + 1)
+            if cursor <= self._end:
+                missing.append((cursor, self._end))
+            return missing
+
+    def complete(self):
+        return not self.missing()
+
+    def _merge(self):
+        merged = []
+        for start, end in self._intervals:
+            if merged and start <= merged[-1][1] + self._resolution:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self._intervals = merged
@@ -0,0 +1,162 @@
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from bitfinex_extractor_influxdb.candles import CandleBuffer
+from bitfinex_extractor_influxdb.resample import deduplicate, to_candles
+
+# pyarrow takes a while to import, it is only loaded once a cache is created.
+pa = None
+pq = None
+
+# Columns of a Bitfinex candle, in the order they are received.
+COLUMNS = ('mts', 'open', 'close', 'high', 'low', 'volume')
+
+
+class PageCache:
+    """Local columnar copy of the raw candle pages fetched from Bitfinex.
+
+    Pages are buffered per series and appended as row groups of compressed Parquet files
+    laid out as ``<path>/<pair>/<timeframe>/<part>.parquet``, one part per series and run.
+    The cache can be replayed into InfluxDB without requesting anything to Bitfinex, files
+    are memory-mapped and read one row group at a time so whole histories fit in bounded memory.
+
+    Requires pyarrow.
+
+    :param path: Directory holding the cached series, created if missing.
+    :type path: str
+    :param compression: Parquet compression codec.
+    :type compression: str
+    :param row_group_size: Candles buffered per series before being appended to its file.
+    :type row_group_size: int
+    """
+
+    def __init__(self, path, compression='zstd', row_group_size=50000):
+        _import_pyarrow()
+        self._path = path
+        self._compression = compression
+        self._row_group_size = row_group_size
+        self._schema = pa.schema([(COLUMNS[0], pa.int64())] + [(column, pa.float64()) for column in COLUMNS[1:]])
+        self._buffers = {}
+        self._writers = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def path(self):
+        return self._path
+
+    def append(self, pair, timeframe, response):
+        """Buffer a page of candles, appending the buffer of the series to its file once it is full.
+
+        :param pair: Pair of the series.
+        :type pair: str
+        :param timeframe: Timeframe of the series.
+        :type timeframe: str
+        :param response: Candles as returned by Bitfinex.
+        :type response: list
+        """
+        candles = to_candles(response)
+        if not candles.size:
+            return
+        with self._lock:
+            buffer = self._buffers.setdefault((pair, timeframe), [])
+            buffer.append(candles)
+            if sum(len(page) for page in buffer) >= self._row_group_size:
+                self._flush(pair, timeframe)
+
+    def flush(self):
+        """Append every buffered page to the files.
+        """
+        with self._lock:
+            for pair, timeframe in list(self._buffers):
+                self._flush(pair, timeframe)
+
+    def close(self):
+        """Append every buffered page and close the files, next pages go to new parts.
+        """
+        with self._lock:
+            for pair, timeframe in list(self._buffers):
+                self._flush(pair, timeframe)
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+    def series(self):
+        """Return the cached series.
+
+        :return: (pair, timeframe) tuples.
+        :rtype: list
+        """
+        if not os.path.isdir(self._path):
+            return []
+        return sorted((pair, timeframe) for pair in os.listdir(self._path)
+                      if os.path.isdir(os.path.join(self._path, pair))
+                      for timeframe in os.listdir(os.path.join(self._path, pair)))
+
+    def pages(self, pair, timeframe, size=10000):
+        """Read back the cached candles of a series, in timestamp order.
+
+        Row groups are appended in the order pages were fetched, not in the order of their candles,
+        since backfill windows are fetched in parallel and holes are repaired later. They are read by
+        their first timestamp and merged, and candles are returned once no row group left can hold an
+        earlier one, so only overlapping row groups are held in memory. Candles cached more than once
+        are returned once.
+
+        :param pair: Pair of the series.
+        :type pair: str
+        :param timeframe: Timeframe of the series.
+        :type timeframe: str
+        :param size: Maximum number of candles per page.
+        :type size: int
+        :return: Pages of candles, usable as Bitfinex responses.
+        :rtype: generator(CandleBuffer)
+        """
+        directory = os.path.join(self._path, pair, timeframe)
+        if not os.path.isdir(directory):
+            return
+        files = {name: pq.ParquetFile(os.path.join(directory, name), memory_map=True)
+                 for name in sorted(os.listdir(directory)) if name.endswith('.parquet')}
+        row_groups = sorted((parquet_file.metadata.row_group(index).column(0).statistics.min, name, index)
+                            for name, parquet_file in files.items()
+                            for index in range(parquet_file.metadata.num_row_groups))
+        merged = CandleBuffer()
+        for position, (_, name, index) in enumerate(row_groups):
+            table = files[name].read_row_group(index, columns=list(COLUMNS))
+            merged = merged.merge(CandleBuffer.from_response(
+                np.column_stack([table.column(column).to_numpy().astype(np.float64) for column in COLUMNS])))
+            # Candles before the first one of the next row group are final.
+            ready = len(merged) if position + 1 == len(row_groups) else \
+                int(np.searchsorted(merged.timestamps, row_groups[position + 1][0]))
+            for start in range(0, ready, size):
+                yield CandleBuffer(merged.candles[start:min(start + size, ready)])
+            merged = CandleBuffer(merged.candles[ready:])
+
+    def _flush(self, pair, timeframe):
+        buffer = self._buffers.pop((pair, timeframe), None)
+        if not buffer:
+            return
+        candles = deduplicate(np.concatenate(buffer))
+        columns = [candles[:, 0].astype(np.int64)] + [candles[:, index] for index in range(1, len(COLUMNS))]
+        table = pa.Table.from_arrays([pa.array(column) for column in columns], schema=self._schema)
+        writer = self._writers.get((pair, timeframe))
+        if writer is None:
+            directory = os.path.join(self._path, pair, timeframe)
+            os.makedirs(directory, exist_ok=True)
+            part = f'{int(candles[0, 0])}-{uuid.uuid4().hex}.parquet'
+            writer = pq.ParquetWriter(os.path.join(directory, part), self._schema, compression=self._compression)
+            self._writers[(pair, timeframe)] = writer
+        writer.write_table(table)
+
+
+def _import_pyarrow():
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # pragma: no cover
+            raise ImportError('pyarrow is required to cache candle pages') from None
+        pa, pq = pyarrow, pyarrow.parquet
@@ -0,0 +1,89 @@
+import numpy as np
+
+# One candle in 48 bytes, fields in the order Bitfinex sends them.
+CANDLE_DTYPE = np.dtype([('mts', np.int64), ('open', np.float64), ('close', np.float64), ('high', np.float64),
+                         ('low', np.float64), ('volume', np.float64)])
+
+
+class CandleBuffer:
+    """Compact page of candles sorted by timestamp, one NumPy structured array row per candle.
+
+    Nested lists parsed from a Bitfinex response take several hundred bytes per candle,
+    a buffer takes 48. Buffers convert to a float64 array laid out as a Bitfinex response,
+    so they can be used anywhere a response is expected, serialization included.
+
+    :param candles: Structured array of :data:`CANDLE_DTYPE`, sorted by timestamp without duplicates.
+    :type candles: :class:`numpy.ndarray`
+    """
+
+    __slots__ = ('_candles',)
+
+    def __init__(self, candles=None):
+        self._candles = np.empty(0, dtype=CANDLE_DTYPE) if candles is None else candles
+
+    @classmethod
+    def from_response(cls, response):
+        """Build a buffer from candles as returned by Bitfinex, sorting them and keeping the last row per timestamp.
+
+        :param response: Candles as returned by Bitfinex.
+        :type response: list
+        :rtype: CandleBuffer
+        """
+        rows = np.asarray(response, dtype=np.float64).reshape(-1, len(CANDLE_DTYPE.names))
+        candles = np.empty(len(rows), dtype=CANDLE_DTYPE)
+        for index, name in enumerate(CANDLE_DTYPE.names):
+            candles[name] = rows[:, index]
+        return cls(_deduplicate(candles))
+
+    @property
+    def candles(self):
+        return self._candles
+
+    @property
+    def timestamps(self):
+        return self._candles['mts']
+
+    @property
+    def last_timestamp(self):
+        """Timestamp in milliseconds of the last candle, None when empty."""
+        return int(self._candles['mts'][-1]) if len(self._candles) else None
+
+    def __len__(self):
+        return len(self._candles)
+
+    def __array__(self, dtype=None, copy=None):
+        rows = np.column_stack([self._candles[name] for name in CANDLE_DTYPE.names]) if len(self._candles) \
+            else np.empty((0, len(CANDLE_DTYPE.names)))
+        return rows if dtype is None else rows.astype(dtype, copy=False)
+
+    def merge(self, other):
+        """Return the candles of both buffers in order, those of ``other`` replacing the ones with the same timestamp.
+
+        :param other: Buffer with later versions of the candles, like the next page of the series.
+        :type other: CandleBuffer
+        :rtype: CandleBuffer
+        """
+        return CandleBuffer(_deduplicate(np.concatenate([self._candles, other.candles])))
+
+    def difference(self, other):
+        """Return the candles missing from ``other`` or different from their version in it.
+
+        Consecutive pages overlap in one candle, this drops it when it did not change.
+
+        :param other: Buffer already written. Optional.
+        :type other: CandleBuffer
+        :rtype: CandleBuffer
+        """
+        if other is None or len(other) == 0 or len(self) == 0:
+            return self
+        positions = np.minimum(np.searchsorted(other.timestamps, self.timestamps), len(other) - 1)
+        unchanged = other.candles[positions] == self._candles
+        return CandleBuffer(self._candles[~unchanged])
+
+
+def _deduplicate(candles):
+    if candles.size == 0:
+        return candles
+    candles = candles[np.argsort(candles['mts'], kind='stable')]
+    keep = np.append(candles['mts'][1:] != candles['mts'][:-1], True)
+    return candles[keep]
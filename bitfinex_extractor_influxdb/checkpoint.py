@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+
+class CheckpointStore:
+    """Local persistent record of the sync progress of every series.
+
+    The timestamp of the last candle written into InfluxDB is stored per pair and
+    timeframe in a SQLite file, so an extraction can resume right away after a restart
+    or a crash without asking InfluxDB where each series ended.
+    Ranges fetched whole while repairing holes are recorded too, so holes Bitfinex has no
+    candles for are not requested again.
+
+    :param path: SQLite database file, created if it does not exist.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL;')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS checkpoint ('
+                                     'pair TEXT NOT NULL, '
+                                     'timeframe TEXT NOT NULL, '
+                                     'timestamp INTEGER NOT NULL, '
+                                     'PRIMARY KEY (pair, timeframe));')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS checked_range ('
+                                     'pair TEXT NOT NULL, '
+                                     'timeframe TEXT NOT NULL, '
+                                     'start INTEGER NOT NULL, '
+                                     'end INTEGER NOT NULL, '
+                                     'PRIMARY KEY (pair, timeframe, start, end));')
+
+    @property
+    def path(self):
+        return self._path
+
+    def get(self, pair, timeframe):
+        """Return the checkpoint of a series.
+
+        :return: Timestamp in milliseconds of the last written candle, None if the series has no checkpoint.
+        :rtype: int
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT timestamp FROM checkpoint WHERE pair = ? AND timeframe = ?;',
+                                           (pair, timeframe)).fetchone()
+        return row[0] if row else None
+
+    def set(self, pair, timeframe, timestamp):
+        """Record the last written candle of a series. Checkpoints never move backwards.
+
+        :param timestamp: Timestamp in milliseconds of the last written candle.
+        :type timestamp: int
+        """
+        with self._lock:
+            self._connection.execute('INSERT INTO checkpoint (pair, timeframe, timestamp) VALUES (?, ?, ?) '
+                                     'ON CONFLICT (pair, timeframe) '
+                                     'DO UPDATE SET timestamp = MAX(timestamp, excluded.timestamp);',
+                                     (pair, timeframe, int(timestamp)))
+
+    def all(self):
+        """Return the checkpoint of every series.
+
+        :return: Timestamps in milliseconds keyed by (pair, timeframe).
+        :rtype: dict
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT pair, timeframe, timestamp FROM checkpoint;').fetchall()
+        return {(pair, timeframe): timestamp for pair, timeframe, timestamp in rows}
+
+    def add_checked(self, pair, timeframe, start, end):
+        """Record a range of a series fetched whole from Bitfinex, so the holes left in it are known to be empty.
+
+        :param start: First timestamp of the range in milliseconds.
+        :type start: int
+        :param end: Last timestamp of the range in milliseconds, included.
+        :type end: int
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR IGNORE INTO checked_range (pair, timeframe, start, end) '
+                                     'VALUES (?, ?, ?, ?);', (pair, timeframe, int(start), int(end)))
+
+    def checked(self, pair, timeframe):
+        """Return the ranges of a series recorded with :meth:`add_checked`.
+
+        :return: (start, end) pairs in milliseconds, both included, sorted by start.
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT start, end FROM checked_range WHERE pair = ? AND timeframe = ? '
+                                            'ORDER BY start;', (pair, timeframe)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,94 @@
+import argparse
+import logging
+import os
+import sys
+from functools import partial
+
+from dotenv import load_dotenv
+
+LOG_FORMAT = '[%(asctime)-15s] [%(levelname)s] %(name)s: %(message)s'
+
+# Extraction methods of DataSync, by command.
+MODES = {'run': 'run', 'run-async': 'run_async', 'stream': 'stream', 'poll': 'poll', 'repair': 'repair',
+         'replay': 'replay'}
+CONCURRENT_MODES = ('run-async', 'stream', 'poll')
+# Commands each process started by supervise can run.
+SUPERVISED_MODES = ('run', 'run-async', 'stream', 'poll')
+
+
+def configure():
+    """Load the .env file and log to the standard output, as the extractor does when started from the command line.
+    """
+    load_dotenv()
+    logging.basicConfig(format=LOG_FORMAT, level=logging.INFO, stream=sys.stdout)
+
+
+def parser():
+    """Build the command line parser.
+
+    :rtype: :class:`argparse.ArgumentParser`
+    """
+    root = argparse.ArgumentParser(prog='bitfinex-extractor-influxdb',
+                                   description='Extract Bitfinex candles into InfluxDB.')
+    commands = root.add_subparsers(dest='command')
+    for command, method in MODES.items():
+        subparser = commands.add_parser(command, help=f'DataSync().{method}()')
+        if command in CONCURRENT_MODES:
+            subparser.add_argument('--max-concurrency', type=int, default=4, help='series extracted at the same time')
+    supervise = commands.add_parser('supervise', help='run the extraction sharded across local processes')
+    supervise.add_argument('workers', type=int, help='number of processes')
+    supervise.add_argument('--mode', default='run', choices=SUPERVISED_MODES, help='command run by each process')
+    return root
+
+
+def main(argv=None):
+    """Entry point of the ``bitfinex-extractor-influxdb`` command, running ``run`` when no command is given.
+
+    :param argv: Command line arguments, those of the process by default.
+    :type argv: list
+    :return: Exit status.
+    :rtype: int
+    """
+    arguments = parser().parse_args(argv)
+    configure()
+    command = arguments.command or 'run'
+    if command == 'supervise':
+        from bitfinex_extractor_influxdb.exchange_db_sync import mysql_connect
+        from bitfinex_extractor_influxdb.sharding import supervise
+
+        supervise(arguments.workers, partial(work, MODES[arguments.mode]), mysql_connect)
+        return 0
+
+    from bitfinex_extractor_influxdb.exchange_db_sync import DataSync
+
+    method = getattr(DataSync(), MODES[command])
+    if command in CONCURRENT_MODES:
+        method(max_concurrency=arguments.max_concurrency)
+    else:
+        method()
+    return 0
+
+
+def work(mode, worker_id, index=0):
+    """Run the extraction as one of the processes started by ``supervise``.
+
+    Each process serves its metrics on METRICS_PORT plus its index, so they do not compete for the same port.
+
+    :param mode: :class:`DataSync` method to run: 'run', 'run_async', 'stream' or 'poll'.
+    :type mode: str
+    :param worker_id: Identifier of the process in the shard registry.
+    :type worker_id: str
+    :param index: Index of the process among those started by ``supervise``.
+    :type index: int
+    """
+    from bitfinex_extractor_influxdb.exchange_db_sync import DataSync
+
+    configure()
+    os.environ['WORKER_ID'] = worker_id
+    if os.getenv('METRICS_PORT'):
+        os.environ['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + index)
+    getattr(DataSync(), mode)()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
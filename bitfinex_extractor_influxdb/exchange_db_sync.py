@@ -1,28 +1,42 @@
-import json
+import asyncio
 import sys
-import time
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from dotenv import load_dotenv
 
-import pendulum
-import pymysql
 import logging
-import requests
-from influxdb_client import InfluxDBClient, Point, WritePrecision
 import datetime
 from datetime import timezone
 
-load_dotenv()
-
-fmt = '[%(asctime)-15s] [%(levelname)s] %(name)s: %(message)s'
-logging.basicConfig(format=fmt, level=logging.INFO, stream=sys.stdout)
+from bitfinex_extractor_influxdb import metrics
+from bitfinex_extractor_influxdb.backfill import Backfill
+from bitfinex_extractor_influxdb.cache import PageCache
+from bitfinex_extractor_influxdb.candles import CandleBuffer
+from bitfinex_extractor_influxdb.checkpoint import CheckpointStore
+from bitfinex_extractor_influxdb.gaps import GapScanner, coalesce_gaps, unchecked
+from bitfinex_extractor_influxdb.pipeline import prefetch
+from bitfinex_extractor_influxdb.protocol import ERROR_CODE_RATE_LIMIT, ERROR_CODE_START_MAINTENANCE, \
+    serialize_lines, serialize_rollups
+from bitfinex_extractor_influxdb.rate_limiter import RateLimiter
+from bitfinex_extractor_influxdb.rollup import DAY_MS, SeriesRollup
+from bitfinex_extractor_influxdb.scheduler import PERIOD_MS, PollScheduler, poll_limit
+from bitfinex_extractor_influxdb.sharding import ShardRegistry
+from bitfinex_extractor_influxdb.spool import Spool
+from bitfinex_extractor_influxdb.resample import BASE_TIMEFRAME, TIMEFRAME_MS, CandleResampler, align, \
+    to_candles
+from bitfinex_extractor_influxdb.writer import InfluxWriter, WriteTracker, WriterOptions
 
 HTTP_API_URL = 'https://api-pub.bitfinex.com/v2/'
 
-ERROR_CODE_SUBSCRIPTION_FAILED = 10300
-ERROR_CODE_RATE_LIMIT = 11010
-INFO_CODE_RECONNECT = 20051
-ERROR_CODE_START_MAINTENANCE = 20006
+# Maximum number of candles returned by Bitfinex in a single request.
+CANDLES_LIMIT = 1000
+
+# Stored candles read by each query when rollups are computed again.
+ROLLUP_CHUNK_CANDLES = 100000
+
 
 class DataSync:
     """This is a class representation of an exchange scrapper
@@ -35,7 +49,7 @@ class DataSync:
 
 
     :param mysql_cursor: :class:`pymysql.client.cursor` cursor
-        object for reading and writing from MYSQL.
+        object for reading and writing from MYSQL, connected on first use.
     :param pairs: A list containing all pairs configuration.
 
         They must exist as rows in the pair table in MYSQL.
@@ -51,6 +65,24 @@ class DataSync:
 
         Avaliable timeframes values: '1m', '5m', '15m', '30m', '1h', '3h', '6h', '12h', '1D', '7D', '14D', '1M'
     :type timeframes: list
+    :param backfill_windows: Number of time windows fetched in parallel when a series is far behind.
+
+        Series more than ``backfill_windows`` pages behind are backfilled with :meth:`backfill_series`
+        before being synced page by page. 1 disables it.
+
+            Configured using the environemnt variable "BACKFILL_WINDOWS"
+    :type backfill_windows: int
+    :param derived_timeframes: Timeframes built locally from 1m candles instead of being requested to Bitfinex.
+
+        Only timeframes up to '1D' can be derived. Timeframes not listed here are requested to Bitfinex.
+
+            Configured using the environemnt variable "DERIVED_TIMEFRAMES", comma separated.
+    :type derived_timeframes: list
+    :param config_poll_interval: Seconds between two checks for changes in the pair and timeframe tables
+        while streaming.
+
+            Configured using the environemnt variable "CONFIG_POLL_INTERVAL"
+    :type config_poll_interval: float
     :param bucket: InfluxDB Bucket name.
 
             Configured using the environemnt variable "INFLUX_BUCKET"
@@ -59,14 +91,80 @@ class DataSync:
 
             Configured using the environemnt variable "INFLUX_ORG"
     :type org: str
-    :param influx_client: :class:`InfluxDBClient` InfluxDB API client.
+    :param influx_client: :class:`InfluxDBClient` InfluxDB API client, created on first use.
 
             Configured using the environemnt variables "INFLUX_URL" and "INFLUX_TOKEN"
     :type influx_client: InfluxDBClient
+    :param writer: :class:`InfluxWriter` batching write pipeline shared by all the extraction workers.
+
+            Configured using the environemnt variables "INFLUX_BATCH_SIZE", "INFLUX_FLUSH_INTERVAL",
+            "INFLUX_MAX_RETRIES", "INFLUX_RETRY_INTERVAL", "INFLUX_JITTER_INTERVAL" and "INFLUX_QUEUE_SIZE".
+            Batches that cannot be written are spooled to disk when "SPOOL_PATH" is set, up to "SPOOL_MAX_BYTES"
+            in segments of "SPOOL_SEGMENT_BYTES", and written again every "SPOOL_DRAIN_INTERVAL" seconds.
+    :type writer: InfluxWriter
+    :param stream_writer: :class:`InfluxWriter` of the WebSocket updates, with the settings of ``writer`` but
+        sending incomplete batches sooner so updates reach InfluxDB in well under a second.
+
+            Configured using the environemnt variable "STREAM_FLUSH_INTERVAL"
+    :type stream_writer: InfluxWriter
+    :param rollup_bucket: InfluxDB Bucket the analytics of every series are written to: returns, rolling
+        volatility over ``rollup_window`` candles and, for timeframes shorter than a day, VWAP and daily OHLCV.
+        They are computed incrementally from each page written, and again from the stored candles once
+        backfill windows or repaired holes are written. None disables them.
+
+            Configured using the environemnt variable "ROLLUP_BUCKET"
+    :type rollup_bucket: str
+    :param rollup_window: Number of returns of the rolling volatility.
+
+            Configured using the environemnt variable "ROLLUP_WINDOW"
+    :type rollup_window: int
+    :param rollup_writer: :class:`InfluxWriter` into ``rollup_bucket``, None when analytics are disabled.
+    :type rollup_writer: InfluxWriter
+    :param fetcher: :class:`CandleFetcher` pooled HTTP client shared by all the extraction workers.
+
+            Configured using the environemnt variables "HTTP_TIMEOUT" and "HTTP_RETRIES"
+    :type fetcher: CandleFetcher
+    :param prefetch_pages: Pages of a series fetched ahead on a background thread while the previous ones
+        are serialized and queued for writing.
+
+            Configured using the environemnt variable "PREFETCH_PAGES"
+    :type prefetch_pages: int
+    :param page_cache: :class:`PageCache` compressed Parquet copy of every page fetched from Bitfinex, which
+        :meth:`replay` writes into InfluxDB again without any request. None when the cache is disabled.
+
+            Configured using the environemnt variable "PAGE_CACHE_PATH"
+    :type page_cache: PageCache
     :param timeseries_start: starting date for the timeseries to scrape.
 
             Configured using the environemnt variable "STARTING_YEAR"
+    :param request_delay: seconds to wait before retrying when the platform is in maintenance.
+
+            Configured using the environemnt variable "REQUEST_DELAY"
     :type request_delay: int
+    :param rate_limiter: :class:`RateLimiter` token bucket shared by every request to Bitfinex.
+
+            Configured using the environemnt variables "REQUESTS_PER_MINUTE", "REQUEST_BURST"
+            and "RATE_LIMIT_BACKOFF"
+    :type rate_limiter: RateLimiter
+    :param watermarks: Last sample timestamp in seconds of every stored series, keyed by (pair, timeframe).
+
+            Loaded with a single query when the extraction starts, None until then.
+    :type watermarks: dict
+    :param checkpoints: :class:`CheckpointStore` with the last written candle of each series, preferred over
+        InfluxDB when resuming. None when checkpoints are disabled.
+
+            Configured using the environemnt variable "CHECKPOINT_PATH"
+    :type checkpoints: CheckpointStore
+    :param shard_registry: :class:`ShardRegistry` membership of the workers sharing the series. Each worker only
+        extracts the series assigned to it among the live ones. None when sharding is disabled.
+
+            Configured using the environemnt variables "WORKER_ID" and "WORKER_TTL"
+    :type shard_registry: ShardRegistry
+    :param metrics: Latency, throughput, rate limit, lag and queue metrics, served in Prometheus text format
+        on ``/metrics``. Disabled unless a port is configured, processes started by ``supervise`` serve them on
+        that port plus their index.
+
+            Configured using the environemnt variable "METRICS_PORT"
     :param logger: :class:`Logger` log handler.
     :type logger: Logger
     """
@@ -74,42 +172,117 @@ class DataSync:
     def __init__(self):
         # Load Environment variables
         load_dotenv()
-        # Establish connection with MYSQL and generate an interface for querying and writing.
-        self._mysql_cursor = pymysql.connect(**{'host': os.getenv("MYSQL_HOST"),
-                                                'user': os.getenv("MYSQL_USER"),
-                                                'password': os.getenv("MYSQL_PASSWORD"),
-                                                'database': os.getenv("MYSQL_DATABASE"),
-                                                'cursorclass': pymysql.cursors.DictCursor}).cursor()
+        # Connections to MYSQL, INFLUXDB and Bitfinex are established on first use.
+        self._lazy_lock = threading.RLock()
+        self._mysql_cursor = None
 
         # Influxdb parameters loaded from MYSQL
         self._bucket = os.getenv("INFLUX_BUCKET")
         self._org = os.getenv("INFLUX_ORG")
 
-        # Establish connection with INFLUXDB.
-        self._influx_client = InfluxDBClient(url=os.getenv("INFLUX_URL"), token=os.getenv("INFLUX_TOKEN"))
+        self._influx_client = None
+        self._influx_url = os.getenv("INFLUX_URL")
+        self._influx_token = os.getenv("INFLUX_TOKEN")
+        self._writer = None
+        self._writer_options = WriterOptions(batch_size=int(os.getenv("INFLUX_BATCH_SIZE", "5000")),
+                                             flush_interval=float(os.getenv("INFLUX_FLUSH_INTERVAL", "1")),
+                                             max_retries=int(os.getenv("INFLUX_MAX_RETRIES", "5")),
+                                             retry_interval=float(os.getenv("INFLUX_RETRY_INTERVAL", "1")),
+                                             jitter_interval=float(os.getenv("INFLUX_JITTER_INTERVAL", "0.5")),
+                                             queue_size=int(os.getenv("INFLUX_QUEUE_SIZE", "100")),
+                                             drain_interval=float(os.getenv("SPOOL_DRAIN_INTERVAL", "5")))
+        # WebSocket updates are written through their own writer, sending incomplete batches sooner.
+        self._stream_writer = None
+        self._stream_writer_options = self._writer_options.replace(
+            flush_interval=float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05")))
+        # Batches that cannot be written are kept on disk until InfluxDB is back, enabled by setting a directory.
+        self._spool_path = os.getenv("SPOOL_PATH")
+        self._spool_options = {'max_bytes': int(os.getenv("SPOOL_MAX_BYTES", str(1024 ** 3))),
+                               'segment_bytes': int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 ** 2)))}
+
+        # Analytics computed from every page written, into their own bucket, enabled by setting the bucket.
+        self._rollup_bucket = os.getenv("ROLLUP_BUCKET")
+        self._rollup_window = int(os.getenv("ROLLUP_WINDOW", "20"))
+        self._rollup_writer = None
+        self._rollups = {}
+        # Derived timeframes built from the polled 1m candles of each pair.
+        self._resamplers = {}
 
         # Functional configuration through MYSQL interaction and environment variables.
-        self._pairs = self.query_pairs()
-        self._timeframes = self.query_timeframes()
+        self._pairs = None
+        self._timeframes = None
         self._timeseries_start = datetime.datetime(int(os.getenv("STARTING_YEAR")), 1, 1, tzinfo=timezone.utc)
         self._request_delay = int(os.getenv("REQUEST_DELAY"))
+        self._backfill_windows = int(os.getenv("BACKFILL_WINDOWS", "1"))
+        self._derived_timeframes_setting = os.getenv("DERIVED_TIMEFRAMES", "")
+        self._derived_timeframes = None
+
+        # Checksum of the pair and timeframe tables the configuration was loaded from.
+        self._config_checksum = None
+        self._config_poll_interval = float(os.getenv("CONFIG_POLL_INTERVAL", "60"))
+
+        # Last sample timestamp of every stored series, loaded in bulk before extracting.
+        self._watermarks = None
+
+        # Local record of the last written candle of each series, enabled by setting a file path.
+        self._checkpoints = CheckpointStore(os.getenv("CHECKPOINT_PATH")) if os.getenv("CHECKPOINT_PATH") else None
+
+        # Proactive rate limiting shared by every request sent to Bitfinex.
+        self._rate_limiter = RateLimiter(requests_per_minute=float(os.getenv("REQUESTS_PER_MINUTE", "30")),
+                                         burst=int(os.getenv("REQUEST_BURST", "1")),
+                                         backoff=float(os.getenv("RATE_LIMIT_BACKOFF", "60")))
+
+        # Pooled HTTP client shared by every extraction worker, so connections to Bitfinex are reused.
+        self._fetcher = None
+        self._http_timeout = float(os.getenv("HTTP_TIMEOUT", "30"))
+        self._http_retries = int(os.getenv("HTTP_RETRIES", "3"))
+
+        # Pages of a series fetched ahead while the previous ones are serialized and written.
+        self._prefetch_pages = int(os.getenv("PREFETCH_PAGES", "2"))
+
+        # Local copy of the fetched pages that can be replayed into InfluxDB, enabled by setting a directory.
+        self._page_cache = PageCache(os.getenv("PAGE_CACHE_PATH")) if os.getenv("PAGE_CACHE_PATH") else None
+
+        # Workers with an identifier only extract their shard of the series.
+        self._shard_registry = None
+        self._worker_id = os.getenv("WORKER_ID")
+        self._worker_ttl = int(os.getenv("WORKER_TTL", "60"))
 
         self._logger = logging.getLogger(self.__class__.__name__)
 
+        # Instrumentation served on /metrics, enabled by setting a port.
+        if os.getenv("METRICS_PORT"):
+            try:
+                metrics.enable(int(os.getenv("METRICS_PORT")))
+            except OSError as e:
+                self._logger.warning('Couldnt serve metrics on port %s: %s', os.getenv("METRICS_PORT"), e)
+
 
     @property
     def mysql_cursor(self):
-        return self._mysql_cursor
+        return self._lazy('_mysql_cursor', lambda: mysql_connect().cursor())
 
     @property
     def pairs(self):
-        return self._pairs
+        return self._lazy('_pairs', self.query_pairs)
 
     @property
     def timeframes(self):
-        return self._timeframes
+        return self._lazy('_timeframes', self.query_timeframes)
 
 
+    @property
+    def backfill_windows(self):
+        return self._backfill_windows
+
+    @property
+    def derived_timeframes(self):
+        return self._lazy('_derived_timeframes', self._configured_derived_timeframes)
+
+    @property
+    def config_poll_interval(self):
+        return self._config_poll_interval
+
     @property
     def bucket(self):
         return self._bucket
@@ -120,7 +293,41 @@ class DataSync:
 
     @property
     def influx_client(self):
-        return self._influx_client
+        return self._lazy('_influx_client', self._connect_influxdb)
+
+    @property
+    def writer(self):
+        return self._lazy('_writer', self._create_writer)
+
+    @property
+    def stream_writer(self):
+        return self._lazy('_stream_writer', self._create_stream_writer)
+
+    @property
+    def rollup_bucket(self):
+        return self._rollup_bucket
+
+    @property
+    def rollup_window(self):
+        return self._rollup_window
+
+    @property
+    def rollup_writer(self):
+        if not self.rollup_bucket:
+            return None
+        return self._lazy('_rollup_writer', self._create_rollup_writer)
+
+    @property
+    def fetcher(self):
+        return self._lazy('_fetcher', self._create_fetcher)
+
+    @property
+    def prefetch_pages(self):
+        return self._prefetch_pages
+
+    @property
+    def page_cache(self):
+        return self._page_cache
 
     @property
     def timeseries_start(self):
@@ -130,10 +337,63 @@ class DataSync:
     def request_delay(self):
         return self._request_delay
 
+    @property
+    def watermarks(self):
+        return self._watermarks
+
+    @property
+    def checkpoints(self):
+        return self._checkpoints
+
+    @property
+    def shard_registry(self):
+        if not self._worker_id:
+            return None
+        return self._lazy('_shard_registry', lambda: ShardRegistry(mysql_connect, self._worker_id,
+                                                                   ttl=self._worker_ttl))
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter
+
     @property
     def logger(self):
         return self._logger
 
+    def _lazy(self, name, create):
+        # Created once on first use, even when several workers ask for it at the same time.
+        value = getattr(self, name)
+        if value is None:
+            with self._lazy_lock:
+                value = getattr(self, name)
+                if value is None:
+                    value = create()
+                    setattr(self, name, value)
+        return value
+
+    def _connect_influxdb(self):
+        from influxdb_client import InfluxDBClient
+
+        return InfluxDBClient(url=self._influx_url, token=self._influx_token)
+
+    def _create_writer(self):
+        spool = Spool(self._spool_path, **self._spool_options) if self._spool_path else None
+        return InfluxWriter(self.influx_client, self.bucket, self.org, self._writer_options, spool=spool)
+
+    def _create_stream_writer(self):
+        # Each writer drains its own spool, stream batches are kept apart from the extraction ones.
+        spool = Spool(os.path.join(self._spool_path, 'stream'), **self._spool_options) if self._spool_path else None
+        return InfluxWriter(self.influx_client, self.bucket, self.org, self._stream_writer_options, spool=spool)
+
+    def _create_rollup_writer(self):
+        return InfluxWriter(self.influx_client, self.rollup_bucket, self.org, self._writer_options)
+
+    def _create_fetcher(self):
+        from bitfinex_extractor_influxdb.fetcher import CandleFetcher
+
+        # Pooled HTTP client shared by every extraction worker, so connections to Bitfinex are reused.
+        return CandleFetcher(rate_limiter=self.rate_limiter, timeout=self._http_timeout, retries=self._http_retries)
+
     def query_pairs(self):
         """Query into MySQL's pair table and return the values.
 
@@ -152,37 +412,688 @@ class DataSync:
         self.mysql_cursor.execute("SELECT * FROM timeframe;")
         return [pair['interval'] for pair in self.mysql_cursor.fetchall()]
 
+    def refresh_config(self):
+        """Reload pairs and timeframes when MySQL's pair or timeframe tables changed since the last call.
+
+        Changes are detected comparing the tables checksum, so nothing else is queried while they stay the same.
+
+        :return: Series added and removed, as lists of (pair, timeframe) tuples.
+        :rtype: tuple
+        """
+        self.mysql_cursor.execute("CHECKSUM TABLE pair, timeframe;")
+        checksum = tuple(row['Checksum'] for row in self.mysql_cursor.fetchall())
+        if checksum == self._config_checksum:
+            return [], []
+
+        before = self._configured_series()
+        self._pairs = self.query_pairs()
+        self._timeframes = self.query_timeframes()
+        self._derived_timeframes = self._configured_derived_timeframes()
+        self._config_checksum = checksum
+        after = self._configured_series()
+        added = [series for series in after if series not in before]
+        removed = [series for series in before if series not in after]
+        if added or removed:
+            self.logger.info('Configuration changed, added %s, removed %s', added, removed)
+        return added, removed
+
     def run(self):
         """Extract time series from Bitfinex Exchange and store them into InfluxDB .
         """
-        for pair in self.pairs:
-            for timeframe in self.timeframes:
+        self._join_shard()
+        self._load_watermarks()
+        try:
+            for pair, timeframe in self._series():
                 self._extract_series(pair, timeframe)
+        finally:
+            self._close_writers()
+            self._close_page_cache()
+            self._leave_shard()
+
+    def run_async(self, max_concurrency=4):
+        """Extract time series from Bitfinex Exchange and store them into InfluxDB,
+        running up to ``max_concurrency`` series at the same time.
+
+        Every pair and timeframe combination is scheduled as an independent worker
+        on an asyncio event loop. Workers share the HTTP client and the InfluxDB writer.
+
+        :param max_concurrency: Maximum number of series extracted concurrently.
+        :type max_concurrency: int
+        """
+        self._join_shard()
+        try:
+            self._extract_all(max_concurrency)
+        finally:
+            self._close_writers()
+            self._close_page_cache()
+            self._leave_shard()
+
+    def stream(self, max_concurrency=4):
+        """Sync every series and keep them updated afterwards with the Bitfinex WebSocket candle channels.
+
+        Runs until interrupted. Every configured pair and timeframe is followed, derived timeframes included,
+        since WebSocket updates do not count against the REST requests budget.
+        When sharded, series are handed over between workers on the first heartbeat after one joins or leaves.
+
+        :param max_concurrency: Maximum number of series extracted concurrently before streaming.
+        :type max_concurrency: int
+        """
+        from bitfinex_extractor_influxdb.stream import CandleStream
+
+        self._join_shard()
+        try:
+            self._extract_all(max_concurrency)
+            candle_stream = CandleStream(self._configured_series(), self.stream_writer, checkpoints=self.checkpoints,
+                                         on_candles=self._write_rollups)
+            asyncio.run(self._stream(candle_stream))
+        except KeyboardInterrupt:
+            self.logger.info('Stopped streaming.')
+        finally:
+            self._close_writers()
+            self._close_page_cache()
+            self._leave_shard()
+
+    def poll(self, max_concurrency=4):
+        """Sync every series and keep them updated afterwards polling each one when its next candle closes.
+
+        Runs until interrupted. Series wait in a :class:`PollScheduler` ordered by the close of their
+        candle in progress, so a series is requested once per candle of its timeframe and only for the
+        few candles published since the last one stored. Derived timeframes are not requested, they are
+        built from the polled 1m candles. Changes in MySQL's pair and timeframe tables are picked up. When sharded,
+        series are handed over between workers on the first heartbeat after one joins or leaves.
+
+        :param max_concurrency: Maximum number of series extracted or polled concurrently.
+        :type max_concurrency: int
+        """
+        scheduler = PollScheduler(grace=float(os.getenv("POLL_GRACE", "5")),
+                                  retry_delay=float(os.getenv("POLL_RETRY_DELAY", "10")),
+                                  max_retries=int(os.getenv("POLL_RETRIES", "3")))
+        # Set from the heartbeat thread when a worker joins or leaves.
+        rebalanced = threading.Event()
+        self._join_shard(on_change=lambda workers: rebalanced.set())
+        try:
+            self._extract_all(max_concurrency)
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                self._schedule(scheduler, self._series())
+                self._poll(scheduler, executor, rebalanced)
+        except KeyboardInterrupt:
+            self.logger.info('Stopped polling.')
+        finally:
+            self._close_writers()
+            self._close_page_cache()
+            self._leave_shard()
+
+    def _poll(self, scheduler, executor, rebalanced):
+        next_config_check = time.monotonic() + self.config_poll_interval
+        while 1:
+            wait = scheduler.wait(_now_ms())
+            timeout = max(0.0, next_config_check - time.monotonic())
+            rebalanced.wait(timeout if wait is None else min(wait / 1000, timeout))
+            if rebalanced.is_set() or time.monotonic() >= next_config_check:
+                rebalanced.clear()
+                next_config_check = time.monotonic() + self.config_poll_interval
+                self._refresh_polled_series(scheduler)
+            futures = {executor.submit(self._poll_series, pair, timeframe, candle): (pair, timeframe, candle)
+                       for pair, timeframe, candle in scheduler.pop_due(_now_ms())}
+            for future in as_completed(futures):
+                pair, timeframe, candle = futures[future]
+                last_candle, full = future.result()
+                scheduler.done(pair, timeframe, candle, last_candle, full=full, now=_now_ms())
+
+    def _refresh_polled_series(self, scheduler):
+        try:
+            added, removed = self._changed_series(scheduler.series, self._series)
+        except Exception as e:
+            self.logger.warning('Couldnt check configuration changes: %s', e)
+            return
+        scheduler.remove(removed)
+        for pair, _ in removed:
+            self._resamplers.pop(pair, None)
+        if not added:
+            return
+        self._extract_added(added)
+        self._schedule(scheduler, added)
+
+    def _extract_added(self, added):
+        # New series are synced before following them, derived timeframes through their 1m series.
+        # Last samples loaded at startup miss new pairs and are stale for series handed over by another worker.
+        self.writer.flush()
+        self._load_watermarks()
+        extracted = {(pair, BASE_TIMEFRAME if timeframe in self.derived_timeframes else timeframe)
+                     for pair, timeframe in added}
+        for pair, timeframe in sorted(extracted):
+            self._extract_series(pair, timeframe)
+
+    def _schedule(self, scheduler, series):
+        # Last samples are loaded again with a single query, once everything written so far is in InfluxDB.
+        self.writer.flush()
+        self._load_watermarks()
+        now = _now_ms()
+        for pair, timeframe in series:
+            scheduler.add(pair, timeframe, self._get_last_sample_timestamp(pair, timeframe) * 1000, now)
+
+    def _poll_series(self, pair, timeframe, candle):
+        resampler = self._poll_resampler(pair, timeframe)
+        if resampler is not None and resampler.empty:
+            # Derived periods are built whole, the first request starts with the longest one in progress.
+            candle = align(candle // 1000, resampler.timeframes) * 1000
+        limit = poll_limit(timeframe, candle, _now_ms(), CANDLES_LIMIT)
+        try:
+            response = self.fetcher.fetch(url_generator(pair, timeframe, candle, limit=limit))
+            if not self._check_bitfinex_connection(response) or not response:
+                return candle, False
+            last_candle = int(response[-1][0])
+            self._cache_page(pair, timeframe, response)
+            metrics.CANDLES.inc(len(response), (timeframe,))
+            metrics.SERIES_LAG.set((_now_ms() - last_candle) / 1000, (pair, timeframe))
+            tracker = WriteTracker()
+            tracker.write(self.writer, serialize_lines(pair, timeframe, response), candle,
+                          on_success=self._checkpoint_callback(pair, timeframe, last_candle))
+            self._write_rollups(pair, timeframe, response)
+            if resampler is not None:
+                self._write_derived(pair, resampler.feed(response), tracker, candle)
+            # A dropped page is polled again from the same candle, after the retry delay.
+            if tracker.wait() is not None:
+                self.logger.warning('Couldnt write %s - %s into INFLUXDB, polling it again', pair, timeframe)
+                return candle, False
+        except Exception as e:
+            self.logger.warning('Couldnt poll %s - %s: %s', pair, timeframe, e)
+            return candle, False
+        return last_candle, len(response) >= limit
+
+    def _poll_resampler(self, pair, timeframe):
+        if timeframe != BASE_TIMEFRAME or not self.derived_timeframes:
+            return None
+        resampler = self._resamplers.get(pair)
+        # Built again when the derived timeframes change.
+        if resampler is None or resampler.timeframes != self.derived_timeframes:
+            resampler = self._resamplers[pair] = CandleResampler(self.derived_timeframes)
+        return resampler
+
+    async def _stream(self, candle_stream):
+        loop = asyncio.get_running_loop()
+        rebalanced = asyncio.Event()
+        # Heartbeats run on their own thread, the event is set from the loop.
+        self._join_shard(on_change=lambda workers: loop.call_soon_threadsafe(rebalanced.set))
+        watcher = asyncio.ensure_future(self._watch_config(candle_stream, rebalanced))
+        try:
+            await candle_stream.run()
+        finally:
+            watcher.cancel()
+
+    async def _watch_config(self, candle_stream, rebalanced):
+        loop = asyncio.get_running_loop()
+        while 1:
+            try:
+                await asyncio.wait_for(rebalanced.wait(), self.config_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            rebalanced.clear()
+            try:
+                added, removed = await loop.run_in_executor(None, self._changed_series, candle_stream.series,
+                                                            self._configured_series)
+            except Exception as e:
+                self.logger.warning('Couldnt check configuration changes: %s', e)
+                continue
+            candle_stream.remove(removed)
+            # The rest of the series keep streaming while the new ones are synced.
+            await loop.run_in_executor(None, self._extract_added, added)
+            candle_stream.add(added)
+
+    def _extract_all(self, max_concurrency):
+        self._load_watermarks()
+        asyncio.run(self._run_async(max_concurrency))
+
+    async def _run_async(self, max_concurrency):
+        loop = asyncio.get_running_loop()
+        series = self._series()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = await asyncio.gather(
+                *(loop.run_in_executor(executor, self._extract_series, pair, timeframe)
+                  for pair, timeframe in series),
+                return_exceptions=True)
+        for (pair, timeframe), result in zip(series, results):
+            if isinstance(result, Exception):
+                self.logger.error('Failed sync %s - %s: %s', pair, timeframe, result)
+
+    def _series(self):
+        timeframes = [timeframe for timeframe in self.timeframes if timeframe not in self.derived_timeframes]
+        if self.derived_timeframes and BASE_TIMEFRAME not in timeframes:
+            timeframes.insert(0, BASE_TIMEFRAME)
+        return self._owned([(pair, timeframe) for pair in self.pairs for timeframe in timeframes])
+
+    def _configured_series(self):
+        return self._owned([(pair, timeframe) for pair in self.pairs for timeframe in self.timeframes])
+
+    def _configured_derived_timeframes(self):
+        return [timeframe for timeframe in self._derived_timeframes_setting.split(',')
+                if timeframe in self.timeframes and timeframe in TIMEFRAME_MS and timeframe != BASE_TIMEFRAME]
+
+    def _changed_series(self, followed, current):
+        # Configuration changes and series handed over between workers, compared to the ones being followed.
+        self.refresh_config()
+        series = current()
+        return [item for item in series if item not in followed], [item for item in followed if item not in series]
+
+    def _owned(self, series):
+        if self.shard_registry is not None:
+            series = self.shard_registry.owned(series)
+        return series
+
+    def _join_shard(self, on_change=None):
+        if self.shard_registry is not None:
+            self.shard_registry.start(on_change)
+
+    def _leave_shard(self):
+        if self._shard_registry is not None:
+            self._shard_registry.stop()
 
     def _extract_series(self, pair, timeframe):
-        last_sample_timestamp_ns = self._get_last_sample_timestamp(pair, timeframe) * 1000
+        derived_timeframes = self.derived_timeframes if timeframe == BASE_TIMEFRAME else []
+        last_sample_timestamp = self._get_last_sample_timestamp(pair, timeframe)
+        resampler = None
+        if derived_timeframes:
+            # Start from the earliest derived series, at the beginning of a period so no candle is built partially.
+            last_sample_timestamp = align(min([last_sample_timestamp] + [
+                self._get_last_sample_timestamp(pair, derived) for derived in derived_timeframes]),
+                derived_timeframes)
+            resampler = CandleResampler(derived_timeframes)
+        last_sample_timestamp_ns = last_sample_timestamp * 1000
+        if self._needs_backfill(timeframe, last_sample_timestamp_ns):
+            backfill_start = last_sample_timestamp_ns
+            last_sample_timestamp_ns = self._backfill(pair, timeframe, last_sample_timestamp_ns, self.backfill_windows,
+                                                      derived_timeframes)
+            if resampler is not None:
+                # The period in progress is built again whole from its 1m candles.
+                last_sample_timestamp_ns = align(last_sample_timestamp_ns // 1000, derived_timeframes) * 1000
+            # Windows were written in parallel, their rollups follow in order up to where the extraction resumes.
+            for series_timeframe in [timeframe] + list(derived_timeframes):
+                self._catch_up_rollups(pair, series_timeframe, backfill_start, last_sample_timestamp_ns, follow=True)
+        while 1:
+            tracker = WriteTracker()
+            self._extract_pages(pair, timeframe, last_sample_timestamp_ns, resampler, tracker)
+            # The series is only in sync once every page has been written.
+            failed = tracker.wait()
+            if failed is None:
+                break
+            # Extraction starts again from the first dropped page, and only moves on once it is written.
+            self.logger.warning('Couldnt write %s - %s into INFLUXDB, extracting it again from %s',
+                                pair, timeframe, failed)
+            last_sample_timestamp_ns = failed
+            if resampler is not None:
+                last_sample_timestamp_ns = align(failed // 1000, resampler.timeframes) * 1000
+                resampler = CandleResampler(resampler.timeframes)
+        self.logger.info('Correctly sync %s - %s', pair, timeframe)
+
+    def _extract_pages(self, pair, timeframe, last_sample_timestamp_ns, resampler, tracker):
+        pages = prefetch(self._pages(pair, timeframe, last_sample_timestamp_ns), self.prefetch_pages)
+        previous = None
+        try:
+            for page in pages:
+                # Pages fetched ahead are discarded once one has been dropped.
+                if tracker.failed is not None:
+                    return
+                last_response_timestamp_ns = page.last_timestamp
+                metrics.CANDLES.inc(len(page), (timeframe,))
+                metrics.SERIES_LAG.set((_now_ms() - last_response_timestamp_ns) / 1000, (pair, timeframe))
+                # The candle shared with the previous page is only written again when it changed.
+                with metrics.STAGE_SECONDS.time(('serialize',)):
+                    lines = serialize_lines(pair, timeframe, page.difference(previous))
+                tracker.write(self.writer, lines, last_sample_timestamp_ns,
+                              on_success=self._checkpoint_callback(pair, timeframe, last_response_timestamp_ns))
+                self._write_rollups(pair, timeframe, page)
+                if resampler is not None:
+                    self._write_derived(pair, resampler.feed(page), tracker, last_sample_timestamp_ns)
+
+                last_sample_timestamp_ns = last_response_timestamp_ns
+                previous = page
+        finally:
+            pages.close()
+
+    def _pages(self, pair, timeframe, last_sample_timestamp_ns):
+        # Runs ahead of _extract_series: the next page is requested as soon as the last timestamp is known.
         while 1:
             url = url_generator(pair, timeframe, last_sample_timestamp_ns)
-            json_response = requests.get(url)
-            response = json.loads(json_response.text)
+            response = self.fetcher.fetch(url)
 
             if not self._check_bitfinex_connection(response):
                 continue
 
-            last_response_timestamp_ns = int(response[-1][0])
-            if compare_timestamps(last_sample_timestamp_ns, last_response_timestamp_ns):
-                self.logger.info('Correctly sync %s - %s', pair, timeframe)
+            # Pages are held compactly while they wait to be serialized.
+            page = CandleBuffer.from_response(response)
+            if len(page) == 0 or compare_timestamps(last_sample_timestamp_ns, page.last_timestamp):
+                return
+            self._cache_page(pair, timeframe, page)
+            yield page
+            last_sample_timestamp_ns = page.last_timestamp
+
+    def backfill_series(self, pair, timeframe, windows=None):
+        """Extract the missing history of a series splitting it into time windows fetched in parallel.
+
+        Each window is paged independently using explicit start and end bounds, and the
+        fetched and written ranges are tracked so every candle is requested once and the
+        checkpoint only moves over the part of the history written without holes. Derived
+        timeframes are built from the 1m candles of each window, aligned to their periods.
+
+        :param pair: Pair to extract.
+        :type pair: str
+        :param timeframe: Timeframe to extract.
+        :type timeframe: str
+        :param windows: Number of windows, ``backfill_windows`` by default.
+        :type windows: int
+        :return: Timestamp in milliseconds of the last candle fetched without holes from the start.
+        :rtype: int
+        """
+        start = self._get_last_sample_timestamp(pair, timeframe) * 1000
+        derived_timeframes = self.derived_timeframes if timeframe == BASE_TIMEFRAME else []
+        return self._backfill(pair, timeframe, start, windows or self.backfill_windows, derived_timeframes)
+
+    def repair(self):
+        """Look for holes in every stored series with a fixed length timeframe and fetch only the missing candles.
+        """
+        self._join_shard()
+        try:
+            for pair, timeframe in self._series():
+                if timeframe in TIMEFRAME_MS:
+                    self.repair_series(pair, timeframe)
+        finally:
+            self._close_writers()
+            self._close_page_cache()
+            self._leave_shard()
+
+    def repair_series(self, pair, timeframe):
+        """Look for holes in a stored series and fetch only the missing candles.
+
+        Holes can be left by failed writes, incomplete pages or exchange outages. Holes close to
+        each other are fetched together, up to a page of candles per window. Periods without trades
+        are reported as holes too: refetching them writes nothing, and the fetched windows are recorded
+        in the checkpoints so later repairs skip the holes inside them. Holes in 1m candles are fetched
+        with the whole periods of the derived timeframes around them, which are built again.
+
+        :param pair: Pair to repair.
+        :type pair: str
+        :param timeframe: Timeframe to repair, one with a fixed length.
+        :type timeframe: str
+        :return: (start, end) pairs in milliseconds of the repaired holes.
+        :rtype: list
+        """
+        scanner = GapScanner(self.influx_client.query_api(), self.bucket, self.org,
+                             chunk_size=int(os.getenv("GAP_SCAN_CHUNK_SIZE", "100000")))
+        checked = self.checkpoints.checked(pair, timeframe) if self.checkpoints is not None else []
+        gaps = unchecked(scanner.scan(pair, timeframe, int(self.timeseries_start.timestamp() * 1000), _now_ms()),
+                         checked)
+        derived_timeframes = self.derived_timeframes if timeframe == BASE_TIMEFRAME else []
+        period = TIMEFRAME_MS[timeframe]
+        alignment = max([TIMEFRAME_MS[derived] for derived in derived_timeframes] + [period])
+        windows = coalesce_gaps(gaps, period, CANDLES_LIMIT, alignment)
+        for start, end in windows:
+            # Holes are behind the checkpoint, so only the fetched range is tracked.
+            self._extract_window(pair, timeframe, (start, end),
+                                 Backfill(start, end, timeframes=derived_timeframes, checkpoint=False))
+            for series_timeframe in [timeframe] + list(derived_timeframes):
+                self._catch_up_rollups(pair, series_timeframe, start, self._rollup_reach(series_timeframe, end))
+            if self.checkpoints is not None:
+                # Holes left in a window fetched whole are empty, the window is recorded once for all of them.
+                self.checkpoints.add_checked(pair, timeframe, start, end)
+        self.logger.info('Repaired %s holes in %s windows of %s - %s', len(gaps), len(windows), pair, timeframe)
+        return gaps
+
+    def replay(self):
+        """Write every configured series stored in the page cache into InfluxDB, without requesting Bitfinex.
+
+        Derived timeframes are built again from the cached 1m candles.
+        """
+        if self.page_cache is None:
+            raise ValueError('Replay requires the page cache, set PAGE_CACHE_PATH')
+        self._join_shard()
+        try:
+            # Buffered pages are written and their files completed before being read back.
+            self._close_page_cache()
+            cached = set(self.page_cache.series())
+            for pair, timeframe in self._series():
+                if (pair, timeframe) in cached:
+                    self.replay_series(pair, timeframe)
+        finally:
+            self._close_writers()
+            self._leave_shard()
+
+    def replay_series(self, pair, timeframe):
+        """Write the cached candles of a series into InfluxDB.
+
+        :param pair: Pair to replay.
+        :type pair: str
+        :param timeframe: Timeframe to replay.
+        :type timeframe: str
+        :return: Number of candles replayed.
+        :rtype: int
+        """
+        derived_timeframes = self.derived_timeframes if timeframe == BASE_TIMEFRAME else []
+        resampler = CandleResampler(derived_timeframes) if derived_timeframes else None
+        replayed = 0
+        for candles in self.page_cache.pages(pair, timeframe):
+            self.writer.write(serialize_lines(pair, timeframe, candles),
+                              on_success=self._checkpoint_callback(pair, timeframe, candles.last_timestamp))
+            self._write_rollups(pair, timeframe, candles)
+            if resampler is not None:
+                self._write_derived(pair, resampler.feed(candles))
+            replayed += len(candles)
+        self.logger.info('Replayed %s candles of %s - %s', replayed, pair, timeframe)
+        return replayed
+
+    def _cache_page(self, pair, timeframe, response):
+        if self.page_cache is None or not response:
+            return
+        try:
+            self.page_cache.append(pair, timeframe, response)
+        except Exception as e:
+            self.logger.warning('Couldnt cache page of %s - %s: %s', pair, timeframe, e)
+
+    def _close_page_cache(self):
+        if self.page_cache is not None:
+            self.page_cache.close()
+
+    def _needs_backfill(self, timeframe, start):
+        if self.backfill_windows <= 1:
+            return False
+        period = TIMEFRAME_MS.get(timeframe, TIMEFRAME_MS['1D'])
+        return (_now_ms() - start) // period > CANDLES_LIMIT * self.backfill_windows
+
+    def _backfill(self, pair, timeframe, start, windows, derived_timeframes=()):
+        backfill = Backfill(start, _now_ms(), PERIOD_MS.get(timeframe, 1), derived_timeframes)
+        planned = backfill.windows(windows)
+        if not planned:
+            return start
+        with ThreadPoolExecutor(max_workers=len(planned)) as executor:
+            futures = [executor.submit(self._extract_window, pair, timeframe, window, backfill) for window in planned]
+
+        # Resume from the last candle of the windows fetched without holes from the start.
+        last_candle = start
+        for (window_start, window_end), future in zip(planned, futures):
+            if future.exception() is not None:
+                self.logger.error('Failed backfill %s - %s from %s to %s: %s', pair, timeframe, window_start,
+                                  window_end, future.exception())
                 break
-            try:
-                self.influx_client.write_api().write(record=serialize_points(pair, timeframe, response), org=self.org,
-                                                     bucket=self.bucket)
-            except Exception as e:
-                self.logger.warning('Couldnt write into INFLUXDB: %s', e)
+            if future.result() is not None:
+                last_candle = future.result()
+        self.logger.info('Backfilled %s - %s, missing %s', pair, timeframe, backfill.fetched.missing())
+        return last_candle
+
+    def _extract_window(self, pair, timeframe, window, backfill):
+        last_candle = None
+        start, end = window
+        while 1:
+            tracker = WriteTracker()
+            window_last_candle = self._fetch_window(pair, timeframe, (start, end), backfill, tracker)
+            if window_last_candle is not None:
+                last_candle = window_last_candle
+            failed = tracker.wait()
+            if failed is None:
+                return last_candle
+            self.logger.warning('Couldnt write %s - %s into INFLUXDB, fetching again from %s', pair, timeframe, failed)
+            start = align(failed // 1000, backfill.timeframes) * 1000 if backfill.timeframes else failed
+
+    def _fetch_window(self, pair, timeframe, window, backfill, tracker):
+        cursor, end = window
+        resampler = CandleResampler(backfill.timeframes) if backfill.timeframes else None
+        last_candle = None
+        while cursor <= end:
+            response = self.fetcher.fetch(url_generator(pair, timeframe, cursor, end))
+            if not self._check_bitfinex_connection(response):
                 continue
 
-            last_sample_timestamp_ns = last_response_timestamp_ns
+            page = CandleBuffer.from_response(response)
+            self._cache_page(pair, timeframe, page)
+            metrics.CANDLES.inc(len(page), (timeframe,))
+            # A short page means there are no more candles in the window.
+            fetched_end = end if len(page) < CANDLES_LIMIT else page.last_timestamp
+            if len(page) > 0:
+                # Only the candles received count as written, the last one may still be open.
+                tracker.write(self.writer, serialize_lines(pair, timeframe, page), cursor,
+                              on_success=partial(self._record_written, pair, timeframe, backfill, cursor,
+                                                 min(end, page.last_timestamp)))
+                last_candle = page.last_timestamp
+                if resampler is not None:
+                    # Checkpoints of derived series are left to the extraction that follows.
+                    for derived, candles in resampler.feed(page).items():
+                        tracker.write(self.writer, serialize_lines(pair, derived, candles), cursor)
+
+            if not backfill.fetched.add(cursor, fetched_end):
+                self.logger.warning('Fetched %s - %s from %s to %s twice', pair, timeframe, cursor, fetched_end)
+            cursor = fetched_end + 1
+        return last_candle
+
+    def _record_written(self, pair, timeframe, backfill, start, end):
+        backfill.written.add(start, end)
+        contiguous_end = backfill.written.contiguous_end()
+        if backfill.checkpoint and self.checkpoints is not None and contiguous_end is not None:
+            self.checkpoints.set(pair, timeframe, contiguous_end)
+
+    def _write_derived(self, pair, derived_candles, tracker=None, position=None):
+        # Derived candles are tracked with the position of the 1m page they were built from.
+        for timeframe, candles in derived_candles.items():
+            if len(candles) == 0:
+                continue
+            lines = serialize_lines(pair, timeframe, candles)
+            on_success = self._checkpoint_callback(pair, timeframe, int(candles[-1][0]))
+            if tracker is None:
+                self.writer.write(lines, on_success=on_success)
+            else:
+                tracker.write(self.writer, lines, position, on_success=on_success)
+            self._write_rollups(pair, timeframe, candles)
+
+    def _write_rollups(self, pair, timeframe, candles):
+        # Pages of a series are fed in order, backfill windows and repairs are caught up once written.
+        if self.rollup_writer is None:
+            return
+        candles = to_candles(candles)
+        if not candles.size:
+            return
+        rollup = self._rollups.get((pair, timeframe))
+        if rollup is None:
+            first = int(candles[:, 0].min())
+            rollup = self._rollups[(pair, timeframe)] = self._seeded_rollup(pair, timeframe, first)
+        self.rollup_writer.write(serialize_rollups(pair, timeframe, rollup.feed(candles)))
+
+    def _catch_up_rollups(self, pair, timeframe, start, stop, follow=False):
+        # Rollups of candles written out of order, computed again from the stored candles in timestamp order.
+        if self.rollup_writer is None or start >= stop:
+            return
+        rollup = self._seeded_rollup(pair, timeframe, start)
+        chunk = PERIOD_MS.get(timeframe, 31 * DAY_MS) * ROLLUP_CHUNK_CANDLES
+        try:
+            for chunk_start in range(start, stop, chunk):
+                candles = self._stored_candles(pair, timeframe, chunk_start, min(chunk_start + chunk, stop))
+                self.rollup_writer.write(serialize_rollups(pair, timeframe, rollup.feed(candles)))
+        except Exception as e:
+            self.logger.warning('Couldnt catch up rollups of %s - %s from %s: %s', pair, timeframe, start, e)
+            return
+        if follow:
+            # Later pages of the series continue from the caught up state.
+            self._rollups[(pair, timeframe)] = rollup
+
+    def _rollup_reach(self, timeframe, end):
+        # Last timestamp whose rollups depend on a candle at end: the volatility window and the rest of its day.
+        period = PERIOD_MS.get(timeframe, 31 * DAY_MS)
+        reach = end + (self.rollup_window + 1) * period
+        if TIMEFRAME_MS.get(timeframe, DAY_MS) < DAY_MS:
+            reach = max(reach, (end // DAY_MS + 1) * DAY_MS)
+        return min(reach, _now_ms())
+
+    def _seeded_rollup(self, pair, timeframe, first):
+        # Returns, volatility and the VWAP of the current day continue from the candles already stored.
+        period = PERIOD_MS.get(timeframe, 31 * DAY_MS)
+        intraday = TIMEFRAME_MS.get(timeframe, DAY_MS) < DAY_MS
+        rollup = SeriesRollup(self.rollup_window, intraday=intraday)
+        start = first - (self.rollup_window + 1) * period
+        if intraday:
+            start = min(start, first // DAY_MS * DAY_MS - period)
+        try:
+            rollup.seed(self._stored_candles(pair, timeframe, start, first))
+        except Exception as e:
+            self.logger.warning('Couldnt seed rollups of %s - %s: %s', pair, timeframe, e)
+        return rollup
+
+    def _stored_candles(self, pair, timeframe, start, stop):
+        candles_query = f'from(bucket: "{self.bucket}") \
+                |> range(start: time(v: {start * 1000000}), stop: time(v: {stop * 1000000})) \
+                |> filter(fn: (r) => r["_measurement"] == "{pair}") \
+                |> filter(fn: (r) => r["timeframe"] == "{timeframe}") \
+                |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value") \
+                |> keep(columns: ["_time", "open", "close", "high", "low", "volume"]) \
+                |> sort(columns: ["_time"])'
+        records = self.influx_client.query_api().query_stream(candles_query, org=self.org)
+        # Points store the Bitfinex close column in the low field and the low column in the close field.
+        return [[round(record.get_time().timestamp() * 1000), record['open'], record['low'], record['high'],
+                 record['close'], record['volume']] for record in records]
+
+    def _close_writers(self):
+        # Writers never used were never created, nothing to close.
+        for writer in (self._writer, self._stream_writer, self._rollup_writer):
+            if writer is not None:
+                writer.close()
+
+    def _checkpoint_callback(self, pair, timeframe, timestamp):
+        if self.checkpoints is None:
+            return None
+        return partial(self.checkpoints.set, pair, timeframe, timestamp)
+
+    def _load_watermarks(self):
+        checkpoints = self.checkpoints.all() if self.checkpoints is not None else {}
+        # The base series is extracted for the derived timeframes even when it is not configured.
+        timeframes = list(self.timeframes)
+        if self.derived_timeframes and BASE_TIMEFRAME not in timeframes:
+            timeframes.append(BASE_TIMEFRAME)
+        missing = [(pair, timeframe) for pair in self.pairs for timeframe in timeframes
+                   if (pair, timeframe) not in checkpoints]
+        if not missing:
+            self._watermarks = {}
+            return
+        pairs = ', '.join(f'"{pair}"' for pair in sorted({pair for pair, _ in missing}))
+        timeframes = ', '.join(f'"{timeframe}"' for timeframe in sorted({timeframe for _, timeframe in missing}))
+        watermarks_query = f'from(bucket: "{self.bucket}") \
+                |> range(start: -9999d) \
+                |> filter(fn: (r) => contains(value: r["_measurement"], set: [{pairs}])) \
+                |> filter(fn: (r) => contains(value: r["timeframe"], set: [{timeframes}])) \
+                |> filter(fn: (r) => r["_field"] == "open") \
+                |> group(columns: ["_measurement", "timeframe"]) \
+                |> last(column: "_time") \
+                |> keep(columns: ["_measurement", "timeframe", "_time"])'
+        try:
+            tables = self.influx_client.query_api().query(watermarks_query, org=self.org)
+        except Exception as e:
+            self.logger.warning('Couldnt load last samples from INFLUXDB, querying each series: %s', e)
+            self._watermarks = None
+            return
+        self._watermarks = {(record['_measurement'], record['timeframe']): int(record.get_time().timestamp())
+                            for table in tables for record in table.records}
 
     def _get_last_sample_timestamp(self, pair, timeframe):
+        if self.checkpoints is not None:
+            checkpoint = self.checkpoints.get(pair, timeframe)
+            if checkpoint is not None:
+                return checkpoint // 1000
+        if self.watermarks is not None:
+            return self.watermarks.get((pair, timeframe), int(self.timeseries_start.timestamp()))
         last_ts_query = f'from(bucket: "{self.bucket}") \
                 |> range(start: -9999d) \
                 |> filter(fn: (r) => r["_measurement"] == "{pair}") \
@@ -201,42 +1112,43 @@ class DataSync:
         if 'error' in response:
             # Check rate limit
             if response[1] == ERROR_CODE_RATE_LIMIT:
-                self.logger.info('Error: reached the limit number of requests. Wait 120 seconds...')
-                time.sleep(20)
+                metrics.RATE_LIMIT_HITS.inc()
+                wait = self.rate_limiter.penalize()
+                self.logger.info('Error: reached the limit number of requests. Wait %s seconds...', wait)
 
             # Check platform status
             if response[1] == ERROR_CODE_START_MAINTENANCE:
                 self.logger.info('Error: platform is in maintenance. Forced to stop all requests.')
-                time.sleep(1)
+                self.rate_limiter.pause(self.request_delay)
             return False
+        self.rate_limiter.reward()
         return True
 
 
-def url_generator(pair, timeframe, last_sample_timestamp_ns):
-    print(HTTP_API_URL + f'candles/trade:{timeframe}:{pair}' \
-                         f'/hist?limit=1000&start={last_sample_timestamp_ns}&sort=1')
-    return HTTP_API_URL + f'candles/trade:{timeframe}:{pair}' \
-                          f'/hist?limit=1000&start={last_sample_timestamp_ns}&sort=1'
-
-
-def serialize_points(pair, timeframe, response):
-    points = []
-    for tick in list(response):
-        open_price = float(tick[1])
-        low_price = float(tick[2])
-        high_price = float(tick[3])
-        close_price = float(tick[4])
-        volume = float(tick[5])
-        timestamp = pendulum.from_timestamp(int(tick[0]) // 1000).in_tz('UTC').to_atom_string()
-        point = Point(pair).field('close', close_price) \
-            .tag('timeframe', timeframe) \
-            .field('open', open_price) \
-            .field('high', high_price) \
-            .field('low', low_price) \
-            .field('volume', volume) \
-            .time(timestamp, WritePrecision.NS)
-        points.append(point)
-    return points
+def mysql_connect():
+    """Open a connection to the MySQL server configured through environment variables.
+
+    :rtype: :class:`pymysql.connections.Connection`
+    """
+    import pymysql
+
+    return pymysql.connect(**{'host': os.getenv("MYSQL_HOST"),
+                              'user': os.getenv("MYSQL_USER"),
+                              'password': os.getenv("MYSQL_PASSWORD"),
+                              'database': os.getenv("MYSQL_DATABASE"),
+                              'cursorclass': pymysql.cursors.DictCursor})
+
+
+def url_generator(pair, timeframe, last_sample_timestamp_ns, end=None, limit=CANDLES_LIMIT):
+    url = HTTP_API_URL + f'candles/trade:{timeframe}:{pair}' \
+                         f'/hist?limit={limit}&start={last_sample_timestamp_ns}&sort=1'
+    if end is not None:
+        url += f'&end={end}'
+    return url
+
+
+def _now_ms():
+    return int(datetime.datetime.now(timezone.utc).timestamp() * 1000)
 
 
 def compare_timestamps(last_sample_timestamp_ns, last_response_timestamp_ns):
@@ -244,4 +1156,6 @@ def compare_timestamps(last_sample_timestamp_ns, last_response_timestamp_ns):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format='[%(asctime)-15s] [%(levelname)s] %(name)s: %(message)s', level=logging.INFO,
+                        stream=sys.stdout)
     DataSync().run()
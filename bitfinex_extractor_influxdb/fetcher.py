@@ -0,0 +1,83 @@
+import json
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from bitfinex_extractor_influxdb import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def loads(content):
+    """Parse a JSON body straight from the response bytes, using orjson when it is installed.
+
+    :param content: Raw response body.
+    :type content: bytes
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class CandleFetcher:
+    """HTTP client for the Bitfinex candles endpoint.
+
+    All requests go through one :class:`requests.Session` with a pool of keep-alive
+    connections, so the TLS handshake is paid once per connection instead of once per page.
+    Responses are requested compressed, connection errors and 5xx answers are retried by
+    the transport, and bodies are parsed directly from the received bytes.
+
+    :param rate_limiter: :class:`RateLimiter` every request waits on before being sent. Optional.
+    :type rate_limiter: RateLimiter
+    :param timeout: Seconds to wait for the server to answer.
+    :type timeout: float
+    :param connect_timeout: Seconds to wait for a connection to be established.
+    :type connect_timeout: float
+    :param retries: Times a failed request is retried by the transport.
+    :type retries: int
+    :param pool_size: Maximum number of connections kept alive.
+    :type pool_size: int
+    """
+
+    def __init__(self, rate_limiter=None, timeout=30, connect_timeout=5, retries=3, pool_size=10):
+        self._rate_limiter = rate_limiter
+        self._timeout = (connect_timeout, timeout)
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def fetch(self, url):
+        """Request a page of candles and return the parsed body.
+
+        :param url: Candles endpoint URL, as built by :func:`url_generator`.
+        :type url: str
+        :return: Candles or the error sent by Bitfinex.
+        :rtype: list
+        """
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        with metrics.STAGE_SECONDS.time(('fetch',)):
+            response = self._session.get(url, timeout=self._timeout)
+        metrics.RESPONSE_BYTES.inc(len(response.content))
+        with metrics.STAGE_SECONDS.time(('parse',)):
+            return loads(response.content)
+
+    def close(self):
+        self._session.close()
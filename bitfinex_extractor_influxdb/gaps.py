@@ -0,0 +1,139 @@
+import bisect
+
+import numpy as np
+
+from bitfinex_extractor_influxdb.resample import TIMEFRAME_MS
+
+
+def find_gaps(timestamps, period):
+    """Find the candles missing between consecutive timestamps.
+
+    :param timestamps: Sorted candle timestamps in milliseconds.
+    :type timestamps: :class:`numpy.ndarray`
+    :param period: Candle length in milliseconds.
+    :type period: int
+    :return: (start, end) pairs in milliseconds, both included, with the timestamps of the missing candles.
+    :rtype: list
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    holes = np.flatnonzero(np.diff(timestamps) > period)
+    return list(zip((timestamps[holes] + period).tolist(), (timestamps[holes + 1] - period).tolist()))
+
+
+def coalesce_gaps(gaps, period, limit, alignment=None):
+    """Group gaps into the windows they are fetched in, so nearby holes share their requests.
+
+    Gaps are widened to whole periods of ``alignment`` first. Consecutive gaps are then put in the
+    same window while it spans up to ``limit`` candles, overlapping or adjacent ones always.
+
+    :param gaps: (start, end) pairs in milliseconds, both included, as returned by :func:`find_gaps`.
+    :type gaps: list
+    :param period: Candle length in milliseconds.
+    :type period: int
+    :param limit: Number of candles fetched with a single request.
+    :type limit: int
+    :param alignment: Length in milliseconds of the periods windows start and end with, the candle length by default.
+    :type alignment: int
+    :return: (start, end) pairs in milliseconds, both included, sorted and without overlapping.
+    :rtype: list
+    """
+    alignment = alignment or period
+    windows = []
+    for start, end in sorted(gaps):
+        start = start // alignment * alignment
+        end = (end // alignment + 1) * alignment - period
+        if windows and (start <= windows[-1][1] + period or (end - windows[-1][0]) // period < limit):
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def unchecked(gaps, checked):
+    """Leave out the gaps already fetched whole from Bitfinex by a previous repair.
+
+    :param gaps: (start, end) pairs in milliseconds, both included.
+    :type gaps: iterable
+    :param checked: (start, end) pairs in milliseconds, both included, of the ranges already fetched.
+    :type checked: list
+    :return: The gaps not contained in any checked range.
+    :rtype: list
+    """
+    merged = []
+    for start, end in sorted(checked):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    starts = [start for start, _ in merged]
+    remaining = []
+    for start, end in gaps:
+        index = bisect.bisect_right(starts, start) - 1
+        if index < 0 or merged[index][1] < end:
+            remaining.append((start, end))
+    return remaining
+
+
+class GapScanner:
+    """Integrity check of the candles stored in InfluxDB.
+
+    The timestamps of a series are read in chunks of ``chunk_size`` candles and compared
+    with the grid expected for its timeframe, so whole years of 1m candles can be checked
+    with a bounded amount of memory. Gaps spanning two chunks are detected too.
+
+    :param query_api: :class:`QueryApi` used to read the stored timestamps.
+    :type query_api: QueryApi
+    :param bucket: InfluxDB Bucket name.
+    :type bucket: str
+    :param org: InfluxDB organization name.
+    :type org: str
+    :param chunk_size: Number of candles read by each query.
+    :type chunk_size: int
+    """
+
+    def __init__(self, query_api, bucket, org, chunk_size=100000):
+        self._query_api = query_api
+        self._bucket = bucket
+        self._org = org
+        self._chunk_size = chunk_size
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    def scan(self, pair, timeframe, start, end):
+        """Yield the gaps of a series between two timestamps.
+
+        Only gaps between stored candles are reported: the range before the first one and
+        after the last one are left to the regular extraction.
+
+        :param pair: Pair of the series.
+        :type pair: str
+        :param timeframe: Timeframe of the series, one of those with a fixed length.
+        :type timeframe: str
+        :param start: First timestamp to check in milliseconds.
+        :type start: int
+        :param end: Last timestamp to check in milliseconds.
+        :type end: int
+        :return: (start, end) pairs in milliseconds, both included, with the timestamps of the missing candles.
+        :rtype: generator
+        """
+        period = TIMEFRAME_MS[timeframe]
+        chunk = period * self.chunk_size
+        previous = np.empty(0, dtype=np.int64)
+        for chunk_start in range(start, end + 1, chunk):
+            timestamps = self._timestamps(pair, timeframe, chunk_start, min(chunk_start + chunk, end + 1))
+            timestamps = np.concatenate([previous, timestamps])
+            yield from find_gaps(timestamps, period)
+            previous = timestamps[-1:]
+
+    def _timestamps(self, pair, timeframe, start, stop):
+        query = f'from(bucket: "{self._bucket}") \
+                |> range(start: time(v: {start * 1000000}), stop: time(v: {stop * 1000000})) \
+                |> filter(fn: (r) => r["_measurement"] == "{pair}") \
+                |> filter(fn: (r) => r["timeframe"] == "{timeframe}") \
+                |> filter(fn: (r) => r["_field"] == "open") \
+                |> keep(columns: ["_time"]) \
+                |> sort(columns: ["_time"])'
+        records = self._query_api.query_stream(query, org=self._org)
+        return np.fromiter((round(record.get_time().timestamp() * 1000) for record in records), dtype=np.int64)
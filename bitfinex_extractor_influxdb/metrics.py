@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentation is off until enable is called, every metric update is then a single flag check.
+_enabled = False
+_server = None
+_registry = []
+_null_timer = nullcontext()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self._name = name
+        self._documentation = documentation
+        self._labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    @property
+    def name(self):
+        return self._name
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(tuple(labels))
+
+    def render(self):
+        lines = [f'# HELP {self._name} {self._documentation}', f'# TYPE {self._name} {self.kind}']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._samples(labels, value))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self, labels, value):
+        return [f'{self._name}{self._format(labels)} {value}']
+
+    def _format(self, labels, extra=()):
+        pairs = list(zip(self._labels, labels)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Counter(_Metric):
+    """Monotonically increasing total."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        if not _enabled:
+            return
+        labels = tuple(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[tuple(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=(.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, documentation, labels)
+        self._buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        if not _enabled:
+            return
+        labels = tuple(labels)
+        with self._lock:
+            counts, total, count = self._values.get(labels, ([0] * len(self._buckets), 0.0, 0))
+            index = bisect.bisect_left(self._buckets, value)
+            if index < len(counts):
+                counts = counts[:index] + [bucket + 1 for bucket in counts[index:]]
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def time(self, labels=()):
+        """Return a context manager observing the seconds spent in its ``with`` block."""
+        if not _enabled:
+            return _null_timer
+        return _Timer(self, labels)
+
+    def _samples(self, labels, value):
+        counts, total, count = value
+        samples = [f'{self._name}_bucket{self._format(labels, [("le", bound)])} {bucket}'
+                   for bound, bucket in zip(self._buckets, counts)]
+        samples.append(f'{self._name}_bucket{self._format(labels, [("le", "+Inf")])} {count}')
+        samples.append(f'{self._name}_sum{self._format(labels)} {total}')
+        samples.append(f'{self._name}_count{self._format(labels)} {count}')
+        return samples
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_labels', '_start')
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, self._labels)
+
+
+STAGE_SECONDS = Histogram('bitfinex_extractor_stage_seconds',
+                          'Seconds spent in each stage of the extraction: fetch, parse, serialize and write.',
+                          labels=('stage',))
+CANDLES = Counter('bitfinex_extractor_candles_total', 'Candles fetched from Bitfinex.', labels=('timeframe',))
+RESPONSE_BYTES = Counter('bitfinex_extractor_response_bytes_total', 'Bytes received from Bitfinex.')
+WRITTEN_POINTS = Counter('bitfinex_extractor_written_points_total', 'Points written into InfluxDB.')
+RATE_LIMIT_HITS = Counter('bitfinex_extractor_rate_limit_hits_total', 'Rate limit errors returned by Bitfinex.')
+SERIES_LAG = Gauge('bitfinex_extractor_series_lag_seconds', 'Seconds between now and the last synced candle.',
+                   labels=('pair', 'timeframe'))
+QUEUE_DEPTH = Gauge('bitfinex_extractor_write_queue_depth', 'Pages waiting to be written into InfluxDB.')
+SPOOL_BYTES = Gauge('bitfinex_extractor_spool_bytes', 'Bytes of line protocol spooled to disk waiting for InfluxDB.')
+
+
+def enabled():
+    return _enabled
+
+
+def enable(port=None, address=''):
+    """Start collecting metrics and, if a port is given, serve them on ``/metrics``.
+
+    :param port: Port of the HTTP server exposing the metrics in Prometheus text format.
+    :type port: int
+    :param address: Address the HTTP server listens on, all interfaces by default.
+    :type address: str
+    """
+    global _enabled, _server
+    _enabled = True
+    if port is not None and _server is None:
+        _server = ThreadingHTTPServer((address, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+
+
+def disable():
+    """Stop collecting metrics and serving them, dropping the collected values.
+    """
+    global _enabled, _server
+    _enabled = False
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+    for metric in _registry:
+        metric.reset()
+
+
+def render():
+    """Return every metric in Prometheus text format.
+
+    :rtype: str
+    """
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
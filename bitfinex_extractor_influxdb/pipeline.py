@@ -0,0 +1,59 @@
+import queue
+import threading
+
+# Marks the end of the produced items in the queue.
+_DONE = object()
+
+
+def prefetch(iterable, depth=2):
+    """Iterate ``iterable`` on a background thread, keeping up to ``depth`` items ready ahead of the consumer.
+
+    Items are handed over through a bounded queue, so the producer blocks once it is ``depth``
+    items ahead. Exceptions raised by the producer are raised again to the consumer, and
+    closing the returned generator stops the producer after the item it is working on.
+
+    :param iterable: Items to produce, iterated from the background thread only.
+    :type iterable: iterable
+    :param depth: Maximum number of items produced and not consumed yet.
+    :type depth: int
+    :return: The items of ``iterable``, in order.
+    :rtype: generator
+    """
+    items = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    break
+            else:
+                put((_DONE, None))
+        except Exception as e:
+            put((_DONE, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while 1:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
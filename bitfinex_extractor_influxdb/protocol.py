@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+
+ERROR_CODE_SUBSCRIPTION_FAILED = 10300
+ERROR_CODE_RATE_LIMIT = 11010
+INFO_CODE_RECONNECT = 20051
+ERROR_CODE_START_MAINTENANCE = 20006
+
+# Line protocol template for a candle, fields sorted by key as influxdb_client does.
+# Column 2 of a candle is stored as low and column 4 as close, as in every series already stored.
+CANDLE_LINE_FIELDS = 'close=%r,high=%r,low=%r,open=%r,volume=%r %d'
+
+
+def serialize_points(pair, timeframe, response):
+    import pendulum
+    from influxdb_client import Point, WritePrecision
+
+    points = []
+    for tick in list(response):
+        open_price = float(tick[1])
+        low_price = float(tick[2])
+        high_price = float(tick[3])
+        close_price = float(tick[4])
+        volume = float(tick[5])
+        timestamp = pendulum.from_timestamp(int(tick[0]) // 1000).in_tz('UTC').to_atom_string()
+        point = Point(pair).field('close', close_price) \
+            .tag('timeframe', timeframe) \
+            .field('open', open_price) \
+            .field('high', high_price) \
+            .field('low', low_price) \
+            .field('volume', volume) \
+            .time(timestamp, WritePrecision.NS)
+        points.append(point)
+    return points
+
+
+def serialize_lines(pair, timeframe, response):
+    """Serialize a whole Bitfinex candles response into InfluxDB line protocol.
+
+    Columns are converted at once with NumPy and timestamps go from milliseconds to
+    nanoseconds as integers, so no intermediate :class:`Point` objects are built.
+
+    :param pair: Pair used as measurement.
+    :type pair: str
+    :param timeframe: Timeframe used as tag.
+    :type timeframe: str
+    :param response: Candles as returned by Bitfinex, or a :class:`CandleBuffer`, fields are mapped as in
+        :func:`serialize_points`.
+    :type response: list
+    :return: One line per candle, encoded as UTF-8.
+    :rtype: bytes
+    """
+    candles = np.asarray(response, dtype=np.float64).reshape(-1, 6)
+    candles = candles[np.isfinite(candles).all(axis=1)]
+    timestamps_ns = candles[:, 0].astype(np.int64) * 1000000
+    template = f'{_escape_measurement(pair)},timeframe={_escape_tag(timeframe)} ' + CANDLE_LINE_FIELDS
+    rows = zip(candles[:, 4].tolist(), candles[:, 3].tolist(), candles[:, 2].tolist(), candles[:, 1].tolist(),
+               candles[:, 5].tolist(), timestamps_ns.tolist())
+    return '\n'.join([template % row for row in rows]).encode('utf-8')
+
+
+def serialize_rollups(pair, timeframe, rollups):
+    """Serialize the analytics built by :class:`SeriesRollup` into InfluxDB line protocol.
+
+    Each rollup is tagged with its kind, fields without a defined value are left out.
+
+    :param pair: Pair used as measurement.
+    :type pair: str
+    :param timeframe: Timeframe used as tag.
+    :type timeframe: str
+    :param rollups: (rollup, timestamps, fields) tuples as returned by :meth:`SeriesRollup.feed`.
+    :type rollups: list
+    :return: One line per timestamp, encoded as UTF-8.
+    :rtype: bytes
+    """
+    lines = []
+    for rollup, timestamps, fields in rollups:
+        prefix = f'{_escape_measurement(pair)},rollup={_escape_tag(rollup)},timeframe={_escape_tag(timeframe)} '
+        names = list(fields)
+        rows = zip(*[fields[name].tolist() for name in names])
+        for timestamp, row in zip(np.asarray(timestamps, dtype=np.int64).tolist(), rows):
+            values = ','.join(f'{name}={value!r}' for name, value in zip(names, row) if math.isfinite(value))
+            if values:
+                lines.append(f'{prefix}{values} {timestamp * 1000000}')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _escape_measurement(measurement):
+    return measurement.replace(',', '\\,').replace(' ', '\\ ')
+
+
+def _escape_tag(tag):
+    return _escape_measurement(tag).replace('=', '\\=')
@@ -0,0 +1,104 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket shared by every worker that sends requests to Bitfinex.
+
+    Tokens are refilled continuously at ``requests_per_minute`` and up to ``burst``
+    of them can be accumulated. Each request consumes one token, blocking the caller
+    until one is available, so the whole process stays under the exchange budget
+    no matter how many series are being extracted.
+
+    When Bitfinex answers with a rate limit error, :meth:`penalize` pauses every worker
+    for ``backoff`` seconds (doubled on each consecutive hit up to ``max_backoff``) and
+    halves the refill rate. Successful responses, reported through :meth:`reward`,
+    restore the rate step by step until the configured one is reached again.
+
+    :param requests_per_minute: Maximum sustained number of requests per minute.
+    :type requests_per_minute: float
+    :param burst: Maximum number of requests that can be sent back to back.
+    :type burst: int
+    :param backoff: Seconds every worker waits after the first rate limit error.
+    :type backoff: float
+    :param max_backoff: Upper bound for the waiting time after consecutive errors.
+    :type max_backoff: float
+    """
+
+    def __init__(self, requests_per_minute=30, burst=1, backoff=60, max_backoff=600):
+        self._requests_per_minute = float(requests_per_minute)
+        self._burst = max(1, int(burst))
+        self._backoff = float(backoff)
+        self._max_backoff = float(max_backoff)
+
+        self._rate = self._requests_per_minute
+        self._tokens = float(self._burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._penalties = 0
+        self._lock = threading.Lock()
+
+    @property
+    def requests_per_minute(self):
+        return self._requests_per_minute
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def rate(self):
+        """Current refill rate in requests per minute, lower than the configured one after a penalty."""
+        return self._rate
+
+    def acquire(self):
+        """Block until a request can be sent without exceeding the budget and consume a token.
+        """
+        while 1:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) * 60 / self._rate
+            time.sleep(wait)
+
+    def penalize(self):
+        """Pause every worker after a rate limit error and slow down the refill rate.
+
+        :return: Seconds the workers will be paused.
+        :rtype: float
+        """
+        with self._lock:
+            wait = min(self._backoff * 2 ** self._penalties, self._max_backoff)
+            self._penalties += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + wait)
+            self._rate = max(self._rate / 2, 1.0)
+            self._tokens = 0.0
+            return wait
+
+    def pause(self, seconds):
+        """Pause every worker for the given seconds without changing the refill rate.
+
+        :param seconds: Seconds to wait before sending the next request.
+        :type seconds: float
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def reward(self):
+        """Report a successful response, resetting the backoff and recovering the refill rate.
+        """
+        with self._lock:
+            self._penalties = 0
+            self._rate = min(self._rate + 1, self._requests_per_minute)
+
+    def _refill(self, now):
+        # No tokens are generated while workers are paused.
+        elapsed = max(0.0, now - max(self._last_refill, self._paused_until))
+        self._last_refill = now
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate / 60)
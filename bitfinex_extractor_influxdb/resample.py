@@ -0,0 +1,127 @@
+import numpy as np
+
+# Columns of a Bitfinex candle: [MTS, OPEN, CLOSE, HIGH, LOW, VOLUME].
+MTS, OPEN, CLOSE, HIGH, LOW, VOLUME = range(6)
+
+BASE_TIMEFRAME = '1m'
+
+# Timeframes with a fixed length that can be built from 1m candles, in milliseconds.
+TIMEFRAME_MS = {
+    '1m': 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '3h': 3 * 60 * 60 * 1000,
+    '6h': 6 * 60 * 60 * 1000,
+    '12h': 12 * 60 * 60 * 1000,
+    '1D': 24 * 60 * 60 * 1000,
+}
+
+
+def to_candles(response):
+    """Convert a Bitfinex candles response into a float64 array with one row per candle.
+
+    :param response: Candles as returned by Bitfinex.
+    :type response: list
+    :rtype: :class:`numpy.ndarray`
+    """
+    return np.asarray(response, dtype=np.float64).reshape(-1, 6)
+
+
+def deduplicate(candles):
+    """Sort candles by timestamp keeping the last received row for each timestamp.
+
+    :param candles: Array of candles.
+    :type candles: :class:`numpy.ndarray`
+    :rtype: :class:`numpy.ndarray`
+    """
+    candles = candles[np.argsort(candles[:, MTS], kind='stable')]
+    keep = np.append(candles[1:, MTS] != candles[:-1, MTS], True)
+    return candles[keep]
+
+
+def resample_candles(candles, timeframe):
+    """Roll up candles into a higher timeframe.
+
+    Candles are grouped by the start of the period they belong to: the first open,
+    the highest high, the lowest low, the last close and the summed volume of each
+    group make the resulting candle, laid out as a Bitfinex response.
+
+    :param candles: Array of candles sorted by timestamp and without duplicates.
+    :type candles: :class:`numpy.ndarray`
+    :param timeframe: Target timeframe, one of :data:`TIMEFRAME_MS`.
+    :type timeframe: str
+    :rtype: :class:`numpy.ndarray`
+    """
+    if not candles.size:
+        return np.empty((0, 6))
+    period = TIMEFRAME_MS[timeframe]
+    buckets = candles[:, MTS] // period * period
+    starts = np.flatnonzero(np.append(True, buckets[1:] != buckets[:-1]))
+    ends = np.append(starts[1:], len(candles)) - 1
+
+    resampled = np.empty((len(starts), 6))
+    resampled[:, MTS] = buckets[starts]
+    resampled[:, OPEN] = candles[starts, OPEN]
+    resampled[:, CLOSE] = candles[ends, CLOSE]
+    resampled[:, HIGH] = np.maximum.reduceat(candles[:, HIGH], starts)
+    resampled[:, LOW] = np.minimum.reduceat(candles[:, LOW], starts)
+    resampled[:, VOLUME] = np.add.reduceat(candles[:, VOLUME], starts)
+    return resampled
+
+
+class CandleResampler:
+    """Incremental roll up of consecutive pages of 1m candles into higher timeframes.
+
+    The 1m candles of the last, possibly unfinished, period of the longest timeframe are
+    kept between pages, so a period split across two pages is rebuilt whole when the next
+    page arrives. Repeated candles, like the one shared by consecutive pages, are dropped.
+
+    :param timeframes: Timeframes to build, all of them in :data:`TIMEFRAME_MS`.
+    :type timeframes: list
+    """
+
+    def __init__(self, timeframes):
+        self._timeframes = list(timeframes)
+        self._period = max(TIMEFRAME_MS[timeframe] for timeframe in self._timeframes)
+        self._pending = np.empty((0, 6))
+
+    @property
+    def timeframes(self):
+        return self._timeframes
+
+    @property
+    def empty(self):
+        """Whether no candles have been fed yet."""
+        return not self._pending.size
+
+    def feed(self, response):
+        """Add a page of 1m candles and return the candles of every timeframe it affects.
+
+        The last candle of each timeframe may belong to an unfinished period, it will be
+        returned again, completed, with the next pages.
+
+        :param response: 1m candles as returned by Bitfinex.
+        :type response: list
+        :return: Arrays of candles keyed by timeframe.
+        :rtype: dict
+        """
+        candles = deduplicate(np.concatenate([self._pending, to_candles(response)]))
+        if len(candles):
+            last_period = candles[-1, MTS] // self._period * self._period
+            self._pending = candles[candles[:, MTS] >= last_period]
+        return {timeframe: resample_candles(candles, timeframe) for timeframe in self._timeframes}
+
+
+def align(timestamp, timeframes):
+    """Move a timestamp in seconds back to the start of the period of the longest timeframe.
+
+    :param timestamp: Timestamp in seconds.
+    :type timestamp: int
+    :param timeframes: Timeframes built from 1m candles.
+    :type timeframes: list
+    :rtype: int
+    """
+    period = max(TIMEFRAME_MS[timeframe] for timeframe in timeframes) // 1000
+    return timestamp // period * period
@@ -0,0 +1,152 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from bitfinex_extractor_influxdb.resample import CLOSE, HIGH, LOW, MTS, OPEN, TIMEFRAME_MS, VOLUME, deduplicate, \
+    to_candles
+
+DAY_MS = TIMEFRAME_MS['1D']
+
+
+class _State:
+    __slots__ = ('last_mts', 'last_close', 'returns', 'day', 'day_complete', 'day_open', 'day_high', 'day_low',
+                 'day_volume', 'day_pv')
+
+    def __init__(self):
+        self.last_mts = -1
+        self.last_close = np.nan
+        self.returns = np.empty(0)
+        self.day = None
+        self.day_complete = False
+        self.day_open = self.day_high = self.day_low = np.nan
+        self.day_volume = self.day_pv = 0.0
+
+
+class SeriesRollup:
+    """Incremental analytics of a candle series, computed only over the candles appended since the last page.
+
+    For every candle: the simple and logarithmic return from the previous close, the
+    volatility as standard deviation of the last ``window`` logarithmic returns and, for
+    timeframes shorter than a day, the VWAP since the start of the UTC day. For those
+    timeframes a daily OHLCV and VWAP summary is built as well.
+
+    The last candle of each page may be unfinished, it is computed again with the next
+    page. Days whose start was not seen, like the one in progress when the first page is
+    fed, get no VWAP nor summary, so nothing partial overwrites complete values. The state
+    can be rebuilt from the candles already stored with :meth:`seed` before the first page.
+
+    :param window: Number of returns of the rolling volatility.
+    :type window: int
+    :param intraday: Whether the candles are shorter than a day, enabling VWAP and daily summaries.
+    :type intraday: bool
+    """
+
+    def __init__(self, window=20, intraday=True):
+        self._window = window
+        self._intraday = intraday
+        self._state = _State()
+        self._pending = np.empty((0, 6))
+
+    @property
+    def window(self):
+        return self._window
+
+    def feed(self, response):
+        """Add a page of candles, in order with the previous ones, and return the rollups it affects.
+
+        :param response: Candles as returned by Bitfinex, or a :class:`CandleBuffer`.
+        :type response: list
+        :return: (rollup, timestamps, fields) tuples: rollup is 'candle' or 'daily', timestamps in milliseconds
+            and fields a dict of float arrays, NaN where a value is not defined.
+        :rtype: list
+        """
+        candles = deduplicate(np.concatenate([self._pending, to_candles(response)]))
+        candles = candles[candles[:, MTS] > self._state.last_mts]
+        if not candles.size:
+            return []
+        rollups, _ = self._compute(self._state, candles)
+        # Everything but the last candle is final and moves the state forward.
+        _, self._state = self._compute(self._state, candles[:-1])
+        self._pending = candles[-1:]
+        return rollups
+
+    def seed(self, response):
+        """Move the state through final candles preceding the next page, without returning their rollups.
+
+        :param response: Candles as returned by Bitfinex, or a :class:`CandleBuffer`.
+        :type response: list
+        """
+        candles = deduplicate(to_candles(response))
+        candles = candles[candles[:, MTS] > self._state.last_mts]
+        _, self._state = self._compute(self._state, candles)
+
+    def _compute(self, state, candles):
+        if not candles.size:
+            return [], state
+        new_state = _State()
+        new_state.last_mts = int(candles[-1, MTS])
+        new_state.last_close = candles[-1, CLOSE]
+        fields = self._candle_fields(state, new_state, candles)
+        rollups = [('candle', candles[:, MTS], fields)]
+        if self._intraday:
+            fields['vwap'], daily = self._daily(state, new_state, candles)
+            rollups.append(daily)
+        return rollups, new_state
+
+    def _candle_fields(self, state, new_state, candles):
+        closes = candles[:, CLOSE]
+        previous = np.append(state.last_close, closes[:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            simple_returns = closes / previous - 1
+            log_returns = np.log(closes / previous)
+        history = np.concatenate([state.returns, log_returns])
+        volatility = np.full(len(history), np.nan)
+        if len(history) >= self._window > 1:
+            volatility[self._window - 1:] = sliding_window_view(history, self._window).std(axis=1, ddof=1)
+        new_state.returns = history[len(history) - self._window + 1:] if self._window > 1 else np.empty(0)
+        return {'return': simple_returns, 'log_return': log_returns, 'volatility': volatility[-len(candles):]}
+
+    @staticmethod
+    def _daily(state, new_state, candles):
+        # VWAP of every candle since the start of its day, and the summary of every complete day.
+        days = candles[:, MTS] // DAY_MS * DAY_MS
+        starts = np.flatnonzero(np.append(True, days[1:] != days[:-1]))
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(candles))))
+        carried = state.day == days[0]
+        complete = np.ones(len(starts), dtype=bool)
+        complete[0] = state.day_complete if carried else state.day is not None
+
+        cumulative_pv, cumulative_volume = _day_sums(candles, starts, group)
+        summary = {'open': candles[starts, OPEN],
+                   'high': np.maximum.reduceat(candles[:, HIGH], starts),
+                   'low': np.minimum.reduceat(candles[:, LOW], starts)}
+        if carried:
+            cumulative_pv[group == 0] += state.day_pv
+            cumulative_volume[group == 0] += state.day_volume
+            summary['open'][0] = state.day_open
+            summary['high'][0] = max(summary['high'][0], state.day_high)
+            summary['low'][0] = min(summary['low'][0], state.day_low)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = np.where(cumulative_volume > 0, cumulative_pv / cumulative_volume, np.nan)
+        ends = np.append(starts[1:], len(candles)) - 1
+        summary.update(close=candles[ends, CLOSE], volume=cumulative_volume[ends], vwap=vwap[ends])
+
+        new_state.day = days[-1]
+        new_state.day_complete = bool(complete[-1])
+        new_state.day_open = summary['open'][-1]
+        new_state.day_high = summary['high'][-1]
+        new_state.day_low = summary['low'][-1]
+        new_state.day_volume = cumulative_volume[-1]
+        new_state.day_pv = cumulative_pv[-1]
+        return np.where(complete[group], vwap, np.nan), \
+            ('daily', days[starts][complete], {name: values[complete] for name, values in summary.items()})
+
+
+def _day_sums(candles, starts, group):
+    # Typical price times volume and volume, accumulated since the start of each day.
+    volume = candles[:, VOLUME]
+    pv = (candles[:, HIGH] + candles[:, LOW] + candles[:, CLOSE]) / 3 * volume
+    cumulative_pv = np.cumsum(pv)
+    cumulative_volume = np.cumsum(volume)
+    cumulative_pv -= (cumulative_pv - pv)[starts][group]
+    cumulative_volume -= (cumulative_volume - volume)[starts][group]
+    return cumulative_pv, cumulative_volume
@@ -0,0 +1,163 @@
+import datetime
+import heapq
+import itertools
+from datetime import timezone
+
+from bitfinex_extractor_influxdb.resample import TIMEFRAME_MS
+
+# Length in milliseconds of every timeframe but '1M', whose candles follow the calendar months.
+PERIOD_MS = dict(TIMEFRAME_MS, **{
+    '7D': 7 * 24 * 60 * 60 * 1000,
+    '14D': 14 * 24 * 60 * 60 * 1000,
+})
+
+
+def next_close(candle, timeframe, now):
+    """Return when the candle in progress closes, the first candle close after ``now``.
+
+    :param candle: Open time in milliseconds of a candle of the series, usually the last one stored.
+    :type candle: int
+    :param timeframe: Timeframe of the series.
+    :type timeframe: str
+    :param now: Current time in milliseconds.
+    :type now: int
+    :return: Timestamp in milliseconds.
+    :rtype: int
+    """
+    if timeframe == '1M':
+        month = datetime.datetime.fromtimestamp(max(candle, now) / 1000, tz=timezone.utc)
+        year, month = divmod(month.year * 12 + month.month, 12)
+        return int(datetime.datetime(year, month + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    period = PERIOD_MS[timeframe]
+    return candle + max(1, (now - candle) // period + 1) * period
+
+
+def expected_candles(candle, timeframe, now):
+    """Return how many candles Bitfinex has from ``candle``, included, to ``now``.
+
+    :rtype: int
+    """
+    period = PERIOD_MS.get(timeframe, 31 * 24 * 60 * 60 * 1000)
+    return max(0, now - candle) // period + 1
+
+
+def poll_limit(timeframe, candle, now, maximum):
+    """Return the number of candles to request from ``candle``, those expected up to now and one more.
+
+    :param maximum: Maximum number of candles per request.
+    :type maximum: int
+    :rtype: int
+    """
+    return max(2, min(maximum, expected_candles(candle, timeframe, now) + 1))
+
+
+class PollScheduler:
+    """Series waiting to be polled, ordered by the close of their next candle.
+
+    A series is due ``grace`` seconds after its candle in progress closes, so each one is
+    requested once per candle of its timeframe instead of in every loop. When the new
+    candle is not there yet it is asked again every ``retry_delay`` seconds, up to
+    ``max_retries`` times, and a series behind by more than a page is due again at once.
+
+    :param grace: Seconds after a candle close before requesting it.
+    :type grace: float
+    :param retry_delay: Seconds between two requests of a candle not published yet.
+    :type retry_delay: float
+    :param max_retries: Requests of a candle not published yet before waiting for the next close.
+    :type max_retries: int
+    """
+
+    def __init__(self, grace=5.0, retry_delay=10.0, max_retries=3):
+        self._grace = int(grace * 1000)
+        self._retry_delay = int(retry_delay * 1000)
+        self._max_retries = max_retries
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    @property
+    def series(self):
+        return sorted(self._entries)
+
+    def add(self, pair, timeframe, candle, now):
+        """Schedule a series for the close of its candle in progress.
+
+        :param pair: Pair of the series.
+        :type pair: str
+        :param timeframe: Timeframe of the series.
+        :type timeframe: str
+        :param candle: Open time in milliseconds of the last candle stored.
+        :type candle: int
+        :param now: Current time in milliseconds.
+        :type now: int
+        """
+        # A closed candle may have been stored unfinished, it is requested again right away.
+        if expected_candles(candle, timeframe, now) >= 2:
+            due = now
+        else:
+            due = next_close(candle, timeframe, now) + self._grace
+        self._push((pair, timeframe), due, candle, 0)
+
+    def remove(self, series):
+        """Stop polling series, given as (pair, timeframe) tuples.
+        """
+        for key in series:
+            self._entries.pop(key, None)
+
+    def wait(self, now):
+        """Return the milliseconds until the next series is due, None when there are none.
+
+        :rtype: int
+        """
+        self._drop_stale()
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - now)
+
+    def pop_due(self, now):
+        """Take every series due at ``now``.
+
+        :return: (pair, timeframe, candle) tuples, candle being the open time of the last candle stored.
+        :rtype: list
+        """
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            due.append(key + (self._entries[key][1],))
+            self._drop_stale()
+        return due
+
+    def done(self, pair, timeframe, previous, candle, *, full, now):
+        """Schedule a polled series again.
+
+        :param previous: Open time in milliseconds of the last candle stored before polling.
+        :type previous: int
+        :param candle: Open time in milliseconds of the last candle received.
+        :type candle: int
+        :param full: Whether the response had as many candles as requested, so more may follow.
+        :type full: bool
+        :param now: Current time in milliseconds.
+        :type now: int
+        """
+        key = (pair, timeframe)
+        if key not in self._entries:
+            return
+        attempt = self._entries[key][2]
+        if full:
+            self._push(key, now, candle, 0)
+        elif candle > previous or attempt >= self._max_retries or expected_candles(candle, timeframe, now) < 2:
+            self._push(key, next_close(candle, timeframe, now) + self._grace, candle, 0)
+        else:
+            self._push(key, now + self._retry_delay, candle, attempt + 1)
+
+    def _push(self, key, due, candle, attempt):
+        entry = (due, next(self._counter), key)
+        self._entries[key] = (entry, candle, attempt)
+        heapq.heappush(self._heap, entry)
+
+    def _drop_stale(self):
+        # Entries of removed or rescheduled series are left in the heap and skipped here.
+        while self._heap and (self._heap[0][2] not in self._entries or
+                              self._entries[self._heap[0][2]][0] is not self._heap[0]):
+            heapq.heappop(self._heap)
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+
+def owner(pair, timeframe, workers):
+    """Return the worker a series belongs to, using rendezvous hashing.
+
+    Every worker computes the same answer from the same list of workers, and when a
+    worker joins or leaves only the series it owns, or will own, change hands.
+
+    :param workers: Identifiers of the live workers.
+    :type workers: list
+    :rtype: str
+    """
+    return max(workers, key=lambda worker: _weight(worker, pair, timeframe))
+
+
+def _weight(worker, pair, timeframe):
+    digest = hashlib.sha1(f'{worker}/{pair}/{timeframe}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class ShardRegistry:
+    """Membership of the workers sharing the extraction of the configured series.
+
+    Each worker keeps a row updated in the MySQL ``worker`` table. Workers whose row
+    has not been updated for ``ttl`` seconds are considered dead, so their series are
+    taken over by the remaining ones the next time they compute their shard.
+
+    :param connect: Function returning a new :class:`pymysql.connections.Connection`.
+    :type connect: callable
+    :param worker_id: Unique identifier of this worker.
+    :type worker_id: str
+    :param ttl: Seconds without heartbeats after which a worker is considered dead.
+    :type ttl: int
+    """
+
+    def __init__(self, connect, worker_id, ttl=60):
+        self._connection = connect()
+        self._worker_id = worker_id
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._workers = None
+        self._on_change = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._execute('CREATE TABLE IF NOT EXISTS worker ('
+                      'id VARCHAR(255) NOT NULL PRIMARY KEY, '
+                      'heartbeat TIMESTAMP NOT NULL);')
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def heartbeat(self, worker_id=None):
+        """Mark a worker, this one by default, as alive.
+        """
+        self._execute('INSERT INTO worker (id, heartbeat) VALUES (%s, NOW()) '
+                      'ON DUPLICATE KEY UPDATE heartbeat = NOW();', (worker_id or self.worker_id,))
+
+    def live_workers(self):
+        """Return the workers with a recent heartbeat.
+
+        :rtype: list(str)
+        """
+        rows = self._execute('SELECT id FROM worker WHERE heartbeat >= NOW() - INTERVAL %s SECOND;', (self.ttl,))
+        return sorted({row['id'] for row in rows} | {self.worker_id})
+
+    def owned(self, series):
+        """Filter the series this worker is responsible for.
+
+        :param series: (pair, timeframe) tuples.
+        :type series: list
+        :rtype: list
+        """
+        self.heartbeat()
+        workers = self.live_workers()
+        return [(pair, timeframe) for pair, timeframe in series if owner(pair, timeframe, workers) == self.worker_id]
+
+    def start(self, on_change=None):
+        """Keep sending heartbeats in the background until :meth:`stop` is called.
+
+        The live workers are read again on every heartbeat, so the series can be handed over
+        as soon as a worker joins or leaves.
+
+        :param on_change: Called with the live workers, from the heartbeat thread, whenever they change.
+            Replaces the previous one when the heartbeats were already started.
+        :type on_change: callable
+        """
+        self.heartbeat()
+        self._workers = self.live_workers()
+        self._on_change = on_change
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._beat, name=self.__class__.__name__, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop sending heartbeats and leave the registry, handing the series over to the other workers.
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self._on_change = None
+        self._execute('DELETE FROM worker WHERE id = %s;', (self.worker_id,))
+
+    def close(self):
+        """Close the MySQL connection, leaving the heartbeats already sent in place.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def _beat(self):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+                workers = self.live_workers()
+            except Exception as e:
+                self._logger.warning('Couldnt send heartbeat: %s', e)
+                continue
+            if workers == self._workers:
+                continue
+            self._logger.info('Live workers changed to %s', workers)
+            self._workers = workers
+            on_change = self._on_change
+            if on_change is not None:
+                try:
+                    on_change(workers)
+                except Exception as e:
+                    self._logger.warning('Couldnt hand the series over: %s', e)
+
+    def _execute(self, query, args=None):
+        with self._lock:
+            with self._connection.cursor() as cursor:
+                cursor.execute(query, args)
+                rows = cursor.fetchall()
+            self._connection.commit()
+        return rows
+
+
+def supervise(workers, work, connect, restart_delay=5):
+    """Run the extraction in several local processes, each of them owning a shard of the series.
+
+    Worker identifiers are registered before the processes start, so all of them agree on the
+    shards from the beginning. Processes exiting with an error are started again.
+
+    :param workers: Number of processes.
+    :type workers: int
+    :param work: Extraction run by each process, called with its worker identifier and its index among the
+        processes. It must be picklable.
+    :type work: callable
+    :param connect: Callable returning a new MySQL connection, used to register the workers.
+    :type connect: callable
+    :param restart_delay: Seconds to wait before restarting a failed process.
+    :type restart_delay: float
+    """
+    logger = logging.getLogger('supervise')
+    worker_ids = [f'{socket.gethostname()}-{os.getpid()}-{index}' for index in range(workers)]
+    registry = ShardRegistry(connect, worker_ids[0])
+    try:
+        for worker_id in worker_ids:
+            registry.heartbeat(worker_id)
+    finally:
+        registry.close()
+
+    processes = {worker_id: _spawn(work, worker_id, index) for index, worker_id in enumerate(worker_ids)}
+    while processes:
+        for worker_id, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            if process.exitcode == 0:
+                logger.info('Worker %s finished.', worker_id)
+                del processes[worker_id]
+                continue
+            logger.warning('Worker %s exited with code %s, restarting it.', worker_id, process.exitcode)
+            time.sleep(restart_delay)
+            processes[worker_id] = _spawn(work, worker_id, worker_ids.index(worker_id))
+        time.sleep(1)
+
+
+def _spawn(work, worker_id, index):
+    process = multiprocessing.Process(target=work, args=(worker_id, index), name=worker_id)
+    process.start()
+    return process
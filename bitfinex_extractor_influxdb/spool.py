@@ -0,0 +1,113 @@
+import os
+import threading
+
+SEGMENT_SUFFIX = '.lp'
+
+
+class Spool:
+    """Append-only spool of line protocol on local disk, kept while InfluxDB cannot be written.
+
+    Records are appended to numbered segment files, a new one being started once the current
+    one holds ``segment_bytes``, and are read back segment by segment in the order they were
+    appended. Segments survive restarts and are only removed once fully written into InfluxDB.
+    Once the spool holds ``max_bytes``, further records are refused.
+
+    :param path: Directory holding the segments, created if missing.
+    :type path: str
+    :param max_bytes: Maximum size of all the segments together.
+    :type max_bytes: int
+    :param segment_bytes: Size after which a segment is closed and a new one started.
+    :type segment_bytes: int
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3, segment_bytes=16 * 1024 ** 2):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        # Segment being appended to and its size, None once it is closed.
+        self._segment = None
+        self._segment_size = 0
+        os.makedirs(path, exist_ok=True)
+
+        self._segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path)
+                                if name.endswith(SEGMENT_SUFFIX))
+        self._size = sum(os.path.getsize(self._segment_path(segment)) for segment in self._segments)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def size(self):
+        """Bytes waiting in the spool."""
+        return self._size
+
+    def empty(self):
+        return not self._size
+
+    def append(self, record):
+        """Append a record durably, after every record appended before it.
+
+        :param record: Line protocol, one point per line.
+        :type record: bytes
+        :return: False when the spool is full and the record was refused.
+        :rtype: bool
+        """
+        record = record.rstrip(b'\n') + b'\n'
+        with self._lock:
+            if self._size + len(record) > self._max_bytes:
+                return False
+            if self._segment is None or self._segment_size >= self._segment_bytes:
+                self._rotate()
+            with open(self._segment_path(self._segment), 'ab') as segment_file:
+                segment_file.write(record)
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+            self._segment_size += len(record)
+            self._size += len(record)
+            return True
+
+    def drain(self, write, batch_lines=5000):
+        """Write the oldest segment through ``write`` in batches and remove it.
+
+        The segment being appended to is closed first, so new records go to a new one.
+
+        :param write: Called with a batch of line protocol, raises when it could not be written.
+        :type write: callable
+        :param batch_lines: Maximum number of lines per batch.
+        :type batch_lines: int
+        :return: Bytes drained, 0 when the spool is empty.
+        :rtype: int
+        """
+        with self._lock:
+            if not self._segments:
+                return 0
+            segment = self._segments[0]
+            if segment == self._segment:
+                self._segment = None
+        path = self._segment_path(segment)
+        with open(path, 'rb') as segment_file:
+            lines = segment_file.read().splitlines()
+        for start in range(0, len(lines), batch_lines):
+            write(b'\n'.join(lines[start:start + batch_lines]))
+        with self._lock:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._segments.remove(segment)
+            self._size -= size
+        return size
+
+    def close(self):
+        """Close the segment being appended to, the next record starts a new one.
+        """
+        with self._lock:
+            self._segment = None
+
+    def _rotate(self):
+        self._segment = self._segments[-1] + 1 if self._segments else 0
+        self._segment_size = 0
+        self._segments.append(self._segment)
+
+    def _segment_path(self, segment):
+        return os.path.join(self._path, f'{segment:012d}{SEGMENT_SUFFIX}')
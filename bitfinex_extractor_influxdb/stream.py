@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+
+import websockets
+
+from bitfinex_extractor_influxdb.protocol import ERROR_CODE_SUBSCRIPTION_FAILED, INFO_CODE_RECONNECT, \
+    serialize_lines
+from bitfinex_extractor_influxdb.fetcher import loads
+
+WS_API_URL = 'wss://api-pub.bitfinex.com/ws/2'
+
+# Bitfinex allows a limited number of public channels per connection.
+MAX_SUBSCRIPTIONS = 25
+
+
+class CandleStream:
+    """Live candle updates from the Bitfinex WebSocket API written into InfluxDB.
+
+    Every (pair, timeframe) series is subscribed to its candles channel, spreading the
+    subscriptions over as many connections as needed. The snapshot sent on subscription
+    and every update are buffered and handed to the writer as a single page every
+    ``flush_interval`` seconds. Connections are opened again, and their channels
+    subscribed again, when they are closed, go silent or Bitfinex asks to reconnect.
+    Series can be added and removed while running, without touching the other ones.
+
+    :param series: (pair, timeframe) tuples to follow.
+    :type series: list
+    :param writer: :class:`InfluxWriter` the buffered candles are written through.
+    :type writer: InfluxWriter
+    :param checkpoints: :class:`CheckpointStore` updated with the last written candle of each series. Optional.
+    :type checkpoints: CheckpointStore
+    :param on_candles: Called with the pair, the timeframe and the candles in timestamp order of every series
+        handed to the writer, like the rollups of the series. Optional.
+    :type on_candles: callable
+    :param url: WebSocket API URL.
+    :type url: str
+    :param flush_interval: Seconds between two writes of the buffered candles.
+    :type flush_interval: float
+    :param reconnect_delay: Seconds to wait before opening a closed connection again.
+    :type reconnect_delay: float
+    :param timeout: Seconds without messages, heartbeats included, after which a connection is considered lost.
+    :type timeout: float
+    """
+
+    def __init__(self, series, writer, *, checkpoints=None, on_candles=None, url=WS_API_URL, flush_interval=0.25,
+                 reconnect_delay=1.0, timeout=30.0):
+        self._series = list(series)
+        self._writer = writer
+        self._checkpoints = checkpoints
+        self._on_candles = on_candles
+        self._url = url
+        self._flush_interval = flush_interval
+        self._reconnect_delay = reconnect_delay
+        self._timeout = timeout
+
+        self._buffer = {}
+        self._removed = set()
+        # Connection and channel id of every subscribed series.
+        self._channels = {}
+        self._tasks = []
+        self._stopped = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def series(self):
+        return self._series
+
+    async def run(self):
+        """Follow every series until :meth:`stop` is called.
+        """
+        self._stopped = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._flush_periodically())]
+        self._start_following(self._series)
+        await self._stopped.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush()
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def add(self, series):
+        """Start following new series on new connections. Must be called from the running event loop.
+
+        :param series: (pair, timeframe) tuples.
+        :type series: list
+        """
+        added = [item for item in series if item not in self._series]
+        self._removed.difference_update(added)
+        self._series.extend(added)
+        self._start_following(added)
+
+    def remove(self, series):
+        """Stop following series. Their channels are unsubscribed and not subscribed again on reconnection.
+        Must be called from the running event loop.
+
+        :param series: (pair, timeframe) tuples.
+        :type series: list
+        """
+        self._removed.update(series)
+        self._series = [item for item in self._series if item not in self._removed]
+        for item in series:
+            if item in self._channels:
+                connection, chan_id = self._channels.pop(item)
+                self._tasks.append(asyncio.ensure_future(self._unsubscribe(connection, chan_id)))
+
+    async def _unsubscribe(self, connection, chan_id):
+        try:
+            await connection.send(json.dumps({'event': 'unsubscribe', 'chanId': chan_id}))
+        except Exception as e:
+            self._logger.warning('Couldnt unsubscribe from channel %s: %s', chan_id, e)
+
+    def _start_following(self, series):
+        for i in range(0, len(series), MAX_SUBSCRIPTIONS):
+            self._tasks.append(asyncio.ensure_future(self._follow(series[i:i + MAX_SUBSCRIPTIONS])))
+
+    async def _follow(self, series):
+        while not self._stopped.is_set():
+            series = [item for item in series if item not in self._removed]
+            if not series:
+                return
+            try:
+                async with websockets.connect(self._url) as connection:
+                    await self._listen(connection, series)
+            except Exception as e:
+                self._logger.warning('WebSocket connection lost: %s', e)
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _listen(self, connection, series):
+        keys = {f'trade:{timeframe}:{pair}': (pair, timeframe) for pair, timeframe in series}
+        for key in keys:
+            await connection.send(json.dumps({'event': 'subscribe', 'channel': 'candles', 'key': key}))
+
+        channels = {}
+        try:
+            await self._receive(connection, keys, channels)
+        finally:
+            for item in channels.values():
+                if self._channels.get(item, (None,))[0] is connection:
+                    del self._channels[item]
+
+    async def _receive(self, connection, keys, channels):
+        while 1:
+            message = loads(await asyncio.wait_for(connection.recv(), self._timeout))
+            if isinstance(message, dict):
+                if message.get('event') == 'subscribed':
+                    channels[message['chanId']] = keys[message['key']]
+                    if keys[message['key']] in self._removed:
+                        await self._unsubscribe(connection, message['chanId'])
+                    else:
+                        self._channels[keys[message['key']]] = (connection, message['chanId'])
+                elif message.get('event') == 'error' and message.get('code') == ERROR_CODE_SUBSCRIPTION_FAILED:
+                    self._logger.error('Couldnt subscribe to candles: %s', message.get('msg'))
+                elif message.get('event') == 'info' and message.get('code') == INFO_CODE_RECONNECT:
+                    self._logger.info('Bitfinex asked to reconnect.')
+                    return
+                continue
+
+            channel, data = message[0], message[1]
+            if channel not in channels or channels[channel] in self._removed or data == 'hb' or not data:
+                continue
+            # Snapshots are lists of candles, updates a single candle.
+            candles = data if isinstance(data[0], list) else [data]
+            self._buffer.setdefault(channels[channel], {}).update({candle[0]: candle for candle in candles})
+
+    async def _flush_periodically(self):
+        while 1:
+            await asyncio.sleep(self._flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, {}
+        pages = {series: [candles[timestamp] for timestamp in sorted(candles)] for series, candles in buffer.items()}
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, pages)
+
+    def _write(self, pages):
+        record = b'\n'.join(serialize_lines(pair, timeframe, page) for (pair, timeframe), page in pages.items())
+        last_candles = {series: page[-1][0] for series, page in pages.items()}
+        self._writer.write(record, on_success=self._checkpoint(last_candles))
+        if self._on_candles is None:
+            return
+        for (pair, timeframe), page in pages.items():
+            try:
+                self._on_candles(pair, timeframe, page)
+            except Exception as e:
+                self._logger.warning('Couldnt handle the candles of %s - %s: %s', pair, timeframe, e)
+
+    def _checkpoint(self, last_candles):
+        if self._checkpoints is None:
+            return None
+
+        def save():
+            for (pair, timeframe), timestamp in last_candles.items():
+                self._checkpoints.set(pair, timeframe, timestamp)
+        return save
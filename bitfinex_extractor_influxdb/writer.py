@@ -0,0 +1,388 @@
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from functools import partial
+
+from bitfinex_extractor_influxdb import metrics
+
+# Line protocol timestamps are in nanoseconds, the value of :attr:`WritePrecision.NS`.
+WRITE_PRECISION = 'ns'
+
+
+class WriteTracker:
+    """Outcome of the pages of one series queued into an :class:`InfluxWriter`.
+
+    Pages are written in the background, so a page dropped after every retry is only known
+    later. Each page is tracked with the position its series has to be extracted again
+    from if it is dropped, and :meth:`wait` returns the earliest of those positions once
+    every tracked page has been written or dropped.
+
+    The callback of a written page only runs once every page from an earlier position has
+    been written, and never after a page from an earlier position was dropped, so checkpoints
+    never move past a hole.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._positions = {}
+        self._written_pages = []
+        self._sequence = itertools.count()
+        self._failed = None
+
+    @property
+    def failed(self):
+        """Earliest position of the dropped pages, None while none was dropped."""
+        with self._condition:
+            return self._failed
+
+    def write(self, writer, record, position, on_success=None):
+        """Queue a page into ``writer``.
+
+        :param writer: Writer the page is queued into.
+        :type writer: InfluxWriter
+        :param record: Line protocol, one point per line.
+        :type record: bytes
+        :param position: Timestamp in milliseconds the page was requested from.
+        :type position: int
+        :param on_success: Called without arguments once the page and every page from an earlier
+            position have been written.
+        :type on_success: callable
+        """
+        if not record:
+            return
+        with self._condition:
+            self._pending += 1
+            self._positions[position] = self._positions.get(position, 0) + 1
+        writer.write(record, on_success=partial(self._written, position, on_success),
+                     on_failure=partial(self._dropped, position))
+
+    def wait(self):
+        """Block until every tracked page has been written or dropped.
+
+        :return: Earliest position of the dropped pages, None when all of them were written.
+        :rtype: int
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._pending)
+            return self._failed
+
+    def _written(self, position, on_success):
+        try:
+            with self._condition:
+                self._release(position)
+                if on_success is not None:
+                    heapq.heappush(self._written_pages, (position, next(self._sequence), on_success))
+                ready = self._ready()
+            for callback in ready:
+                callback()
+        finally:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+
+    def _dropped(self, position, error):
+        with self._condition:
+            self._release(position)
+            self._pending -= 1
+            self._failed = position if self._failed is None else min(self._failed, position)
+            self._condition.notify_all()
+
+    def _release(self, position):
+        self._positions[position] -= 1
+        if not self._positions[position]:
+            del self._positions[position]
+
+    def _ready(self):
+        # Callbacks of the pages before the earliest page still pending or dropped.
+        boundaries = list(self._positions)
+        if self._failed is not None:
+            boundaries.append(self._failed)
+        boundary = min(boundaries, default=None)
+        ready = []
+        while self._written_pages and (boundary is None or self._written_pages[0][0] < boundary):
+            ready.append(heapq.heappop(self._written_pages)[2])
+        return ready
+
+
+class WriterOptions:
+    """Batching, retry and queueing settings of an :class:`InfluxWriter`.
+
+    :param batch_size: Number of points after which a batch is sent without waiting for more pages.
+    :type batch_size: int
+    :param flush_interval: Seconds to wait for more pages before sending an incomplete batch.
+    :type flush_interval: float
+    :param max_retries: Times a failed batch is retried before being dropped, notifying every page in it.
+    :type max_retries: int
+    :param retry_interval: Seconds before the first retry, doubled on every attempt.
+    :type retry_interval: float
+    :param jitter_interval: Maximum random seconds added to every retry wait.
+    :type jitter_interval: float
+    :param queue_size: Maximum number of pages waiting to be written.
+    :type queue_size: int
+    :param drain_interval: Seconds between two attempts to drain the spool.
+    :type drain_interval: float
+    """
+
+    def __init__(self, *, batch_size=5000, flush_interval=1.0, max_retries=5, retry_interval=1.0,
+                 jitter_interval=0.5, queue_size=100, drain_interval=5.0):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_retries = max_retries
+        self._retry_interval = retry_interval
+        self._jitter_interval = jitter_interval
+        self._queue_size = queue_size
+        self._drain_interval = drain_interval
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def flush_interval(self):
+        return self._flush_interval
+
+    @property
+    def max_retries(self):
+        return self._max_retries
+
+    @property
+    def retry_interval(self):
+        return self._retry_interval
+
+    @property
+    def jitter_interval(self):
+        return self._jitter_interval
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def drain_interval(self):
+        return self._drain_interval
+
+    def replace(self, **changes):
+        """Return a copy of the options with some of the settings changed.
+
+        :param changes: Settings to change, with the names of the constructor arguments.
+        :rtype: WriterOptions
+        """
+        settings = {'batch_size': self._batch_size, 'flush_interval': self._flush_interval,
+                    'max_retries': self._max_retries, 'retry_interval': self._retry_interval,
+                    'jitter_interval': self._jitter_interval, 'queue_size': self._queue_size,
+                    'drain_interval': self._drain_interval}
+        settings.update(changes)
+        return WriterOptions(**settings)
+
+
+class InfluxWriter:
+    """Long-lived write pipeline into InfluxDB.
+
+    Pages serialized as line protocol are queued by the extraction workers and written
+    by a background thread, so fetching from Bitfinex keeps going while InfluxDB is busy.
+    Queued pages are grouped into a batch until it holds ``options.batch_size`` points or
+    ``options.flush_interval`` seconds have passed, and every batch is sent through the same
+    :class:`WriteApi`. The queue is bounded: when InfluxDB is slower than the exchange,
+    :meth:`write` blocks and the workers are slowed down.
+
+    :param influx_client: :class:`InfluxDBClient` used to create the write API.
+    :type influx_client: InfluxDBClient
+    :param bucket: InfluxDB Bucket name.
+    :type bucket: str
+    :param org: InfluxDB organization name.
+    :type org: str
+    :param options: :class:`WriterOptions` batching, retry and queueing settings, the defaults when missing.
+    :type options: WriterOptions
+    :param spool: :class:`Spool` batches are appended to instead of being dropped when they cannot be written.
+        While it holds anything every batch goes through it, so points are written in the order they were queued,
+        and a background thread drains it every ``options.drain_interval`` seconds. Optional.
+    :type spool: Spool
+    """
+
+    def __init__(self, influx_client, bucket, org, options=None, *, spool=None):
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
+        self._write_api = influx_client.write_api(write_options=SYNCHRONOUS)
+        self._bucket = bucket
+        self._org = org
+        self._options = options or WriterOptions()
+        self._spool = spool
+
+        self._queue = queue.Queue(maxsize=self._options.queue_size)
+        self._thread = None
+        self._drainer = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def batch_size(self):
+        return self._options.batch_size
+
+    @property
+    def flush_interval(self):
+        return self._options.flush_interval
+
+    @property
+    def spool(self):
+        return self._spool
+
+    @property
+    def pending(self):
+        """Number of pages waiting in the queue."""
+        return self._queue.qsize()
+
+    def write(self, record, on_success=None, on_failure=None):
+        """Queue a page of line protocol, blocking while the queue is full.
+
+        :param record: Line protocol, one point per line.
+        :type record: bytes
+        :param on_success: Called without arguments once the page has been written.
+        :type on_success: callable
+        :param on_failure: Called with the exception once the page has been dropped.
+        :type on_failure: callable
+        """
+        if not record:
+            return
+        self._start()
+        self._queue.put((record, on_success, on_failure))
+        metrics.QUEUE_DEPTH.set(self._queue.qsize())
+
+    def flush(self):
+        """Block until every queued page has been written or dropped.
+        """
+        self._queue.join()
+
+    def close(self):
+        """Write every queued page, and the spool if InfluxDB can be written, and stop the background threads.
+
+        The writer can still be used afterwards, a new thread is started on the next write.
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            if self._drainer is not None:
+                self._stopped.set()
+                self._drainer.join()
+                self._drainer = None
+                self._stopped.clear()
+                # Whatever cannot be written now stays in the spool for the next run.
+                self._drain_spool()
+                self._spool.close()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._consume, name=self.__class__.__name__, daemon=True)
+                self._thread.start()
+            if self._spool is not None and self._drainer is None:
+                self._drainer = threading.Thread(target=self._drain, name=f'{self.__class__.__name__}-drain',
+                                                 daemon=True)
+                self._drainer.start()
+
+    def _consume(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            size = item[0].count(b'\n') + 1
+            deadline = time.monotonic() + self.flush_interval
+            while size < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += item[0].count(b'\n') + 1
+
+            metrics.QUEUE_DEPTH.set(self._queue.qsize())
+            lines = b'\n'.join(record for record, _, _ in batch)
+            # Spooled points are written first, later versions of the same points must not be overwritten by them.
+            if self._spool is not None and not self._spool.empty():
+                error = self._spool_batch(lines, size)
+            else:
+                error = self._write_batch(lines, size)
+                if error is not None and self._spool is not None:
+                    error = self._spool_batch(lines, size)
+            self._notify(batch, error)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+
+    def _notify(self, batch, error):
+        for _, on_success, on_failure in batch:
+            callback = on_success if error is None else on_failure and partial(on_failure, error)
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                self._logger.warning('Write callback failed: %s', e)
+
+    def _write_batch(self, lines, size):
+        # Returns the last error when the batch could not be written, None once it is.
+        error = None
+        for attempt in range(self._options.max_retries + 1):
+            if attempt:
+                wait = self._options.retry_interval * 2 ** (attempt - 1) + \
+                    random.uniform(0, self._options.jitter_interval)
+                self._logger.warning('Couldnt write into INFLUXDB, retrying in %.1f seconds: %s', wait, error)
+                time.sleep(wait)
+            try:
+                with metrics.STAGE_SECONDS.time(('write',)):
+                    self._write_api.write(record=lines, org=self._org, bucket=self._bucket,
+                                          write_precision=WRITE_PRECISION)
+                metrics.WRITTEN_POINTS.inc(size)
+                return None
+            except Exception as e:
+                error = e
+        if self._spool is None:
+            self._logger.error('Couldnt write %s points into INFLUXDB, dropping them: %s', size, error)
+        return error
+
+    def _spool_batch(self, lines, size):
+        try:
+            spooled = self._spool.append(lines)
+        except OSError as e:
+            self._logger.error('Couldnt spool %s points, dropping them: %s', size, e)
+            return e
+        if not spooled:
+            self._logger.error('Spool is full, dropping %s points', size)
+            return OSError(f'Spool is full, dropped {size} points')
+        metrics.SPOOL_BYTES.set(self._spool.size)
+        return None
+
+    def _drain(self):
+        while not self._stopped.wait(self._options.drain_interval):
+            self._drain_spool()
+
+    def _drain_spool(self):
+        try:
+            while self._spool.drain(self._write_spooled, self.batch_size):
+                metrics.SPOOL_BYTES.set(self._spool.size)
+                if self._stopped.is_set():
+                    return
+        except Exception as e:
+            self._logger.warning('Couldnt drain spool into INFLUXDB, %s bytes waiting: %s', self._spool.size, e)
+
+    def _write_spooled(self, lines):
+        with metrics.STAGE_SECONDS.time(('write',)):
+            self._write_api.write(record=lines, org=self._org, bucket=self._bucket, write_precision=WRITE_PRECISION)
+        metrics.WRITTEN_POINTS.inc(lines.count(b'\n') + 1)
@@ -29,7 +29,24 @@ setup(
 
     packages=find_packages(exclude=('tests',)),
 
-    install_requires=[],
+    install_requires=[
+        'influxdb-client',
+        'numpy',
+        'PyMySQL',
+        'pandas',
+        'python-dotenv',
+        'pendulum',
+        'requests',
+        'websockets',
+    ],
+
+    extras_require={
+        'cache': ['pyarrow'],
+    },
+
+    entry_points={
+        'console_scripts': ['bitfinex-extractor-influxdb = bitfinex_extractor_influxdb.cli:main'],
+    },
 
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
@@ -0,0 +1,62 @@
+from bitfinex_extractor_influxdb.backfill import Backfill, Coverage, plan_windows
+
+
+def test_plan_windows():
+    assert plan_windows(0, 99, 4) == [(0, 24), (25, 49), (50, 74), (75, 99)]
+
+
+def test_plan_windows_uneven():
+    windows = plan_windows(10, 20, 3)
+    assert windows[0][0] == 10 and windows[-1][1] == 20
+    assert all(windows[i][1] + 1 == windows[i + 1][0] for i in range(len(windows) - 1))
+
+
+def test_plan_windows_small_range():
+    assert plan_windows(5, 6, 8) == [(5, 5), (6, 6)]
+    assert plan_windows(6, 5, 8) == []
+
+
+def test_plan_windows_aligned():
+    assert plan_windows(5, 99, 4, alignment=10) == [(5, 19), (20, 49), (50, 69), (70, 99)]
+    # Windows left empty by the alignment are dropped.
+    assert plan_windows(5, 12, 4, alignment=10) == [(5, 9), (10, 12)]
+
+
+def test_backfill_windows():
+    backfill = Backfill(0, 10 * 3600000 - 1, period=60000, timeframes=['15m', '1h'])
+    assert all(start % 3600000 == 0 for start, _ in backfill.windows(3))
+    assert Backfill(0, 99).windows(4) == plan_windows(0, 99, 4)
+
+
+def test_coverage_resolution():
+    # Candles one period apart are consecutive, nothing is missing between them.
+    coverage = Coverage(0, 999, resolution=60)
+    assert coverage.add(0, 480)
+    assert coverage.add(540, 900)
+    assert coverage.contiguous_end() == 900
+    assert not coverage.add(600, 660)
+    coverage.add(961, 999)
+    assert coverage.intervals == [(0, 900), (961, 999)]
+
+
+def test_coverage_merge_and_missing():
+    coverage = Coverage(0, 99)
+    assert coverage.contiguous_end() is None
+    assert coverage.add(50, 74)
+    assert coverage.add(0, 24)
+    assert coverage.contiguous_end() == 24
+    assert coverage.missing() == [(25, 49), (75, 99)]
+    assert coverage.add(25, 49)
+    assert coverage.contiguous_end() == 74
+    assert coverage.intervals == [(0, 74)]
+    assert not coverage.complete()
+    assert coverage.add(75, 99)
+    assert coverage.complete()
+
+
+def test_coverage_overlap():
+    coverage = Coverage(0, 99)
+    assert coverage.add(10, 20)
+    assert not coverage.add(20, 30)
+    assert not coverage.add(0, 10)
+    assert coverage.intervals == [(0, 30)]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from bitfinex_extractor_influxdb.cache import PageCache  # noqa: E402
+
+
+def _page(start, count):
+    return [[1612137600000 + (start + i) * 60000, 1.0 + i, 2.0, 3.0, 0.5, 10.0] for i in range(count)]
+
+
+def test_append_and_read(tmp_path):
+    cache = PageCache(str(tmp_path), row_group_size=100)
+    cache.append('tBTCUSD', '1m', _page(0, 80))
+    cache.append('tBTCUSD', '1m', _page(79, 80))
+    cache.append('tBTCUSD', '1h', _page(0, 3))
+    cache.close()
+    assert cache.series() == [('tBTCUSD', '1h'), ('tBTCUSD', '1m')]
+    candles = np.concatenate(list(cache.pages('tBTCUSD', '1m')))
+    # The repeated candle at the page boundary is stored once, keeping the last one received.
+    assert len(candles) == 159
+    assert (np.diff(candles[:, 0]) == 60000).all()
+    assert candles[79].tolist() == _page(79, 1)[0]
+
+
+def test_pages_size(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.append('tBTCUSD', '1m', _page(0, 250))
+    cache.close()
+    assert [len(page) for page in cache.pages('tBTCUSD', '1m', size=100)] == [100, 100, 50]
+
+
+def test_parts_per_run(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.append('tBTCUSD', '1m', _page(0, 10))
+    cache.close()
+    cache.append('tBTCUSD', '1m', _page(10, 10))
+    cache.close()
+    assert len(list((tmp_path / 'tBTCUSD' / '1m').iterdir())) == 2
+    assert sum(len(page) for page in PageCache(str(tmp_path)).pages('tBTCUSD', '1m')) == 20
+
+
+def test_missing_series(tmp_path):
+    cache = PageCache(str(tmp_path / 'cache'))
+    assert cache.series() == []
+    assert list(cache.pages('tBTCUSD', '1m')) == []
+
+
+def test_pages_sorted(tmp_path):
+    # Windows fetched in parallel and repaired holes are cached out of order.
+    cache = PageCache(str(tmp_path), row_group_size=10)
+    cache.append('tBTCUSD', '1m', _page(30, 10))
+    cache.append('tBTCUSD', '1m', _page(0, 15))
+    cache.append('tBTCUSD', '1m', _page(14, 16))
+    cache.close()
+    cache.append('tBTCUSD', '1m', _page(5, 3))
+    cache.close()
+    pages = list(cache.pages('tBTCUSD', '1m', size=8))
+    assert all(len(page) <= 8 for page in pages)
+    timestamps = np.concatenate([page.timestamps for page in pages])
+    assert timestamps.tolist() == [1612137600000 + i * 60000 for i in range(40)]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from bitfinex_extractor_influxdb.candles import CANDLE_DTYPE, CandleBuffer
+
+
+def _response(start, count, close=2.0):
+    return [[1612137600000 + (start + i) * 60000, 1.0, close, 3.0, 0.5, 10.0] for i in range(count)]
+
+
+def test_from_response():
+    page = CandleBuffer.from_response(_response(0, 3)[::-1])
+    assert len(page) == 3
+    assert page.candles.dtype == CANDLE_DTYPE
+    assert page.candles.itemsize == 48
+    assert page.last_timestamp == 1612137600000 + 2 * 60000
+    assert np.asarray(page, dtype=np.float64).tolist() == _response(0, 3)
+
+
+def test_empty():
+    page = CandleBuffer.from_response([])
+    assert len(page) == 0
+    assert page.last_timestamp is None
+    assert np.asarray(page).shape == (0, 6)
+
+
+def test_merge_keeps_later_versions():
+    merged = CandleBuffer.from_response(_response(0, 3)).merge(CandleBuffer.from_response(_response(2, 3, 4.0)))
+    assert merged.timestamps.tolist() == [1612137600000 + i * 60000 for i in range(5)]
+    assert merged.candles['close'].tolist() == [2.0, 2.0, 4.0, 4.0, 4.0]
+
+
+def test_difference_drops_unchanged_overlap():
+    previous = CandleBuffer.from_response(_response(0, 3))
+    page = CandleBuffer.from_response(_response(2, 3))
+    assert page.difference(previous).timestamps.tolist() == page.timestamps[1:].tolist()
+    assert page.difference(None) is page
+
+
+def test_difference_keeps_changed_overlap():
+    previous = CandleBuffer.from_response(_response(0, 3))
+    page = CandleBuffer.from_response(_response(2, 3, 4.0))
+    assert len(page.difference(previous)) == 3
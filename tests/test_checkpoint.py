@@ -0,0 +1,41 @@
+from bitfinex_extractor_influxdb.checkpoint import CheckpointStore
+
+
+def test_get_missing(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    assert store.get('tBTCUSD', '1m') is None
+    assert store.all() == {}
+
+
+def test_set_and_get(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    store.set('tBTCUSD', '1m', 1612137600000)
+    store.set('tBTCUSD', '1h', 1612137600000)
+    store.set('tBTCUSD', '1m', 1612137660000)
+    assert store.get('tBTCUSD', '1m') == 1612137660000
+    assert store.all() == {('tBTCUSD', '1m'): 1612137660000, ('tBTCUSD', '1h'): 1612137600000}
+
+
+def test_never_moves_backwards(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    store.set('tBTCUSD', '1m', 1612137660000)
+    store.set('tBTCUSD', '1m', 1612137600000)
+    assert store.get('tBTCUSD', '1m') == 1612137660000
+
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'checkpoints.sqlite')
+    store = CheckpointStore(path)
+    store.set('tBTCUSD', '1m', 1612137600000)
+    store.close()
+    assert CheckpointStore(path).get('tBTCUSD', '1m') == 1612137600000
+
+
+def test_checked_ranges(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    store.add_checked('tBTCUSD', '1m', 1612137720000, 1612137780000)
+    store.add_checked('tBTCUSD', '1m', 1612137600000, 1612137600000)
+    store.add_checked('tBTCUSD', '1m', 1612137600000, 1612137600000)
+    store.add_checked('tBTCUSD', '1h', 1612137600000, 1612141200000)
+    assert store.checked('tBTCUSD', '1m') == [(1612137600000, 1612137600000), (1612137720000, 1612137780000)]
+    assert store.checked('tIOTUSD', '1m') == []
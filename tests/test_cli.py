@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from mock import patch
+
+from bitfinex_extractor_influxdb import cli
+
+
+@patch("bitfinex_extractor_influxdb.cli.configure")
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync")
+def test_default_command(mock_data_sync, mock_configure):
+    assert cli.main([]) == 0
+    assert mock_configure.call_count == 1
+    assert mock_data_sync.return_value.run.call_count == 1
+
+
+@patch("bitfinex_extractor_influxdb.cli.configure")
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync")
+def test_concurrent_command(mock_data_sync, mock_configure):
+    cli.main(['poll', '--max-concurrency', '8'])
+    mock_data_sync.return_value.poll.assert_called_once_with(max_concurrency=8)
+    cli.main(['run-async'])
+    mock_data_sync.return_value.run_async.assert_called_once_with(max_concurrency=4)
+    cli.main(['replay'])
+    mock_data_sync.return_value.replay.assert_called_once_with()
+
+
+@patch("bitfinex_extractor_influxdb.cli.configure")
+@patch("bitfinex_extractor_influxdb.sharding.supervise")
+def test_supervise(mock_supervise, mock_configure):
+    cli.main(['supervise', '3', '--mode', 'run-async'])
+    workers, work, _ = mock_supervise.call_args.args
+    assert workers == 3
+    # Modes are named as the commands and mapped to DataSync methods.
+    assert (work.func, work.args) == (cli.work, ('run_async',))
+    with pytest.raises(SystemExit):
+        cli.main(['supervise', '3', '--mode', 'run_async'])
+
+
+@patch("bitfinex_extractor_influxdb.cli.configure")
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync")
+@patch.dict(os.environ, {'METRICS_PORT': '9100'})
+def test_work(mock_data_sync, mock_configure):
+    cli.work('stream', 'worker-1', 2)
+    assert os.environ['WORKER_ID'] == 'worker-1'
+    assert os.environ['METRICS_PORT'] == '9102'
+    mock_data_sync.return_value.stream.assert_called_once_with()
+
+
+def test_unknown_command():
+    with pytest.raises(SystemExit):
+        cli.main(['extract'])
+
+
+def test_lazy_imports():
+    # Clients and their dependencies are only imported once they are used.
+    modules = ('influxdb_client', 'pandas', 'pyarrow', 'requests', 'pendulum', 'pymysql')
+    code = ('import sys\n'
+            'import bitfinex_extractor_influxdb.cli\n'
+            'import bitfinex_extractor_influxdb.exchange_db_sync\n'
+            f'print(",".join(module for module in {modules!r} if module in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ''
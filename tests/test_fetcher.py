@@ -0,0 +1,30 @@
+import pickle
+
+from mock import patch, MagicMock
+
+from bitfinex_extractor_influxdb import fetcher
+from bitfinex_extractor_influxdb.fetcher import CandleFetcher
+
+url = 'https://api-pub.bitfinex.com/v2/candles/trade:1m:tBTCUSD/hist?limit=1000&start=1612137600000&sort=1'
+
+
+@patch('requests.Session.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
+def test_fetch():
+    rate_limiter = MagicMock()
+    candle_fetcher = CandleFetcher(rate_limiter=rate_limiter, timeout=10, connect_timeout=2)
+    assert candle_fetcher.fetch(url) == [[1612137600000, 33117.79931925, 57774, 57855, 32333, 200196.55757341]]
+    assert rate_limiter.acquire.call_count == 1
+    assert candle_fetcher.session.get.call_args.kwargs['timeout'] == (2, 10)
+
+
+def test_session_configuration():
+    candle_fetcher = CandleFetcher(retries=5, pool_size=4)
+    adapter = candle_fetcher.session.get_adapter(url)
+    assert adapter.max_retries.total == 5
+    assert adapter._pool_maxsize == 4
+    assert 'gzip' in candle_fetcher.session.headers['Accept-Encoding']
+
+
+@patch('bitfinex_extractor_influxdb.fetcher.orjson', None)
+def test_loads_without_orjson():
+    assert fetcher.loads(b'["error", 11010, "ratelimit: error"]') == ['error', 11010, 'ratelimit: error']
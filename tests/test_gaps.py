@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+
+from mock import MagicMock
+from influxdb_client.client.flux_table import FluxRecord
+
+from bitfinex_extractor_influxdb.gaps import GapScanner, coalesce_gaps, find_gaps, unchecked
+
+minute = 60 * 1000
+start = 1612137600000
+
+
+def test_find_gaps():
+    timestamps = [start, start + minute, start + 4 * minute, start + 5 * minute, start + 7 * minute]
+    assert find_gaps(timestamps, minute) == [(start + 2 * minute, start + 3 * minute),
+                                             (start + 6 * minute, start + 6 * minute)]
+
+
+def test_find_gaps_continuous():
+    assert find_gaps([start + i * minute for i in range(100)], minute) == []
+    assert find_gaps([], minute) == []
+
+
+def _records(timestamps):
+    return [FluxRecord(0, {'_time': datetime.fromtimestamp(timestamp / 1000, timezone.utc)})
+            for timestamp in timestamps]
+
+
+def test_scan_chunks():
+    stored = [start + i * minute for i in range(30) if i not in (9, 10, 11, 20)]
+    query_api = MagicMock()
+    query_api.query_stream.side_effect = lambda query, org: iter(_records(
+        [timestamp for timestamp in stored
+         if int(query.split('start: time(v: ')[1].split(')')[0]) <= timestamp * 1000000 <
+         int(query.split('stop: time(v: ')[1].split(')')[0])]))
+    scanner = GapScanner(query_api, 'bucket', 'org', chunk_size=10)
+    gaps = list(scanner.scan('tBTCUSD', '1m', start, start + 29 * minute))
+    assert gaps == [(start + 9 * minute, start + 11 * minute), (start + 20 * minute, start + 20 * minute)]
+    assert query_api.query_stream.call_count == 3
+
+
+def test_coalesce_gaps():
+    gaps = [(start + 2 * minute, start + 3 * minute), (start + 8 * minute, start + 8 * minute),
+            (start + 20 * minute, start + 21 * minute)]
+    assert coalesce_gaps(gaps, minute, 10) == [(start + 2 * minute, start + 8 * minute),
+                                               (start + 20 * minute, start + 21 * minute)]
+    assert coalesce_gaps(gaps, minute, 1) == gaps
+    # Widened to whole quarters, overlapping windows are merged whatever their length.
+    assert coalesce_gaps(gaps, minute, 1, 15 * minute) == [(start, start + 29 * minute)]
+
+
+def test_unchecked():
+    gaps = [(start + 2 * minute, start + 3 * minute), (start + 8 * minute, start + 9 * minute)]
+    assert unchecked(gaps, []) == gaps
+    assert unchecked(gaps, [(start + 2 * minute, start + 3 * minute)]) == gaps[1:]
+    assert unchecked(gaps, [(start + 7 * minute, start + 8 * minute)]) == gaps
+    assert unchecked(gaps, [(start + 7 * minute, start + 8 * minute), (start + 8 * minute, start + 10 * minute),
+                            (start, start + minute)]) == gaps[:1]
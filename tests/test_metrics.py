@@ -0,0 +1,53 @@
+from urllib.request import urlopen
+
+import pytest
+
+from bitfinex_extractor_influxdb import metrics
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.enable()
+    yield
+    metrics.disable()
+
+
+def test_disabled_metrics_are_not_collected():
+    metrics.CANDLES.inc(10, ('1m',))
+    with metrics.STAGE_SECONDS.time(('fetch',)):
+        pass
+    assert metrics.CANDLES.value(('1m',)) is None
+    assert metrics.STAGE_SECONDS.value(('fetch',)) is None
+
+
+def test_counter_and_gauge(enabled_metrics):
+    metrics.CANDLES.inc(10, ('1m',))
+    metrics.CANDLES.inc(5, ('1m',))
+    metrics.SERIES_LAG.set(60, ('tBTCUSD', '1m'))
+    metrics.SERIES_LAG.set(30, ('tBTCUSD', '1m'))
+    assert metrics.CANDLES.value(('1m',)) == 15
+    assert metrics.SERIES_LAG.value(('tBTCUSD', '1m')) == 30
+
+
+def test_histogram(enabled_metrics):
+    metrics.STAGE_SECONDS.observe(0.003, ('write',))
+    metrics.STAGE_SECONDS.observe(20, ('write',))
+    with metrics.STAGE_SECONDS.time(('write',)):
+        pass
+    lines = metrics.render().split('\n')
+    assert 'bitfinex_extractor_stage_seconds_bucket{stage="write",le="0.001"} 1' in lines
+    assert 'bitfinex_extractor_stage_seconds_bucket{stage="write",le="0.005"} 2' in lines
+    assert 'bitfinex_extractor_stage_seconds_bucket{stage="write",le="+Inf"} 3' in lines
+    assert 'bitfinex_extractor_stage_seconds_count{stage="write"} 3' in lines
+    assert '# TYPE bitfinex_extractor_stage_seconds histogram' in lines
+
+
+def test_serve_metrics():
+    metrics.enable(port=0, address='127.0.0.1')
+    try:
+        metrics.RATE_LIMIT_HITS.inc()
+        port = metrics._server.server_address[1]
+        body = urlopen(f'http://127.0.0.1:{port}/metrics').read().decode()
+        assert 'bitfinex_extractor_rate_limit_hits_total 1' in body.split('\n')
+    finally:
+        metrics.disable()
@@ -1,8 +1,15 @@
+import asyncio
+import json
 import os
 
 from mock import patch, MagicMock, Mock
-from bitfinex_extractor_influxdb import exchange_db_sync
+from bitfinex_extractor_influxdb import exchange_db_sync, metrics, protocol, sharding
 import pickle
+import numpy as np
+import pytest
+from datetime import datetime, timezone
+
+from influxdb_client.client.flux_table import FluxTable, FluxRecord
 
 mock_pairs = ['tBTCUSD', 'tIOTUSD', 'tLTCBTC']
 mock_timeframes = ['1m', '15m', '1h']
@@ -21,6 +28,11 @@ environment_variables = {
     "INFLUX_BUCKET": "INFLUXDB_BUCKET",
     "STARTING_YEAR": "1970",
     "REQUEST_DELAY": "1",
+    "REQUESTS_PER_MINUTE": "60000",
+    "REQUEST_BURST": "100",
+    "INFLUX_FLUSH_INTERVAL": "0.01",
+    "INFLUX_RETRY_INTERVAL": "0",
+    "INFLUX_JITTER_INTERVAL": "0",
 }
 
 
@@ -60,6 +72,9 @@ def test_initialize(mock_pymsql, mock_query_pairs, mock_query_timeframes):
     mock_query_timeframes.return_value = mock_timeframes
 
     sync = exchange_db_sync.DataSync()
+    # Connections are established on first use.
+    assert not mock_pymsql.called
+    assert sync.mysql_cursor is mock_pymsql.return_value.cursor.return_value
     assert sync.pairs == mock_pairs
     assert sync.timeframes == mock_timeframes
     assert sync.bucket == environment_variables['INFLUX_BUCKET']
@@ -80,6 +95,7 @@ def test_query_timeframes():
     assert sync.query_timeframes() == mock_timeframes
 
 
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._load_watermarks", MagicMock())
 @patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._extract_series")
 def test_run(mock_extract_series):
     sync = test_initialize()
@@ -87,6 +103,25 @@ def test_run(mock_extract_series):
     assert mock_extract_series.call_count == len(mock_pairs) * len(mock_timeframes)
 
 
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._load_watermarks", MagicMock())
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._extract_series")
+def test_run_async(mock_extract_series):
+    sync = test_initialize()
+    sync.run_async(max_concurrency=2)
+    assert mock_extract_series.call_count == len(mock_pairs) * len(mock_timeframes)
+    assert {call.args for call in mock_extract_series.call_args_list} == \
+           {(pair, timeframe) for pair in mock_pairs for timeframe in mock_timeframes}
+
+
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._load_watermarks", MagicMock())
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._extract_series",
+       MagicMock(side_effect=Exception('Test')))
+def test_run_async_worker_exception():
+    sync = test_initialize()
+    sync.run_async()
+    assert sync._extract_series.call_count == len(mock_pairs) * len(mock_timeframes)
+
+
 # @patch('requests.get')
 # @patch('influxdb_client.InfluxDBClient.query_api')
 # def test_extract_series(mock_query_api,mock_get):
@@ -107,6 +142,15 @@ mock_url_generated = "https://api-pub.bitfinex.com/v2/candles/trade:12h:tBTCUSD/
 mock_last_sample_timestamp = 1613908800
 
 
+@patch('bitfinex_extractor_influxdb.metrics.enable', MagicMock(side_effect=OSError('Address already in use')))
+@patch.dict(os.environ, {'METRICS_PORT': '9100'})
+def test_metrics_port_in_use():
+    # Another process serving the port does not stop the extraction.
+    sync = test_initialize()
+    assert metrics.enable.call_args.args == (9100,)
+    assert sync.pairs == mock_pairs
+
+
 # Simulating two correct iterations, the second one will be up to date.
 
 
@@ -116,14 +160,22 @@ mock_last_sample_timestamp = 1613908800
        MagicMock(side_effect=[False, True]))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._check_bitfinex_connection',
        MagicMock(return_value=True))
-@patch('requests.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
+@patch('requests.Session.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.url_generator',
        MagicMock(return_value=mock_url_generated))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
        MagicMock(return_value=mock_last_sample_timestamp))
 def test_extract_series():
     sync = test_initialize()
-    sync._extract_series(pair_test, timeframe_test)
+    metrics.enable()
+    try:
+        sync._extract_series(pair_test, timeframe_test)
+        sync.writer.close()
+        assert metrics.CANDLES.value((timeframe_test,)) == 1
+        assert metrics.WRITTEN_POINTS.value() == 1
+        assert metrics.STAGE_SECONDS.value(('serialize',)) is not None
+    finally:
+        metrics.disable()
     assert sync._get_last_sample_timestamp.call_count == 1
     assert exchange_db_sync.url_generator.call_count == 2
     assert sync._check_bitfinex_connection.call_count == 2
@@ -138,7 +190,7 @@ def test_extract_series():
        MagicMock(return_value=True))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._check_bitfinex_connection',
        MagicMock(side_effect=[False, True]))
-@patch('requests.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
+@patch('requests.Session.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.url_generator',
        MagicMock(return_value=mock_url_generated))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
@@ -146,6 +198,7 @@ def test_extract_series():
 def test_no_connection():
     sync = test_initialize()
     sync._extract_series(pair_test, timeframe_test)
+    sync.writer.close()
     assert sync._get_last_sample_timestamp.call_count == 1
     assert exchange_db_sync.url_generator.call_count == 2
     assert sync._check_bitfinex_connection.call_count == 2
@@ -153,14 +206,16 @@ def test_no_connection():
     assert sync.influx_client.write_api().write.call_count == 0
 
 
-# Write call throws exception, first attempt. 'last_sample_timestamp_ns' shouldn't be updated that time.
+# Write call throws exception, first attempt. The page is dropped, so it is fetched and written again
+# and 'last_sample_timestamp_ns' is not updated that time.
+@patch.dict(os.environ, {'INFLUX_MAX_RETRIES': '0'})
 @patch('influxdb_client.client.write_api.WriteApi.write',
        MagicMock(side_effect=[Exception('Test'), True]))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.compare_timestamps',
-       MagicMock(side_effect=[False, False, True, True]))
+       MagicMock(side_effect=[False, True, False, True]))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._check_bitfinex_connection',
        MagicMock(return_value=True))
-@patch('requests.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
+@patch('requests.Session.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.url_generator',
        MagicMock(return_value=mock_url_generated))
 @patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
@@ -168,12 +223,14 @@ def test_no_connection():
 def test_write_call_exception():
     sync = test_initialize()
     sync._extract_series(pair_test, timeframe_test)
+    sync.writer.close()
     assert sync._get_last_sample_timestamp.call_count == 1
-    assert exchange_db_sync.url_generator.call_count == 3
-    assert sync._check_bitfinex_connection.call_count == 3
-    assert exchange_db_sync.compare_timestamps.call_count == 3
+    assert exchange_db_sync.url_generator.call_count == 4
+    assert sync._check_bitfinex_connection.call_count == 4
+    assert exchange_db_sync.compare_timestamps.call_count == 4
     assert sync.influx_client.write_api().write.call_count == 2
-
+    # The dropped page is requested again from the same position.
+    assert exchange_db_sync.url_generator.call_args_list[0] == exchange_db_sync.url_generator.call_args_list[2]
     assert exchange_db_sync.url_generator.call_args_list[-2] != exchange_db_sync.url_generator.call_args_list[
         -1]
 
@@ -194,6 +251,469 @@ def test_get_last_sample_timestamp_key_exception():
     assert sync._get_last_sample_timestamp(pair_test, timeframe_test) == sync.timeseries_start.timestamp()
 
 
+@patch('bitfinex_extractor_influxdb.stream.CandleStream.run')
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._leave_shard")
+@patch("bitfinex_extractor_influxdb.exchange_db_sync.DataSync._extract_all")
+def test_stream(mock_extract_all, mock_leave_shard, mock_stream_run):
+    sync = test_initialize()
+    sync.stream()
+    assert mock_extract_all.call_count == 1
+    assert mock_stream_run.call_count == 1
+    # The shard is only left once streaming stops.
+    assert mock_leave_shard.call_count == 1
+    # Updates do not wait for the batches of the extraction writer to fill.
+    assert sync.stream_writer.flush_interval == 0.05
+    assert sync.stream_writer.batch_size == sync.writer.batch_size
+
+
+@patch("pymysql.connect", MagicMock())
+@patch.dict(os.environ, {'WORKER_ID': 'worker-1'})
+def test_sharded_series():
+    sync = test_initialize()
+    sync.shard_registry.live_workers = MagicMock(return_value=['worker-0', 'worker-1'])
+    sync.shard_registry.heartbeat = MagicMock()
+    series = sync._series()
+    assert series
+    assert all(sharding.owner(pair, timeframe, ['worker-0', 'worker-1']) == 'worker-1' for pair, timeframe in series)
+
+
+@patch("pymysql.connect", MagicMock())
+@patch.dict(os.environ, {'WORKER_ID': 'worker-1'})
+def test_changed_series_rebalance():
+    sync = test_initialize()
+    sync.refresh_config = MagicMock(return_value=([], []))
+    sync.shard_registry.heartbeat = MagicMock()
+    sync.shard_registry.live_workers = MagicMock(return_value=['worker-0', 'worker-1'])
+    followed = sync._configured_series()
+    assert sync._changed_series(followed, sync._configured_series) == ([], [])
+    # worker-0 left, its series are taken over.
+    sync.shard_registry.live_workers = MagicMock(return_value=['worker-1'])
+    added, removed = sync._changed_series(followed, sync._configured_series)
+    assert sorted(followed + added) == sorted((pair, timeframe) for pair in sync.pairs for timeframe in sync.timeframes)
+    assert removed == []
+    # worker-2 joined, some of the series are handed over to it.
+    sync.shard_registry.live_workers = MagicMock(return_value=['worker-1', 'worker-2'])
+    added, removed = sync._changed_series(followed + added, sync._configured_series)
+    assert added == []
+    assert removed and all(sharding.owner(pair, timeframe, ['worker-1', 'worker-2']) == 'worker-2'
+                           for pair, timeframe in removed)
+
+
+@patch.dict(os.environ, {'CONFIG_POLL_INTERVAL': '0.01'})
+def test_watch_config_applies_first_change():
+    sync = test_initialize()
+    candle_stream = MagicMock(series=sync._configured_series())
+
+    def change_pairs():
+        sync._pairs = sync.pairs + ['tETHUSD']
+    sync.refresh_config = MagicMock(side_effect=change_pairs)
+    sync._extract_series = MagicMock()
+    sync._load_watermarks = MagicMock()
+
+    async def scenario():
+        watcher = asyncio.ensure_future(sync._watch_config(candle_stream, asyncio.Event()))
+        while not candle_stream.add.call_count:
+            await asyncio.sleep(0.01)
+        watcher.cancel()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    # The change found by the first check is followed right away.
+    assert sync.refresh_config.call_count == 1
+    candle_stream.add.assert_called_once_with([('tETHUSD', timeframe) for timeframe in mock_timeframes])
+    assert sync._extract_series.call_count == len(mock_timeframes)
+
+
+def test_extract_added_reloads_watermarks():
+    sync = test_initialize()
+    sync._writer = MagicMock()
+    calls = []
+    sync._load_watermarks = MagicMock(side_effect=lambda: calls.append('watermarks'))
+    sync._extract_series = MagicMock(side_effect=lambda pair, timeframe: calls.append((pair, timeframe)))
+    sync._extract_added([('tETHUSD', '1h')])
+    # Series written so far are flushed, then last samples are loaded again before extracting.
+    assert sync._writer.flush.call_count == 1
+    assert calls == ['watermarks', ('tETHUSD', '1h')]
+
+
+def test_refresh_config():
+    sync = test_initialize()
+    sync.mysql_cursor.fetchall.side_effect = [
+        [{'Table': 'db.pair', 'Checksum': 1}, {'Table': 'db.timeframe', 'Checksum': 2}],
+        mock_fetch_pairs, mock_fetch_timeframes,
+        [{'Table': 'db.pair', 'Checksum': 1}, {'Table': 'db.timeframe', 'Checksum': 2}],
+        [{'Table': 'db.pair', 'Checksum': 3}, {'Table': 'db.timeframe', 'Checksum': 2}],
+        mock_fetch_pairs[1:] + [{'id': 4, 'name': 'tETHUSD'}], mock_fetch_timeframes]
+    assert sync.refresh_config() == ([], [])
+    # Unchanged checksum, tables are not queried again.
+    assert sync.refresh_config() == ([], [])
+    assert sync.mysql_cursor.execute.call_count == 4
+    added, removed = sync.refresh_config()
+    assert added == [('tETHUSD', timeframe) for timeframe in mock_timeframes]
+    assert removed == [('tBTCUSD', timeframe) for timeframe in mock_timeframes]
+    assert sync.pairs == ['tIOTUSD', 'tLTCBTC', 'tETHUSD']
+
+
+def _mock_watermark_tables():
+    table = FluxTable()
+    table.records = [
+        FluxRecord(0, {'_measurement': 'tBTCUSD', 'timeframe': '1m', '_time': datetime(2021, 2, 1, tzinfo=timezone.utc)}),
+        FluxRecord(0, {'_measurement': 'tIOTUSD', 'timeframe': '1h', '_time': datetime(2021, 3, 1, tzinfo=timezone.utc)})]
+    return [table]
+
+
+@patch('influxdb_client.client.query_api.QueryApi.query_data_frame')
+@patch('influxdb_client.client.query_api.QueryApi.query', MagicMock(return_value=_mock_watermark_tables()))
+def test_load_watermarks(mock_query_data_frame):
+    sync = test_initialize()
+    sync._load_watermarks()
+    assert sync.watermarks == {('tBTCUSD', '1m'): 1612137600, ('tIOTUSD', '1h'): 1614556800}
+    assert sync._get_last_sample_timestamp('tBTCUSD', '1m') == 1612137600
+    assert sync._get_last_sample_timestamp('tLTCBTC', '1m') == sync.timeseries_start.timestamp()
+    assert mock_query_data_frame.call_count == 0
+
+
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m,1h'})
+@patch('influxdb_client.client.query_api.QueryApi.query', MagicMock(return_value=_mock_watermark_tables()))
+def test_load_watermarks_base_timeframe():
+    sync = test_initialize()
+    # 1m is not configured, it is only extracted as the base of the derived timeframes.
+    sync._timeframes = ['15m', '1h']
+    sync._derived_timeframes = None
+    sync._load_watermarks()
+    assert '"1m"' in sync.influx_client.query_api().query.call_args.args[0]
+    assert sync._get_last_sample_timestamp('tBTCUSD', '1m') == 1612137600
+
+
+@patch('influxdb_client.client.query_api.QueryApi.query', MagicMock(side_effect=Exception('Test')))
+def test_load_watermarks_exception():
+    sync = test_initialize()
+    sync._load_watermarks()
+    assert sync.watermarks is None
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write',
+       MagicMock(return_value=False))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.compare_timestamps',
+       MagicMock(side_effect=[False, True]))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._check_bitfinex_connection',
+       MagicMock(return_value=True))
+@patch('requests.Session.get', MagicMock(return_value=pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))))
+@patch('influxdb_client.client.query_api.QueryApi.query_data_frame',
+       MagicMock(side_effect=KeyError('initialize timeserie')))
+@patch('influxdb_client.client.query_api.QueryApi.query')
+def test_checkpoints(mock_query, tmp_path):
+    with patch.dict(os.environ, {'CHECKPOINT_PATH': str(tmp_path / 'checkpoints.sqlite')}):
+        sync = test_initialize()
+    sync._extract_series(pair_test, timeframe_test)
+    sync.writer.close()
+    assert sync.checkpoints.get(pair_test, timeframe_test) == 1612137600000
+    assert sync._get_last_sample_timestamp(pair_test, timeframe_test) == 1612137600
+
+    for pair in mock_pairs:
+        for timeframe in mock_timeframes:
+            sync.checkpoints.set(pair, timeframe, 1612137600000)
+    sync._load_watermarks()
+    assert mock_query.call_count == 0
+
+
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m,1h,7D'})
+def test_derived_series():
+    sync = test_initialize()
+    assert sync.derived_timeframes == ['15m', '1h']
+    assert sync._series() == [(pair, '1m') for pair in mock_pairs]
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._check_bitfinex_connection',
+       MagicMock(return_value=True))
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch',
+       MagicMock(side_effect=[[[1612137600000 + i * 60000, 1, 1, 1, 1, 1] for i in range(61)],
+                              [[1612137600000 + 60 * 60000, 1, 1, 1, 1, 1]]]))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(side_effect=[1612137600 + 60 * 20, 1612137600 + 60 * 15, 1612137600]))
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m,1h'})
+def test_extract_series_derived(mock_write):
+    sync = test_initialize()
+    sync._extract_series(pair_test, '1m')
+    sync.writer.close()
+    # Resumes from the earliest derived series.
+    assert 'start=1612137600000&' in sync.fetcher.fetch.call_args_list[0].args[0]
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).decode().split('\n')
+    assert len([line for line in lines if 'timeframe=1m ' in line]) == 61
+    assert len([line for line in lines if 'timeframe=15m ' in line]) == 5
+    assert len([line for line in lines if 'timeframe=1h ' in line]) == 2
+
+
+def _fake_fetch(url):
+    # Synthetic 1m series of 5000 candles served with Bitfinex paging semantics.
+    query = dict(parameter.split('=') for parameter in url.split('?')[1].split('&'))
+    first, last = 1612137600000, 1612137600000 + 4999 * 60000
+    start = max(int(query['start']), first)
+    end = min(int(query.get('end', last)), last)
+    start += -start % 60000
+    return [[timestamp, 1, 1, 1, 1, 1] for timestamp in range(start, end + 1, 60000)][:int(query['limit'])]
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+def test_extract_series_overlapping_pages(mock_write):
+    sync = test_initialize()
+    sync._extract_series(pair_test, timeframe_test)
+    sync.writer.close()
+    # Consecutive pages share a candle, it is written once.
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).split(b'\n')
+    assert len(lines) == len(set(lines)) == 5000
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._stored_candles', MagicMock(return_value=[]))
+@patch.dict(os.environ, {'ROLLUP_BUCKET': 'ROLLUP_BUCKET'})
+def test_extract_series_rollups(mock_write):
+    sync = test_initialize()
+    sync._extract_series(pair_test, timeframe_test)
+    sync._close_writers()
+    rollups = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list
+                         if call.kwargs['bucket'] == 'ROLLUP_BUCKET').split(b'\n')
+    candles = [line for line in rollups if b'rollup=candle' in line]
+    # Every candle but the first one has a return, recomputed lines of unfinished candles are repeated.
+    assert len({line.split(b' ')[-1] for line in candles}) == 4999
+    # VWAP and daily summaries start with the first day seen from its beginning.
+    day_ns = 24 * 60 * 60 * 1000000000
+    assert min(int(line.split(b' ')[-1]) for line in candles if b'vwap=' in line) == 1612137600000000000 + day_ns
+    assert {int(line.split(b' ')[-1]) for line in rollups if b'rollup=daily' in line} == \
+           {1612137600000000000 + day * day_ns for day in (1, 2, 3)}
+
+
+@patch('influxdb_client.client.query_api.QueryApi.query_stream')
+@patch.dict(os.environ, {'ROLLUP_BUCKET': 'ROLLUP_BUCKET'})
+def test_seeded_rollup(mock_query_stream):
+    stored = [[1612137600000 + minute * 60000, 1.0, 2.0 + minute, 3.0, 0.5, 1.0] for minute in range(3)]
+    # Stored points hold the Bitfinex close in the low field and the Bitfinex low in the close field.
+    mock_query_stream.return_value = [
+        FluxRecord(0, values={'_time': datetime.fromtimestamp(mts / 1000, timezone.utc), 'open': open_,
+                              'close': low, 'high': high, 'low': close, 'volume': volume})
+        for mts, open_, close, high, low, volume in stored]
+    sync = test_initialize()
+    first = 1612137600000 + 3 * 60000
+    rollup = sync._seeded_rollup(pair_test, timeframe_test, first)
+    query = mock_query_stream.call_args.args[0]
+    # The volatility window and the whole current day are read back.
+    assert f'stop: time(v: {first * 1000000})' in query
+    assert f'start: time(v: {(first - 21 * 60000) * 1000000})' in query
+    _, _, fields = rollup.feed([[first, 1.0, 10.0, 10.0, 10.0, 1.0]])[0]
+    assert np.isclose(fields['return'][0], 10.0 / 4.0 - 1)
+
+    mock_query_stream.side_effect = Exception('unreachable')
+    rollup = sync._seeded_rollup(pair_test, timeframe_test, first)
+    assert np.isnan(rollup.feed([[first, 1.0, 10.0, 10.0, 10.0, 1.0]])[0][2]['return'][0])
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 5000 * 60000))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+def test_backfill_series(mock_write, tmp_path):
+    with patch.dict(os.environ, {'CHECKPOINT_PATH': str(tmp_path / 'checkpoints.sqlite')}):
+        sync = test_initialize()
+    assert sync.backfill_series(pair_test, timeframe_test, windows=4) == 1612137600000 + 4999 * 60000
+    sync.writer.close()
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).split(b'\n')
+    assert len(lines) == len(set(lines)) == 5000
+    # The checkpoint stops at the last candle written, which may still be open, not at the end of the range.
+    assert sync.checkpoints.get(pair_test, timeframe_test) == 1612137600000 + 4999 * 60000
+
+
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600 + 60))
+def test_backfill_series_nothing_planned():
+    sync = test_initialize()
+    assert sync.backfill_series(pair_test, timeframe_test, windows=4) == 1612137660000
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 5000 * 60000))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m,1h', 'BACKFILL_WINDOWS': '2'})
+def test_extract_series_derived_backfill(mock_write):
+    sync = test_initialize()
+    sync._extract_series(pair_test, '1m')
+    sync.writer.close()
+    # The 1m history is fetched in two windows aligned to the hour, then the last hour is built again.
+    starts = [call.args[0].split('start=')[1].split('&')[0] for call in sync.fetcher.fetch.call_args_list]
+    assert str(1612137600000 + 41 * 3600000) in starts
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).decode().split('\n')
+    # Unfinished periods are written again once complete, the last version of each candle is kept.
+    stored = {}
+    for line in lines:
+        stored[(line.split(' ')[0], line.split(' ')[-1])] = line
+    assert len([key for key in stored if key[0].endswith('timeframe=1m')]) == 5000
+    assert len([key for key in stored if key[0].endswith('timeframe=15m')]) == 334
+    hours = [line for key, line in stored.items() if key[0].endswith('timeframe=1h')]
+    assert len(hours) == 84
+    # Every hour is built from all its candles, the last one holds the 20 minutes up to the last candle.
+    assert sorted(line.split('volume=')[1].split(' ')[0] for line in hours) == ['20.0'] + ['60.0'] * 83
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write', MagicMock())
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 5000 * 60000))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._catch_up_rollups')
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '1h', 'BACKFILL_WINDOWS': '2'})
+def test_extract_series_backfill_rollups(mock_catch_up):
+    sync = test_initialize()
+    sync._extract_series(pair_test, '1m')
+    sync.writer.close()
+    # Rollups of the windows written in parallel are caught up to the hour the extraction resumes from.
+    resumed = 1612137600000 + 83 * 3600000
+    assert [call.args for call in mock_catch_up.call_args_list] == [
+        (pair_test, '1m', 1612137600000, resumed), (pair_test, '1h', 1612137600000, resumed)]
+    assert all(call.kwargs == {'follow': True} for call in mock_catch_up.call_args_list)
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._stored_candles')
+@patch.dict(os.environ, {'ROLLUP_BUCKET': 'ROLLUP_BUCKET'})
+def test_catch_up_rollups(mock_stored_candles, mock_write):
+    stored = [[1612137600000 + minute * 60000, 1.0, 1.0 + minute, 1.0, 1.0, 1.0] for minute in range(10)]
+    mock_stored_candles.side_effect = lambda pair, timeframe, start, stop: [
+        candle for candle in stored if start <= candle[0] < stop]
+    sync = test_initialize()
+    with patch('bitfinex_extractor_influxdb.exchange_db_sync.ROLLUP_CHUNK_CANDLES', 4):
+        sync._catch_up_rollups(pair_test, timeframe_test, 1612137600000, 1612137600000 + 10 * 60000, follow=True)
+    sync._close_writers()
+    # Seeded before the range, then read in chunks of 4 candles.
+    assert [call.args[2:] for call in mock_stored_candles.call_args_list][1:] == [
+        (1612137600000 + start * 60000, 1612137600000 + min(start + 4, 10) * 60000) for start in (0, 4, 8)]
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).split(b'\n')
+    # Every candle but the first one, without a previous close, has a return.
+    assert len({line.split(b' ')[-1] for line in lines if b'rollup=candle' in line}) == 9
+    # Pages extracted afterwards continue from the caught up state.
+    _, _, fields = sync._rollups[(pair_test, timeframe_test)].feed([[1612137600000 + 10 * 60000] + [1.0] * 5])[0]
+    assert np.isclose(fields['return'][-1], 1.0 / 10.0 - 1)
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.gaps.GapScanner.scan',
+       MagicMock(return_value=iter([(1612137600000 + 10 * 60000, 1612137600000 + 12 * 60000)])))
+def test_repair_series(mock_write):
+    sync = test_initialize()
+    assert sync.repair_series(pair_test, timeframe_test) == [(1612137600000 + 10 * 60000,
+                                                              1612137600000 + 12 * 60000)]
+    sync.writer.close()
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).split(b'\n')
+    assert len(lines) == 3
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.gaps.GapScanner.scan')
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m'})
+def test_repair_series_windows(mock_scan, mock_write, tmp_path):
+    gaps = [(1612137600000 + 10 * 60000, 1612137600000 + 12 * 60000),
+            (1612137600000 + 20 * 60000, 1612137600000 + 20 * 60000),
+            (1612137600000 + 3000 * 60000, 1612137600000 + 3001 * 60000)]
+    mock_scan.side_effect = lambda *args: iter(gaps)
+    with patch.dict(os.environ, {'CHECKPOINT_PATH': str(tmp_path / 'checkpoints.sqlite')}):
+        sync = test_initialize()
+        sync._catch_up_rollups = MagicMock()
+        assert sync.repair_series(pair_test, '1m') == gaps
+    sync.writer.close()
+    # Nearby holes share a request, every window covers whole quarters.
+    starts = [call.args[0].split('start=')[1].split('&')[0] for call in sync.fetcher.fetch.call_args_list]
+    assert starts == [str(1612137600000), str(1612137600000 + 3000 * 60000)]
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).decode().split('\n')
+    quarters = [line for line in lines if 'timeframe=15m ' in line]
+    assert len(quarters) == 3
+    assert all('volume=15.0 ' in line for line in quarters)
+    # Rollups of each window and of the candles depending on it are computed again.
+    assert [call.args[:3] for call in sync._catch_up_rollups.call_args_list] == [
+        (pair_test, '1m', 1612137600000), (pair_test, '15m', 1612137600000),
+        (pair_test, '1m', 1612137600000 + 3000 * 60000), (pair_test, '15m', 1612137600000 + 3000 * 60000)]
+    # Holes fetched once are not requested again, each window is recorded as a whole.
+    assert sync.checkpoints.checked(pair_test, '1m') == [(1612137600000, 1612137600000 + 29 * 60000),
+                                                         (1612137600000 + 3000 * 60000,
+                                                          1612137600000 + 3014 * 60000)]
+    assert sync.repair_series(pair_test, '1m') == []
+    assert sync.fetcher.fetch.call_count == 2
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 5000 * 60000))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync.DataSync._get_last_sample_timestamp',
+       MagicMock(return_value=1612137600))
+def test_replay(mock_write, tmp_path):
+    pytest.importorskip('pyarrow')
+    with patch.dict(os.environ, {'PAGE_CACHE_PATH': str(tmp_path / 'cache')}):
+        sync = test_initialize()
+    with patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch)):
+        sync.backfill_series(pair_test, timeframe_test, windows=4)
+    sync.writer.close()
+    sync.page_cache.close()
+    mock_write.reset_mock()
+
+    with patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch') as mock_fetch:
+        sync.replay()
+        assert mock_fetch.call_count == 0
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).split(b'\n')
+    assert len(lines) == len(set(lines)) == 5000
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 4999 * 60000))
+def test_poll_series(mock_write, tmp_path):
+    with patch.dict(os.environ, {'CHECKPOINT_PATH': str(tmp_path / 'checkpoints.sqlite')}):
+        sync = test_initialize()
+    assert sync._poll_series(pair_test, timeframe_test, 1612137600000 + 4997 * 60000) == \
+           (1612137600000 + 4999 * 60000, False)
+    sync.writer.close()
+    # Only the candles published since the last one stored are requested.
+    assert 'limit=4&' in sync.fetcher.fetch.call_args.args[0]
+    assert len(mock_write.call_args.kwargs['record'].split(b'\n')) == 3
+    assert sync.checkpoints.get(pair_test, timeframe_test) == 1612137600000 + 4999 * 60000
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+@patch('bitfinex_extractor_influxdb.fetcher.CandleFetcher.fetch', MagicMock(side_effect=_fake_fetch))
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 4999 * 60000))
+@patch.dict(os.environ, {'DERIVED_TIMEFRAMES': '15m'})
+def test_poll_series_derived(mock_write):
+    sync = test_initialize()
+    # Derived timeframes are not polled, they are built from the 1m candles.
+    assert ('tBTCUSD', '15m') not in sync._series()
+    assert sync._poll_series(pair_test, '1m', 1612137600000 + 4997 * 60000) == (1612137600000 + 4999 * 60000, False)
+    # The first request starts with the quarter in progress, so it is built whole.
+    assert f'start={1612137600000 + 4995 * 60000}&' in sync.fetcher.fetch.call_args.args[0]
+    assert sync._poll_series(pair_test, '1m', 1612137600000 + 4999 * 60000) == (1612137600000 + 4999 * 60000, False)
+    assert f'start={1612137600000 + 4999 * 60000}&' in sync.fetcher.fetch.call_args.args[0]
+    sync.writer.close()
+    lines = b'\n'.join(call.kwargs['record'] for call in mock_write.call_args_list).decode().split('\n')
+    quarters = [line for line in lines if 'timeframe=15m ' in line]
+    assert quarters and all(line.endswith(f'volume=5.0 {(1612137600000 + 4995 * 60000) * 1000000}')
+                            for line in quarters)
+
+
+@patch.dict(os.environ, {'BACKFILL_WINDOWS': '4'})
+@patch('bitfinex_extractor_influxdb.exchange_db_sync._now_ms', MagicMock(return_value=1612137600000 + 5000 * 60000))
+def test_needs_backfill():
+    sync = test_initialize()
+    assert sync._needs_backfill('1m', 1612137600000)
+    assert not sync._needs_backfill('1m', 1612137600000 + 1000 * 60000)
+    assert not sync._needs_backfill('1h', 1612137600000)
+
+
 def test_check_bitfinex_connection():
     sync = test_initialize()
     assert sync._check_bitfinex_connection(pickle.load(open("./tests/bitfinex_response_candle.p", "rb"))) == True
@@ -203,12 +723,13 @@ def test_check_bitfinex_connection():
 def test_check_bitfinex_connection_limit_rate():
     sync = test_initialize()
     assert sync._check_bitfinex_connection(pickle.load(open("./tests/bitfinex_response_limit_error.p", "rb"))) == False
+    assert sync.rate_limiter.rate == sync.rate_limiter.requests_per_minute / 2
 
 
 @patch('time.sleep', MagicMock(side_effect=None))
 def test_check_bitfinex_connection_maintenance():
     sync = test_initialize()
-    assert sync._check_bitfinex_connection(['error', exchange_db_sync.ERROR_CODE_START_MAINTENANCE]) == False
+    assert sync._check_bitfinex_connection(['error', protocol.ERROR_CODE_START_MAINTENANCE]) == False
 
 
 url_generator_pair = 'tBTCUSD'
@@ -222,6 +743,45 @@ def test_url_generator():
                                           url_generator_last_sample_timestamp_ns) == mock_url_generator_expected
 
 
+def test_url_generator_end():
+    assert exchange_db_sync.url_generator(url_generator_pair, url_generator_timeframe,
+                                          url_generator_last_sample_timestamp_ns, 1617235200000) == \
+           mock_url_generator_expected + '&end=1617235200000'
+
+
+def test_url_generator_limit():
+    assert exchange_db_sync.url_generator(url_generator_pair, url_generator_timeframe,
+                                          url_generator_last_sample_timestamp_ns, limit=3) == \
+           mock_url_generator_expected.replace('limit=1000', 'limit=3')
+
+
+def test_serialize_lines():
+    response = json.loads(pickle.load(open("./tests/bitfinex_response_candle.p", "rb")).content)
+    assert protocol.serialize_lines(pair_test, timeframe_test, response) == \
+           b'tBTCUSD,timeframe=1m close=32333.0,high=57855.0,low=57774.0,open=33117.79931925,' \
+           b'volume=200196.55757341 1612137600000000000'
+
+
+def test_serialize_lines_matches_points():
+    response = [[1612137600000, 1.5, 1, 2, 0.5, 10], [1612137660000, 2.5, 2, 3, 1.25, 0.001]]
+    lines = protocol.serialize_lines('tTEST USD', '1m', response).decode().split('\n')
+    points = protocol.serialize_points('tTEST USD', '1m', response)
+    assert len(lines) == len(points)
+    for line, point in zip(lines, points):
+        assert line.replace('.0,', ',').replace('.0 ', ' ') == point.to_line_protocol()
+
+
+def test_serialize_lines_empty():
+    assert protocol.serialize_lines(pair_test, timeframe_test, []) == b''
+
+
+def test_serialize_rollups():
+    rollups = [('candle', np.array([1612137600000, 1612137660000]),
+                {'return': np.array([np.nan, 0.5]), 'volatility': np.array([np.nan, np.nan])})]
+    assert protocol.serialize_rollups(pair_test, timeframe_test, rollups) == \
+           b'tBTCUSD,rollup=candle,timeframe=1m return=0.5 1612137660000000000'
+
+
 def test_compare_timestamp():
     assert exchange_db_sync.compare_timestamps(url_generator_last_sample_timestamp_ns,
                                                url_generator_last_sample_timestamp_ns) == True
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from bitfinex_extractor_influxdb.pipeline import prefetch
+
+
+def test_yields_in_order():
+    assert list(prefetch(iter(range(10)), depth=3)) == list(range(10))
+
+
+def test_empty():
+    assert list(prefetch(iter([]))) == []
+
+
+def test_raises_producer_errors():
+    def produce():
+        yield 1
+        raise ValueError('fetch failed')
+
+    pages = prefetch(produce())
+    assert next(pages) == 1
+    with pytest.raises(ValueError):
+        next(pages)
+
+
+def test_runs_ahead_up_to_depth():
+    produced = []
+
+    def produce():
+        for item in range(10):
+            produced.append(item)
+            yield item
+
+    pages = prefetch(produce(), depth=2)
+    assert next(pages) == 0
+    time.sleep(0.1)
+    # One item consumed, two waiting in the queue and one blocked on the full queue.
+    assert produced == [0, 1, 2, 3]
+    pages.close()
+
+
+def test_close_stops_producer():
+    closed = threading.Event()
+
+    def produce():
+        try:
+            while 1:
+                yield 1
+        finally:
+            closed.set()
+
+    pages = prefetch(produce(), depth=1)
+    assert next(pages) == 1
+    pages.close()
+    assert closed.wait(1)
@@ -0,0 +1,82 @@
+from mock import patch, MagicMock
+
+from bitfinex_extractor_influxdb.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _patched_clock():
+    clock = FakeClock()
+    return clock, patch.multiple('bitfinex_extractor_influxdb.rate_limiter.time',
+                                 monotonic=MagicMock(side_effect=clock.monotonic),
+                                 sleep=MagicMock(side_effect=clock.sleep))
+
+
+def test_burst_is_free():
+    clock, patcher = _patched_clock()
+    with patcher:
+        limiter = RateLimiter(requests_per_minute=60, burst=3)
+        for _ in range(3):
+            limiter.acquire()
+    assert clock.now == 1000.0
+
+
+def test_sustained_rate():
+    clock, patcher = _patched_clock()
+    with patcher:
+        limiter = RateLimiter(requests_per_minute=30, burst=1)
+        for _ in range(4):
+            limiter.acquire()
+    # First token is available at start, every following one takes 2 seconds to refill.
+    assert clock.now == 1006.0
+
+
+def test_penalize_backoff_doubles_and_resets():
+    clock, patcher = _patched_clock()
+    with patcher:
+        limiter = RateLimiter(requests_per_minute=60, burst=1, backoff=10, max_backoff=25)
+        assert limiter.penalize() == 10
+        assert limiter.penalize() == 20
+        assert limiter.penalize() == 25
+        assert limiter.rate == 7.5
+        limiter.reward()
+        assert limiter.penalize() == 10
+
+
+def test_penalize_pauses_workers():
+    clock, patcher = _patched_clock()
+    with patcher:
+        limiter = RateLimiter(requests_per_minute=60, burst=5, backoff=60)
+        limiter.penalize()
+        limiter.acquire()
+    # Paused for 60 seconds, then one token at the halved rate (30 per minute).
+    assert clock.now == 1062.0
+
+
+def test_reward_recovers_rate():
+    limiter = RateLimiter(requests_per_minute=4)
+    limiter.penalize()
+    assert limiter.rate == 2
+    limiter.reward()
+    limiter.reward()
+    limiter.reward()
+    assert limiter.rate == 4
+
+
+def test_pause():
+    clock, patcher = _patched_clock()
+    with patcher:
+        limiter = RateLimiter(requests_per_minute=60, burst=1)
+        limiter.pause(5)
+        limiter.acquire()
+    assert clock.now == 1005.0
+    assert limiter.rate == 60
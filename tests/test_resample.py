@@ -0,0 +1,50 @@
+import numpy as np
+
+from bitfinex_extractor_influxdb import resample
+from bitfinex_extractor_influxdb.resample import CandleResampler
+
+minute = 60 * 1000
+start = 1612137600000
+
+# [MTS, OPEN, CLOSE, HIGH, LOW, VOLUME]
+candles_1m = [[start + i * minute, 10 + i, 11 + i, 12 + i, 9 + i, 1] for i in range(10)]
+
+
+def test_resample_candles():
+    resampled = resample.resample_candles(resample.to_candles(candles_1m), '5m')
+    assert resampled.tolist() == [[start, 10, 15, 16, 9, 5], [start + 5 * minute, 15, 20, 21, 14, 5]]
+
+
+def test_resample_candles_empty():
+    assert resample.resample_candles(resample.to_candles([]), '5m').shape == (0, 6)
+
+
+def test_deduplicate_keeps_last():
+    candles = resample.to_candles([[start + minute, 1, 1, 1, 1, 1], [start, 2, 2, 2, 2, 2], [start, 3, 3, 3, 3, 3]])
+    assert resample.deduplicate(candles)[:, 0].tolist() == [start, start + minute]
+    assert resample.deduplicate(candles)[0, 1] == 3
+
+
+def test_resampler_completes_periods_across_pages():
+    resampler = CandleResampler(['5m', '15m'])
+    first = resampler.feed(candles_1m[:7])
+    assert first['5m'].tolist()[-1] == [start + 5 * minute, 15, 17, 18, 14, 2]
+    # Pages are inclusive at start, so the last candle of the previous page is repeated.
+    second = resampler.feed(candles_1m[6:])
+    assert second['5m'].tolist() == [[start, 10, 15, 16, 9, 5], [start + 5 * minute, 15, 20, 21, 14, 5]]
+    assert second['15m'].tolist() == [[start, 10, 20, 21, 9, 10]]
+
+
+def test_resample_matches_single_pass():
+    rng = np.random.default_rng(0)
+    candles = resample.to_candles([[start + i * minute] + rng.random(5).tolist() for i in range(3000)])
+    resampler = CandleResampler(['1h'])
+    for page in range(0, 3000, 1000):
+        derived = resampler.feed(candles[max(page - 1, 0):page + 1000])
+    expected = resample.resample_candles(candles, '1h')
+    assert np.allclose(derived['1h'][-1], expected[-1])
+
+
+def test_align():
+    assert resample.align(1612137600 + 3600 * 5 + 60, ['5m', '1D']) == 1612137600
+    assert resample.align(1612137600 + 60 * 7, ['5m']) == 1612137600 + 60 * 5
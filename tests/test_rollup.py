@@ -0,0 +1,78 @@
+import numpy as np
+
+from bitfinex_extractor_influxdb.rollup import DAY_MS, SeriesRollup
+
+HOUR = 60 * 60 * 1000
+START = 1612137600000  # 2021-02-01 00:00 UTC
+
+
+def _candles(start, closes, volume=1.0):
+    # [MTS, OPEN, CLOSE, HIGH, LOW, VOLUME], high and low equal to the close so the typical price is the close.
+    return [[start + i * HOUR, close, close, close, close, volume] for i, close in enumerate(closes)]
+
+
+def _rollup(rollups, kind):
+    return next((timestamps, fields) for rollup, timestamps, fields in rollups if rollup == kind)
+
+
+def test_returns_across_pages():
+    rollup = SeriesRollup(window=3)
+    _, fields = _rollup(rollup.feed(_candles(START, [100.0, 110.0])), 'candle')
+    assert np.isnan(fields['return'][0])
+    assert np.isclose(fields['return'][1], 0.1)
+    timestamps, fields = _rollup(rollup.feed(_candles(START + HOUR, [110.0, 121.0])), 'candle')
+    # The last candle of the previous page is computed again, then the new one.
+    assert timestamps.tolist() == [START + HOUR, START + 2 * HOUR]
+    assert np.allclose(fields['return'], [0.1, 0.1])
+    assert np.allclose(fields['log_return'], np.log(1.1))
+
+
+def test_rolling_volatility():
+    closes = [100.0, 101.0, 99.0, 102.0, 98.0, 103.0]
+    rollup = SeriesRollup(window=3)
+    _, fields = _rollup(rollup.feed(_candles(START, closes[:3])), 'candle')
+    assert np.isnan(fields['volatility']).all()
+    _, fields = _rollup(rollup.feed(_candles(START + 2 * HOUR, closes[2:])), 'candle')
+    log_returns = np.diff(np.log(closes))
+    expected = [np.std(log_returns[i - 2:i + 1], ddof=1) for i in range(2, 5)]
+    assert np.allclose(fields['volatility'][1:], expected)
+
+
+def test_daily_summary_and_vwap():
+    rollup = SeriesRollup(window=2)
+    # The first day was seen from the middle, it gets neither VWAP nor summary.
+    rollups = rollup.feed(_candles(START + 22 * HOUR, [10.0, 20.0]))
+    assert len(_rollup(rollups, 'daily')[0]) == 0
+    assert np.isnan(_rollup(rollups, 'candle')[1]['vwap']).all()
+
+    day = START + DAY_MS
+    rollup.feed(_candles(START + 23 * HOUR, [20.0, 30.0, 40.0], volume=2.0))
+    rollups = rollup.feed(_candles(day + HOUR, [40.0, 50.0]) + _candles(day + DAY_MS, [60.0]))
+    timestamps, fields = _rollup(rollups, 'daily')
+    assert timestamps.tolist() == [day, day + DAY_MS]
+    assert fields['open'][0] == 30.0
+    assert fields['high'][0] == 50.0
+    assert fields['low'][0] == 30.0
+    assert fields['close'][0] == 50.0
+    # The unfinished candle at 01:00 was replaced by its later version.
+    assert fields['volume'][0] == 4.0
+    assert np.isclose(fields['vwap'][0], (30.0 * 2 + 40.0 + 50.0) / 4)
+    timestamps, fields = _rollup(rollups, 'candle')
+    assert np.isclose(fields['vwap'][-1], 60.0)
+
+
+def test_no_daily_for_daily_timeframes():
+    rollup = SeriesRollup(intraday=False)
+    rollups = rollup.feed([[START + i * DAY_MS, 1.0, 1.0 + i, 1.0, 1.0, 1.0] for i in range(3)])
+    assert [kind for kind, _, _ in rollups] == ['candle']
+    assert 'vwap' not in rollups[0][2]
+
+
+def test_seed_from_stored_candles():
+    rollup = SeriesRollup(window=2)
+    # Stored candles from the end of the previous day, so the day of the next page is seen from its start.
+    rollup.seed(_candles(START - HOUR, [10.0, 20.0, 30.0]))
+    _, fields = _rollup(rollup.feed(_candles(START + 2 * HOUR, [60.0])), 'candle')
+    assert np.isclose(fields['return'][0], 1.0)
+    assert np.isclose(fields['volatility'][0], np.std([np.log(1.5), np.log(2.0)], ddof=1))
+    assert np.isclose(fields['vwap'][0], (20.0 + 30.0 + 60.0) / 3)
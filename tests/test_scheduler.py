@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+from bitfinex_extractor_influxdb.scheduler import PollScheduler, expected_candles, next_close, poll_limit
+
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+START = 1612137600000
+
+
+def _ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def test_next_close():
+    assert next_close(START, '1m', START + 30000) == START + MINUTE
+    assert next_close(START, '1h', START + 5 * HOUR + 1) == START + 6 * HOUR
+    assert next_close(START, '7D', START + 1) == START + 7 * 24 * HOUR
+
+
+def test_next_close_month():
+    assert next_close(_ms(2021, 2, 1), '1M', _ms(2021, 2, 10)) == _ms(2021, 3, 1)
+    assert next_close(_ms(2021, 12, 1), '1M', _ms(2021, 12, 31)) == _ms(2022, 1, 1)
+
+
+def test_expected_candles():
+    assert expected_candles(START, '1m', START + 30000) == 1
+    assert expected_candles(START, '1m', START + 3 * MINUTE) == 4
+    assert poll_limit('1m', START, START + 3 * MINUTE, 1000) == 5
+    assert poll_limit('1m', START, START + 3000 * MINUTE, 1000) == 1000
+
+
+def test_ordered_by_next_close():
+    scheduler = PollScheduler(grace=1)
+    now = START + 30000
+    scheduler.add('tBTCUSD', '1h', START, now)
+    scheduler.add('tBTCUSD', '1m', START, now)
+    scheduler.add('tETHUSD', '1D', START, now)
+    assert scheduler.wait(now) == 30000 + 1000
+    assert scheduler.pop_due(now) == []
+    assert scheduler.pop_due(START + MINUTE + 1000) == [('tBTCUSD', '1m', START)]
+    assert scheduler.pop_due(START + HOUR + 1000) == [('tBTCUSD', '1h', START)]
+
+
+def test_behind_is_due_at_once():
+    scheduler = PollScheduler()
+    now = START + 5 * MINUTE
+    scheduler.add('tBTCUSD', '1m', START, now)
+    assert scheduler.pop_due(now) == [('tBTCUSD', '1m', START)]
+
+
+def test_done_advanced():
+    scheduler = PollScheduler(grace=1)
+    now = START + MINUTE + 1000
+    scheduler.add('tBTCUSD', '1m', START, START)
+    scheduler.pop_due(now)
+    scheduler.done('tBTCUSD', '1m', START, START + MINUTE, full=False, now=now)
+    assert scheduler.wait(now) == MINUTE
+    assert scheduler.pop_due(START + 2 * MINUTE + 1000) == [('tBTCUSD', '1m', START + MINUTE)]
+
+
+def test_done_full_page():
+    scheduler = PollScheduler()
+    now = START + 5000 * MINUTE
+    scheduler.add('tBTCUSD', '1m', START, now)
+    scheduler.pop_due(now)
+    scheduler.done('tBTCUSD', '1m', START, START + 999 * MINUTE, full=True, now=now)
+    assert scheduler.pop_due(now) == [('tBTCUSD', '1m', START + 999 * MINUTE)]
+
+
+def test_done_retries_unpublished_candle():
+    scheduler = PollScheduler(grace=1, retry_delay=10, max_retries=2)
+    now = START + MINUTE + 1000
+    scheduler.add('tBTCUSD', '1m', START, START)
+    for _ in range(2):
+        scheduler.pop_due(now)
+        scheduler.done('tBTCUSD', '1m', START, START, full=False, now=now)
+        assert scheduler.wait(now) == 10000
+        now += 10000
+    scheduler.pop_due(now)
+    scheduler.done('tBTCUSD', '1m', START, START, full=False, now=now)
+    # Out of retries, waits for the next close.
+    assert scheduler.wait(now) == START + 2 * MINUTE + 1000 - now
+
+
+def test_remove():
+    scheduler = PollScheduler()
+    scheduler.add('tBTCUSD', '1m', START, START)
+    scheduler.add('tETHUSD', '1m', START, START)
+    scheduler.remove([('tBTCUSD', '1m')])
+    assert scheduler.series == [('tETHUSD', '1m')]
+    assert scheduler.pop_due(START + HOUR) == [('tETHUSD', '1m', START)]
+    assert scheduler.wait(START + HOUR) is None
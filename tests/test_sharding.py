@@ -0,0 +1,78 @@
+import threading
+
+from mock import patch, MagicMock
+
+from bitfinex_extractor_influxdb import sharding
+from bitfinex_extractor_influxdb.sharding import ShardRegistry
+
+series = [(pair, timeframe) for pair in ['tBTCUSD', 'tIOTUSD', 'tLTCBTC', 'tETHUSD']
+          for timeframe in ['1m', '5m', '15m', '1h', '1D']]
+workers = ['worker-0', 'worker-1', 'worker-2']
+
+
+def test_owner_assigns_every_series_once():
+    shards = {worker: [s for s in series if sharding.owner(*s, workers) == worker] for worker in workers}
+    assert sorted(sum(shards.values(), [])) == sorted(series)
+    assert all(shards.values())
+
+
+def test_owner_rebalances_only_dead_worker_series():
+    before = {s: sharding.owner(*s, workers) for s in series}
+    after = {s: sharding.owner(*s, workers[:2]) for s in series}
+    moved = [s for s in series if before[s] != after[s]]
+    assert moved and all(before[s] == 'worker-2' for s in moved)
+
+
+def _registry(worker_id, live, ttl=30):
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [{'id': worker} for worker in live]
+    return ShardRegistry(MagicMock(return_value=connection), worker_id, ttl=ttl), cursor
+
+
+def test_registry_owned():
+    registry, cursor = _registry('worker-1', workers)
+    assert registry.live_workers() == workers
+    assert registry.owned(series) == [s for s in series if sharding.owner(*s, workers) == 'worker-1']
+    assert any('ON DUPLICATE KEY UPDATE' in call.args[0] for call in cursor.execute.call_args_list)
+
+
+def test_registry_includes_itself():
+    registry, _ = _registry('worker-1', [])
+    assert registry.owned(series) == series
+
+
+def test_registry_start_stop():
+    registry, cursor = _registry('worker-1', workers)
+    registry.start()
+    registry.stop()
+    assert cursor.execute.call_args.args == ('DELETE FROM worker WHERE id = %s;', ('worker-1',))
+
+
+def test_registry_notifies_changes():
+    registry, cursor = _registry('worker-1', workers, ttl=0.03)
+    changed = threading.Event()
+    on_change = MagicMock(side_effect=lambda live: changed.set())
+    registry.start(on_change)
+    cursor.fetchall.return_value = [{'id': worker} for worker in workers[:2]]
+    assert changed.wait(5)
+    registry.stop()
+    on_change.assert_called_once_with(workers[:2])
+
+
+@patch('bitfinex_extractor_influxdb.sharding.time.sleep', MagicMock())
+@patch('bitfinex_extractor_influxdb.sharding._spawn')
+@patch('bitfinex_extractor_influxdb.sharding.ShardRegistry')
+def test_supervise_restarts_failed_workers(mock_registry, mock_spawn):
+    failed = MagicMock(is_alive=MagicMock(return_value=False), exitcode=1)
+    finished = MagicMock(is_alive=MagicMock(return_value=False), exitcode=0)
+    mock_spawn.side_effect = [finished, failed, finished]
+    work = MagicMock()
+    sharding.supervise(2, work, MagicMock(), restart_delay=0)
+    assert mock_spawn.call_count == 3
+    assert mock_spawn.call_args_list[1].args == mock_spawn.call_args_list[2].args
+    assert mock_spawn.call_args_list[0].args[0] is work
+    # A restarted process keeps its index.
+    assert [call.args[2] for call in mock_spawn.call_args_list] == [0, 1, 1]
+    assert mock_registry.return_value.heartbeat.call_count == 2
+    assert mock_registry.return_value.close.call_count == 1
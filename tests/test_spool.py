@@ -0,0 +1,64 @@
+import pytest
+
+from bitfinex_extractor_influxdb.spool import Spool
+
+
+def test_append_and_drain_in_order(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=10)
+    for record in (b'a 1', b'b 2\nc 3', b'd 4'):
+        assert spool.append(record)
+    assert spool.size == 16
+    written = []
+    while spool.drain(written.append):
+        pass
+    # Segments are drained whole, in the order records were appended.
+    assert written == [b'a 1\nb 2\nc 3', b'd 4']
+    assert spool.empty()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_drain_batches(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b'a 1\nb 2\nc 3')
+    written = []
+    spool.drain(written.append, batch_lines=2)
+    assert written == [b'a 1\nb 2', b'c 3']
+
+
+def test_drain_failure_keeps_segment(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b'a 1')
+
+    def fail(lines):
+        raise ConnectionError('InfluxDB down')
+
+    with pytest.raises(ConnectionError):
+        spool.drain(fail)
+    assert spool.size == 4
+    # Records appended meanwhile go after the failed segment.
+    spool.append(b'b 2')
+    written = []
+    while spool.drain(written.append):
+        pass
+    assert written == [b'a 1', b'b 2']
+
+
+def test_size_cap(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=8)
+    assert spool.append(b'a 1')
+    assert spool.append(b'b 2')
+    assert not spool.append(b'c 3')
+    assert spool.size == 8
+
+
+def test_persistent(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b'a 1')
+    spool.close()
+    spool = Spool(str(tmp_path))
+    spool.append(b'b 2')
+    assert spool.size == 8
+    written = []
+    while spool.drain(written.append):
+        pass
+    assert written == [b'a 1', b'b 2']
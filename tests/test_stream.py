@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import websockets
+from mock import MagicMock
+
+from bitfinex_extractor_influxdb.stream import CandleStream
+
+series = [('tBTCUSD', '1m'), ('tBTCUSD', '1h')]
+candle = [1612137600000, 1, 1, 1, 1, 1]
+
+
+class FakeBitfinex:
+    """Local stand-in for the Bitfinex WebSocket API, asking to reconnect after the first connection."""
+
+    def __init__(self):
+        self.connections = 0
+        self.subscriptions = []
+
+    async def handler(self, connection):
+        self.connections += 1
+        await connection.send(json.dumps({'event': 'info', 'version': 2}))
+        for chan_id in range(len(series)):
+            subscription = json.loads(await connection.recv())
+            self.subscriptions.append(subscription['key'])
+            await connection.send(json.dumps({'event': 'subscribed', 'channel': 'candles', 'chanId': chan_id,
+                                              'key': subscription['key']}))
+        if self.connections == 1:
+            await connection.send(json.dumps([0, [candle, [candle[0] + 60000, 2, 2, 2, 2, 2]]]))
+            await connection.send(json.dumps([1, 'hb']))
+            await connection.send(json.dumps([1, [candle[0], 3, 3, 3, 3, 3]]))
+            await connection.send(json.dumps({'event': 'info', 'code': 20051}))
+        else:
+            await connection.send(json.dumps([0, [candle[0] + 120000, 4, 4, 4, 4, 4]]))
+        await connection.wait_closed()
+
+
+def _follow(writer, checkpoints=None, on_candles=None):
+    fake_bitfinex = FakeBitfinex()
+
+    async def scenario():
+        async with websockets.serve(fake_bitfinex.handler, 'localhost', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            candle_stream = CandleStream(series, writer, checkpoints=checkpoints, on_candles=on_candles,
+                                         url=f'ws://localhost:{port}', flush_interval=0.01, reconnect_delay=0.01)
+            task = asyncio.ensure_future(candle_stream.run())
+            while fake_bitfinex.connections < 2 or not writer.write.call_count:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            candle_stream.stop()
+            await task
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    return fake_bitfinex
+
+
+def test_stream_subscribes_and_writes():
+    writer = MagicMock()
+    fake_bitfinex = _follow(writer)
+    assert fake_bitfinex.subscriptions == ['trade:1m:tBTCUSD', 'trade:1h:tBTCUSD'] * 2
+    lines = b'\n'.join(call.args[0] for call in writer.write.call_args_list).decode().split('\n')
+    assert len([line for line in lines if 'timeframe=1m ' in line]) == 3
+    assert len([line for line in lines if 'timeframe=1h ' in line]) == 1
+
+
+def test_stream_checkpoints():
+    writer = MagicMock()
+    checkpoints = MagicMock()
+    _follow(writer, checkpoints)
+    for call in writer.write.call_args_list:
+        call.kwargs['on_success']()
+    checkpoints.set.assert_any_call('tBTCUSD', '1m', candle[0] + 120000)
+    checkpoints.set.assert_any_call('tBTCUSD', '1h', candle[0])
+
+
+def test_stream_on_candles():
+    def fail_first(pair, timeframe, page):
+        if on_candles.call_count == 1:
+            raise Exception('Test')
+    on_candles = MagicMock(side_effect=fail_first)
+    _follow(MagicMock(), on_candles=on_candles)
+    # Candles of each series are handed over in timestamp order, a failing call does not stop the stream.
+    timestamps = [candle[0] for call in on_candles.call_args_list if call.args[:2] == ('tBTCUSD', '1m')
+                  for candle in call.args[2]]
+    assert sorted(set(timestamps)) == [candle[0], candle[0] + 60000, candle[0] + 120000]
+    for call in on_candles.call_args_list:
+        assert [item[0] for item in call.args[2]] == sorted(item[0] for item in call.args[2])
+
+
+def test_stream_add_and_remove():
+    subscriptions = []
+    unsubscriptions = []
+
+    async def handler(connection):
+        async for message in connection:
+            subscription = json.loads(message)
+            if subscription['event'] == 'unsubscribe':
+                unsubscriptions.append(subscription['chanId'])
+                continue
+            subscriptions.append(subscription['key'])
+            chan_id = len(subscriptions)
+            await connection.send(json.dumps({'event': 'subscribed', 'channel': 'candles', 'chanId': chan_id,
+                                              'key': subscription['key']}))
+            await connection.send(json.dumps([chan_id, [candle[0] + chan_id, 1, 1, 1, 1, 1]]))
+
+    writer = MagicMock()
+
+    async def scenario():
+        async with websockets.serve(handler, 'localhost', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            candle_stream = CandleStream(series[:1], writer, url=f'ws://localhost:{port}', flush_interval=0.01)
+            task = asyncio.ensure_future(candle_stream.run())
+            while len(subscriptions) < 1:
+                await asyncio.sleep(0.01)
+            candle_stream.remove(series[:1])
+            candle_stream.add(series[1:])
+            while len(subscriptions) < 2 or not unsubscriptions:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            candle_stream.stop()
+            await task
+            return candle_stream
+
+    candle_stream = asyncio.run(asyncio.wait_for(scenario(), 10))
+    assert subscriptions == ['trade:1m:tBTCUSD', 'trade:1h:tBTCUSD']
+    assert unsubscriptions == [1]
+    assert candle_stream.series == series[1:]
+    lines = b'\n'.join(call.args[0] for call in writer.write.call_args_list).decode()
+    assert 'timeframe=1h ' in lines
@@ -0,0 +1,149 @@
+from mock import patch, MagicMock
+from influxdb_client import InfluxDBClient
+
+from bitfinex_extractor_influxdb.spool import Spool
+from bitfinex_extractor_influxdb.writer import InfluxWriter, WriteTracker, WriterOptions
+
+page = b'tBTCUSD,timeframe=1m close=1.0,high=1.0,low=1.0,open=1.0,volume=1.0 1612137600000000000\n' \
+       b'tBTCUSD,timeframe=1m close=1.0,high=1.0,low=1.0,open=1.0,volume=1.0 1612137660000000000'
+
+
+def _writer(spool=None, **kwargs):
+    options = {'flush_interval': 0.01, 'retry_interval': 0, 'jitter_interval': 0}
+    options.update(kwargs)
+    return InfluxWriter(InfluxDBClient(url='INFLUXDB_HOST', token='INFLUXDB_TOKEN'), 'bucket', 'org',
+                        WriterOptions(**options), spool=spool)
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_write_batches_pages(mock_write):
+    writer = _writer(batch_size=4, flush_interval=10)
+    writer.write(page)
+    writer.write(page)
+    writer.flush()
+    writer.close()
+    assert mock_write.call_count == 1
+    assert mock_write.call_args.kwargs['record'] == page + b'\n' + page
+    assert mock_write.call_args.kwargs['bucket'] == 'bucket'
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_write_flush_interval(mock_write):
+    writer = _writer(batch_size=1000)
+    writer.write(page)
+    writer.flush()
+    assert mock_write.call_count == 1
+    writer.write(page)
+    writer.close()
+    assert mock_write.call_count == 2
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write', MagicMock(side_effect=Exception('Test')))
+def test_write_retries_and_drops():
+    writer = _writer(max_retries=2)
+    writer.write(page)
+    writer.close()
+    assert writer._write_api.write.call_count == 3
+    assert writer.pending == 0
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_write_empty_record(mock_write):
+    writer = _writer()
+    writer.write(b'')
+    writer.close()
+    assert mock_write.call_count == 0
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_close_restarts(mock_write):
+    writer = _writer()
+    writer.write(page)
+    writer.close()
+    writer.write(page)
+    writer.close()
+    assert mock_write.call_count == 2
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_write_on_success(mock_write):
+    writer = _writer()
+    on_success = MagicMock()
+    writer.write(page, on_success=on_success)
+    writer.close()
+    assert on_success.call_count == 1
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write', MagicMock(side_effect=Exception('Test')))
+def test_write_on_success_not_called_when_dropped():
+    writer = _writer(max_retries=0)
+    on_success = MagicMock()
+    on_failure = MagicMock()
+    writer.write(page, on_success=on_success, on_failure=on_failure)
+    writer.close()
+    assert on_success.call_count == 0
+    assert str(on_failure.call_args.args[0]) == 'Test'
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write', MagicMock(side_effect=[Exception('Test'), None, None]))
+def test_write_tracker():
+    writer = _writer(max_retries=0, batch_size=2)
+    tracker = WriteTracker()
+    on_success = MagicMock()
+    tracker.write(writer, page, 1612137600000)
+    assert tracker.wait() == 1612137600000
+    tracker.write(writer, page, 1612137660000, on_success=on_success)
+    # The earliest dropped position is kept, pages after it do not move checkpoints past the hole.
+    assert tracker.wait() == 1612137600000
+    assert on_success.call_count == 0
+    assert WriteTracker().wait() is None
+    writer.close()
+
+
+def test_write_tracker_waits_for_earlier_pages():
+    writer = MagicMock()
+    tracker = WriteTracker()
+    first, second = MagicMock(), MagicMock()
+    tracker.write(writer, page, 1612137600000, on_success=first)
+    tracker.write(writer, page, 1612137660000, on_success=second)
+    written = [call.kwargs['on_success'] for call in writer.write.call_args_list]
+    # The later page is written first, its callback waits for the earlier one.
+    written[1]()
+    assert second.call_count == 0
+    written[0]()
+    assert first.call_count == second.call_count == 1
+    assert tracker.wait() is None
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write', MagicMock(side_effect=Exception('Test')))
+def test_write_spools_failed_batches(tmp_path):
+    on_success = MagicMock()
+    writer = _writer(max_retries=1, spool=Spool(str(tmp_path)), drain_interval=60)
+    writer.write(page, on_success=on_success)
+    writer.flush()
+    assert writer.spool.size == len(page) + 1
+    # Kept for the next run when InfluxDB is still down.
+    writer.close()
+    assert writer.spool.size == len(page) + 1
+    on_success.assert_called_once_with()
+
+
+@patch('influxdb_client.client.write_api.WriteApi.write')
+def test_write_drains_spool_first(mock_write, tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(page)
+    newer = page.replace(b'close=1.0', b'close=2.0')
+    writer = _writer(spool=spool, drain_interval=0.01)
+    writer.write(newer)
+    writer.close()
+    # The newer batch is spooled behind the older one, so it is written after it.
+    records = [call.kwargs['record'] for call in mock_write.call_args_list]
+    assert b'\n'.join(records) == page + b'\n' + newer
+    assert spool.empty()
+
+
+def test_writer_options_replace():
+    options = WriterOptions(batch_size=10, flush_interval=1.0)
+    replaced = options.replace(flush_interval=0.05)
+    assert (replaced.batch_size, replaced.flush_interval) == (10, 0.05)
+    assert options.flush_interval == 1.0